@@ -1,22 +1,57 @@
+import time
+
+IMPORT_START = time.perf_counter()
+
 from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from app import main
 from contextlib import asynccontextmanager
-from inference.load_model import get_predictor
-import time
+from inference.load_model import get_detection_cache
+import inference.load_model as load_model
+from app.executor import get_executor
+from app.uploads import RequestSizeLimit
+from app import jobs
+import threading
+import utility.config as config
 import utility.utils as utils
+from utility import metrics
 
 logger = utils.get_logger(__name__)
 
+def warm_up_predictor(start_time: float):
+    """
+    Runs the warm-up passes while the service already answers liveness checks;
+    `/inference/ready` reports ready once they are done.
+    """
+    try:
+        load_model.warm_up()
+    except Exception as e:
+        load_model.startup_error = str(e)
+        logger.error(f"[Startup] Model warm-up failed: {e}")
+        return
+    breakdown = ", ".join(f"{name[:-2]} {seconds:.2f}s" for name, seconds in load_model.startup_timings.items())
+    logger.info(f"[Startup] Model predictor ready in {time.perf_counter() - start_time:.2f} seconds ({breakdown}).")
+
 # Load the predictor at startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("[Startup] Initializing model predictor...")
+    load_model.startup_timings["imports_s"] = round(time.perf_counter() - IMPORT_START, 3)
     start_time = time.perf_counter()
-    get_predictor()
-    end_time = time.perf_counter()
-    logger.info(f"[Startup] Model predictor initialized in {end_time - start_time:.2f} seconds.")
+    # starts the inference worker processes, if any, before request threads exist
+    load_model.load()
+    logger.info(f"[Startup] Model predictor initialized in {time.perf_counter() - start_time:.2f} seconds.")
+    threading.Thread(target=warm_up_predictor, args=(start_time,), name="warm-up", daemon=True).start()
+    get_detection_cache()
+    get_executor()
+    # only with JOB_WORKERS set: job workers then run PDF jobs on the model serving interactive requests
+    jobs.start_workers(jobs.run_job)
     yield
+    jobs.stop_workers()
+    get_executor().shutdown()
+    if load_model.worker_pool is not None:
+        load_model.worker_pool.shutdown()
 
 
 # Initialize FastAPI app
@@ -40,6 +75,9 @@ app = FastAPI(
     swagger_ui_parameters={"defaultModelsExpandDepth": -1}  
 )
 
+# oversized request bodies are rejected before they are read
+app.add_middleware(RequestSizeLimit, max_bytes=config.REQUEST_MAX_BYTES)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -50,4 +88,13 @@ app.add_middleware(
 )
 
 # adding a base route and including the main router
-app.include_router(main.app, prefix="/inference", tags=["Image Detection API"])
\ No newline at end of file
+app.include_router(main.app, prefix="/inference", tags=["Image Detection API"])
+
+# not async: the job gauge queries the job database, which must not block the event loop
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    """
+    Per-stage latency histograms and page/detection/byte counters in the Prometheus text format.
+    ** Internal Use Only **
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import utility.config as config
+import utility.utils as utils
+
+# Command line entry point, `image-extract`.
+#
+#   image-extract batch /data/pages /data/archive.tar.gz --output /data/out --processes 8
+#
+# `batch` extracts drawings offline from directories and tar/zip archives of images and PDFs,
+# without going through HTTP. Every source (an image or a PDF) is processed as a whole by one
+# of a pool of processes, each holding its own model: PDF pages are rendered, run through the
+# model and their detected regions cropped and encoded while the next pages render.
+#
+# The output directory holds:
+#   - detections.jsonl : one line per source, written once the source is complete:
+#       {"source": ..., "results": [...], "crops": [...]} for images,
+#       {"source": ..., "pages": [{"page": ..., "results": [...], "crops": [...]}, ...]} for PDFs,
+#       {"source": ..., "error": ...} for sources that could not be processed
+#   - crops/ : the detected regions, in the paths listed by "crops"
+# Sources already in detections.jsonl are skipped, so an interrupted run resumes where it
+# stopped when started again with the same output directory. Sources are identified by their
+# absolute path, and by `<archive path>::<member name>` inside archives.
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+DETECTIONS_FNAME = "detections.jsonl"
+
+options = None
+
+
+def is_source(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS + (".pdf",))
+
+def iter_sources(inputs: list, skip: set):
+    """
+    Walks the input directories, archives and files.
+
+    Yields:
+        tuple: (source key, path on disk or None, content of archive members or None)
+    """
+    for input_path in inputs:
+        input_path = os.path.abspath(input_path)
+        if os.path.isdir(input_path):
+            for dirpath, dirnames, fnames in os.walk(input_path):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    yield from _iter_file(os.path.join(dirpath, fname), skip)
+        else:
+            yield from _iter_file(input_path, skip)
+
+def _iter_file(path: str, skip: set):
+    name = path.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                key = f"{path}::{info.filename}"
+                if not info.is_dir() and is_source(info.filename) and key not in skip:
+                    yield key, None, archive.read(info)
+    elif name.endswith(ARCHIVE_EXTENSIONS):
+        # members are read in order, compressed tar archives cannot be read at random
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                key = f"{path}::{member.name}"
+                if member.isfile() and is_source(member.name) and key not in skip:
+                    yield key, None, archive.extractfile(member).read()
+    elif is_source(path) and path not in skip:
+        yield path, path, None
+
+def read_checkpoint(detections_path: str, retry_failed: bool) -> set:
+    """
+    Returns the sources already in `detections_path`, after dropping a last line left
+    incomplete by an interrupted run.
+    """
+    if not os.path.exists(detections_path):
+        return set()
+    done = set()
+    complete_size = 0
+    with open(detections_path, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break
+            complete_size += len(line)
+            record = json.loads(line)
+            if not (retry_failed and "error" in record):
+                done.add(record["source"])
+    if complete_size < os.path.getsize(detections_path):
+        with open(detections_path, "r+b") as fp:
+            fp.truncate(complete_size)
+    return done
+
+
+def _init_worker(worker_options: dict, num_threads: int):
+    """
+    Loads the model once per batch process.
+    """
+    global options
+    import torch
+    from inference import load_model
+
+    options = worker_options
+    config.INFERENCE_WORKERS = 0
+    config.DETECTION_CACHE_ENABLED = False
+    torch.set_num_threads(num_threads)
+    if not options["verbose"]:
+        for name in ("inference.batching", "inference.inference", "inference.load_model", "inference.pdf_pipeline", "utility.pdf"):
+            utils.get_logger(name).setLevel(logging.ERROR)
+    load_model.load_and_warm_up()
+
+def _save_crops(key: str, page: int, crops: list) -> list:
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    crop_dir = os.path.join("crops", digest[:2], digest)
+    os.makedirs(os.path.join(options["output"], crop_dir), exist_ok=True)
+    extension = utils.ENCODE_EXTENSIONS[options["image_format"]]
+    paths = []
+    for j, crop in enumerate(crops):
+        path = os.path.join(crop_dir, f"page_{page}_{j}{extension}" if page else f"{j}{extension}")
+        with open(os.path.join(options["output"], path), "wb") as fp:
+            fp.write(utils.encode_image(crop, options["image_format"], options["quality"]))
+        paths.append(path)
+    return paths
+
+def _process_image(key: str, image) -> dict:
+    from inference import inference
+
+    results = inference.inference_image(image, draw=False) or []
+    crops = _save_crops(key, 0, utils.get_images(image, results)) if options["crops"] else []
+    return {"source": key, "results": results, "crops": crops}
+
+def _process_pdf(key: str, pdf_path: str) -> dict:
+    from inference import pdf_pipeline
+
+    pages = []
+    for page, image, scale, results in pdf_pipeline.iter_pdf_detections(pdf_path, options["dpi"]):
+        results = results or []
+        crops = []
+        if results and options["crops"]:
+            crops = _save_crops(key, page, pdf_pipeline.page_crops(pdf_path, page, image, scale, results, options["dpi"]))
+        pages.append({"page": page, "results": results, "crops": crops})
+    return {"source": key, "pages": pages}
+
+def process_source(source: tuple) -> dict:
+    """
+    Runs one source through the model in a batch process.
+
+    Returns:
+        dict: The line of the source in detections.jsonl.
+    """
+    import utility.pdf as pdf_utils
+
+    key, path, data = source
+    try:
+        if key.lower().endswith(".pdf"):
+            if path is not None:
+                return _process_pdf(key, path)
+            with pdf_utils.spooled_pdf(data) as pdf_path:
+                return _process_pdf(key, pdf_path)
+        image = utils.read_image(path) if path is not None else utils.decode_image(data)
+        return _process_image(key, image)
+    except Exception as e:
+        return {"source": key, "error": f"{type(e).__name__}: {e}"}
+
+
+class Progress:
+    """
+    Counts processed sources, pages and crops and prints the throughput every `interval` seconds.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+        self.sources = self.pages = self.crops = self.errors = 0
+
+    def add(self, record: dict):
+        self.sources += 1
+        if "error" in record:
+            self.errors += 1
+            print(f"Failed {record['source']}: {record['error']}", file=sys.stderr, flush=True)
+            return
+        pages = record.get("pages", [record])
+        self.pages += len(pages)
+        self.crops += sum(len(page["crops"]) for page in pages)
+        if time.perf_counter() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.perf_counter()
+        elapsed = max(self.last_report - self.start_time, 1e-9)
+        print(
+            f"{self.sources} sources, {self.pages} pages, {self.crops} crops, {self.errors} errors "
+            f"in {elapsed:.0f}s: {self.sources / elapsed:.2f} sources/s, {self.pages / elapsed:.2f} pages/s",
+            flush=True,
+        )
+
+def run_batch(args) -> int:
+    try:
+        utils.encode_params(args.image_format, args.quality)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if not config.PDF_MIN_DPI <= args.dpi <= config.PDF_MAX_DPI:
+        print(f"Error: --dpi must be between {config.PDF_MIN_DPI} and {config.PDF_MAX_DPI}", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    detections_path = os.path.join(args.output, DETECTIONS_FNAME)
+    done = read_checkpoint(detections_path, args.retry_failed)
+    if done:
+        print(f"Resuming: {len(done)} sources already in {detections_path}", flush=True)
+
+    worker_options = {
+        "output": os.path.abspath(args.output),
+        "crops": args.mode == "extract",
+        "dpi": args.dpi,
+        "image_format": args.image_format,
+        "quality": args.quality,
+        "verbose": args.verbose,
+    }
+    num_threads = args.threads or max(1, (os.cpu_count() or 1) // args.processes)
+    progress = Progress(args.report_interval)
+    with open(detections_path, "a") as fp, ProcessPoolExecutor(
+        args.processes, initializer=_init_worker, initargs=(worker_options, num_threads)
+    ) as pool:
+
+        def write(finished):
+            for future in finished:
+                record = future.result()
+                # a source is only done once its line is complete
+                fp.write(json.dumps(record) + "\n")
+                fp.flush()
+                progress.add(record)
+
+        # sources are read lazily, with a few per process queued so that archive members are not all held in memory
+        pending = set()
+        for source in iter_sources(args.inputs, done):
+            pending.add(pool.submit(process_source, source))
+            if len(pending) >= 2 * args.processes:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write(finished)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write(finished)
+    progress.report()
+    return 1 if progress.errors else 0
+
+def main():
+    parser = argparse.ArgumentParser(prog="image-extract", description="Detect and extract drawings from images and PDFs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser(
+        "batch",
+        help="Process directories and tar/zip archives of images and PDFs offline",
+        description="Process directories and tar/zip archives of images and PDFs with a pool of processes. "
+        "Detections are appended to OUTPUT/detections.jsonl, one line per source, and runs resume where they stopped.",
+    )
+    batch.add_argument("inputs", nargs="+", help="Directories, archives, images or PDFs")
+    batch.add_argument("-o", "--output", required=True, help="Output directory, also holding the progress of the run")
+    batch.add_argument("--mode", default="extract", choices=["bbox", "extract"], help="Only detect, or also save the detected regions")
+    batch.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Processes, each with its own model")
+    batch.add_argument("--threads", type=int, default=0, help="Torch threads per process, 0 shares the cores between processes")
+    batch.add_argument("--dpi", type=int, default=config.PDF_DPI, help="Resolution of the boxes and regions of PDF pages")
+    batch.add_argument("--format", dest="image_format", default="png", choices=config.ENCODE_FORMATS, help="Format of the saved regions")
+    batch.add_argument("--quality", type=int, help="PNG compression level (0-9) or JPEG quality (1-100)")
+    batch.add_argument("--retry-failed", action="store_true", help="Process sources that failed in earlier runs again; the last line of a source wins")
+    batch.add_argument("--report-interval", type=float, default=10, help="Seconds between throughput reports")
+    batch.add_argument("--verbose", action="store_true", help="Log every page")
+    args = parser.parse_args()
+
+    if args.command == "batch":
+        sys.exit(run_batch(args))
+
+if __name__ == "__main__":
+    main()
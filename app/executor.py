@@ -0,0 +1,263 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import utility.config as config
+import utility.utils as utils
+from utility import metrics
+
+logger = utils.get_logger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue is past its depth limit."""
+
+
+class InferenceExecutor:
+    """
+    Bounded executor that runs blocking CPU work (decoding, inference, zip encoding)
+    off the event loop and rejects new work once too many jobs are waiting.
+    """
+
+    def __init__(self, max_workers: int, max_queue_depth: int):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._started = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._last_wait = 0.0
+
+    def _admit(self):
+        with self._lock:
+            if self._queued >= self.max_queue_depth:
+                self._rejected += 1
+                raise QueueFullError(f"Inference queue is full ({self._queued} waiting)")
+            self._queued += 1
+
+    def _wrap(self, fn, submitted_at: float):
+        def job(*args):
+            wait = time.perf_counter() - submitted_at
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._started += 1
+                self._total_wait += wait
+                self._last_wait = wait
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+        return job
+
+    async def run(self, fn, *args):
+        """
+        Run `fn(*args)` on the executor and await its result.
+
+        Raises:
+            QueueFullError: If the queue is past `max_queue_depth`.
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        job = self._wrap(fn, time.perf_counter())
+        return await loop.run_in_executor(self._pool, job, *args)
+
+    def iterate(self, fn, *args):
+        """
+        Run the generator function `fn(*args)` on the executor and return an async
+        iterator over the items it yields. The producer blocks while the consumer
+        is `config.STREAM_BUFFER_SIZE` items behind.
+
+        Raises:
+            QueueFullError: If the queue is past `max_queue_depth`.
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        buffer = asyncio.Queue(maxsize=config.STREAM_BUFFER_SIZE)
+        done = object()
+        cancelled = threading.Event()
+
+        def put(entry) -> bool:
+            pending = asyncio.run_coroutine_threadsafe(buffer.put(entry), loop)
+            while True:
+                try:
+                    pending.result(timeout=0.1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if cancelled.is_set():
+                        pending.cancel()
+                        return False
+
+        def produce():
+            try:
+                for item in fn(*args):
+                    if cancelled.is_set() or not put((item, None)):
+                        return
+            except Exception as e:
+                put((done, e))
+            else:
+                put((done, None))
+
+        loop.run_in_executor(self._pool, self._wrap(produce, time.perf_counter()))
+
+        async def consume():
+            try:
+                while True:
+                    item, error = await buffer.get()
+                    if error is not None:
+                        raise error
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                # stops the producer if the client went away mid-stream
+                cancelled.set()
+
+        return consume()
+
+    def stats(self) -> dict:
+        """
+        Returns the current queue depth and wait times.
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "running": self._running,
+                "max_workers": self.max_workers,
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "last_wait_ms": round(self._last_wait * 1000, 2),
+                "avg_wait_ms": round(self._total_wait * 1000 / self._started, 2) if self._started else 0.0,
+            }
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return self._queued >= self.max_queue_depth
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class PixelBudget:
+    """
+    Bounds the pixels decoded and rendered by the requests in process at once, so that a few
+    large PDFs cannot exhaust the memory of the replica. Requests that do not fit wait in
+    arrival order, at most `max_waiting` of them and for at most `max_wait` seconds, and are
+    then rejected. A request larger than the whole budget is admitted once nothing else is.
+    """
+
+    def __init__(self, max_pixels: int, max_wait: float, max_waiting: int):
+        self.max_pixels = max_pixels
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._admitted = 0
+        self._waiting = deque()
+        self._rejected = 0
+
+    def _grant(self):
+        """
+        Reserve the pixels of the waiters at the head of the line that fit, and wake them up.
+        Called with the lock held.
+        """
+        while self._waiting:
+            pixels, loop, granted = self._waiting[0]
+            if self._admitted and self._in_use + pixels > self.max_pixels:
+                return
+            self._waiting.popleft()
+            self._in_use += pixels
+            self._admitted += 1
+            loop.call_soon_threadsafe(granted.set)
+
+    async def acquire(self, pixels: int):
+        """
+        Wait until `pixels` fit in the budget and reserve them, see `release`.
+
+        Raises:
+            QueueFullError: If too many requests are waiting already, or if the budget did not
+                free up within `max_wait` seconds.
+        """
+        waiter = (pixels, asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if len(self._waiting) >= self.max_waiting:
+                self._rejected += 1
+                raise QueueFullError(f"Too many requests waiting for pixel budget ({len(self._waiting)} waiting)")
+            self._waiting.append(waiter)
+            self._grant()
+        try:
+            await asyncio.wait_for(waiter[2].wait(), timeout=self.max_wait)
+        except BaseException as e:
+            with self._lock:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                    # the requests behind may fit now
+                    self._grant()
+                    if isinstance(e, asyncio.TimeoutError):
+                        self._rejected += 1
+                        raise QueueFullError(f"No pixel budget for {pixels} pixels within {self.max_wait}s")
+                    raise
+            # granted as the wait ended
+            if not isinstance(e, asyncio.TimeoutError):
+                self.release(pixels)
+                raise
+
+    def release(self, pixels: int):
+        with self._lock:
+            self._in_use -= pixels
+            self._admitted -= 1
+            self._grant()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pixels_in_use": self._in_use,
+                "max_pixels": self.max_pixels,
+                "admitted": self._admitted,
+                "waiting": len(self._waiting),
+                "rejected": self._rejected,
+            }
+
+
+executor = None
+pixel_budget = None
+
+def get_executor() -> InferenceExecutor:
+    """
+    Returns the process-wide inference executor, creating it on first use.
+    """
+    global executor
+    if executor is None:
+        executor = InferenceExecutor(
+            max_workers=config.EXECUTOR_MAX_WORKERS,
+            max_queue_depth=config.EXECUTOR_MAX_QUEUE_DEPTH,
+        )
+        logger.info(f"[Executor] Started with {config.EXECUTOR_MAX_WORKERS} workers, queue depth limit {config.EXECUTOR_MAX_QUEUE_DEPTH}")
+    return executor
+
+def get_pixel_budget() -> PixelBudget:
+    """
+    Returns the process-wide pixel budget of the `/image` and `/pdf` endpoints, creating it on first use.
+    """
+    global pixel_budget
+    if pixel_budget is None:
+        pixel_budget = PixelBudget(
+            max_pixels=config.PROCESS_MAX_PIXELS,
+            max_wait=config.ADMISSION_MAX_WAIT,
+            max_waiting=config.EXECUTOR_MAX_QUEUE_DEPTH,
+        )
+    return pixel_budget
+
+metrics.Gauge("imgextract_queue_depth", "Jobs waiting for an executor thread", lambda: get_executor().stats()["queue_depth"])
+metrics.Gauge("imgextract_running", "Jobs running on executor threads", lambda: get_executor().stats()["running"])
+metrics.Gauge("imgextract_pixels_in_use", "Pixels reserved by the admitted requests", lambda: get_pixel_budget().stats()["pixels_in_use"])
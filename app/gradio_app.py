@@ -1,82 +1,128 @@
 import gradio as gr
-from inference.load_model import get_predictor
-from PIL import Image
-import zipfile
-import io
+import atexit
 import os
-import numpy as np
+import shutil
 import tempfile
-import atexit
-import time
 import threading
+import time
+from collections import deque
+import cv2
+import utility.config as config
+import utility.utils as utils
+from inference import inference
+from inference.load_model import load_and_warm_up
+
+logger = utils.get_logger(__name__)
+
+# Gradio front end of the extraction. Uploads are queued by Gradio and processed in batches
+# through the same batched, cached inference path as the FastAPI service.
+
+
+class ResultStore:
+    """
+    Directory of result files bounded in total size and age.
+
+    Files are evicted oldest first whenever a new one is stored, once they are older than
+    `max_age` or the store is larger than `max_bytes`. Files younger than `min_age` are never
+    evicted, so a download in progress is not cut off; under a burst the store can briefly
+    exceed `max_bytes` by the files of the last `min_age` seconds.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float, min_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self._entries = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, data: bytes, suffix: str) -> str:
+        """
+        Store a result file.
+
+        Returns:
+            str: Path to the file.
+        """
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        now = time.monotonic()
+        with self._lock:
+            self._entries.append((path, len(data), now))
+            self._bytes += len(data)
+            self._evict(now)
+        return path
+
+    def _evict(self, now: float):
+        while self._entries:
+            path, size, created_at = self._entries[0]
+            age = now - created_at
+            if age < self.min_age or (age < self.max_age and self._bytes <= self.max_bytes):
+                break
+            self._entries.popleft()
+            self._bytes -= size
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.warning(f"[Gradio] Failed to delete result {path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+result_store = ResultStore(
+    config.GRADIO_RESULT_DIR or tempfile.mkdtemp(prefix="imgextract-gradio-"),
+    max_bytes=config.GRADIO_RESULT_MAX_BYTES,
+    max_age=config.GRADIO_RESULT_MAX_AGE,
+    min_age=config.GRADIO_RESULT_MIN_AGE,
+)
+atexit.register(result_store.clear)
+
+def extract_and_zip(images: list) -> list:
+    """
+    Extracts the detected regions of a batch of uploads, one zip file per upload.
+
+    Args:
+        images (list): RGB images of the uploads batched together by Gradio, None for an empty submit.
 
-predictor = get_predictor()
-
-temp_files = []
-temp_files_lock = threading.Lock()
-
-def cleanup_temp_files():
-    """Clean up all temporary files created by this app"""
-    with temp_files_lock:
-        files_to_remove = temp_files.copy()
-        temp_files.clear()
-    
-    for temp_file in files_to_remove:
-        try:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-                print(f"Cleaned up temp file: {temp_file}")
-        except Exception as e:
-            print(f"Failed to delete temp file {temp_file}: {e}")
-
-def periodic_cleanup():
-    """Periodically clean up old temporary files"""
-    while True:
-        time.sleep(300)  # Clean up every 5 minutes
-        cleanup_temp_files()
-
-atexit.register(cleanup_temp_files)
-
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
-
-def extract_and_zip(image: Image.Image):
-    image_np = np.array(image)
-    results = predictor(image_np) 
-    
-    pil_images = []
-    if 'instances' in results:
-        instances = results['instances']
-        boxes = instances.pred_boxes.tensor.cpu().numpy()
-        
-        for i, box in enumerate(boxes):
-            x1, y1, x2, y2 = map(int, box)
-            region = image.crop((x1, y1, x2, y2))
-            pil_images.append(region)
-
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    temp_file_path = temp_file.name
-    temp_file.close()
-    
-    with temp_files_lock:
-        temp_files.append(temp_file_path)
-    
-    with zipfile.ZipFile(temp_file_path, "w") as zf:
-        for i, img in enumerate(pil_images):
-            img_io = io.BytesIO()
-            img.save(img_io, format="PNG")
-            zf.writestr(f"image_{i}.png", img_io.getvalue())
-    
-    return temp_file_path
+    Returns:
+        list: The list of zip file paths, None for empty submits, as the single output of the batch.
+    """
+    # an empty submit gets no file, instead of failing the uploads batched with it
+    paths = [None] * len(images)
+    indices = [i for i, image in enumerate(images) if image is not None]
+    images = [cv2.cvtColor(images[i], cv2.COLOR_RGB2BGR) for i in indices]
+    logger.info(f"[Gradio] Processing a batch of {len(images)} images")
+    for index, image, results in zip(indices, images, inference.inference_images(images, draw=False)):
+        crops = utils.get_images(image, results or [])
+        data = b"".join(utils.stream_zip((f"image_{i}.png", crop) for i, crop in enumerate(crops)))
+        paths[index] = result_store.put(data, ".zip")
+    return [paths]
 
 demo = gr.Interface(
     fn=extract_and_zip,
-    inputs=gr.Image(type="pil", label="Upload Image"),
+    inputs=gr.Image(type="numpy", image_mode="RGB", label="Upload Image"),
     outputs=gr.File(label="Download ZIP of Extracted Images"),
     title="Image Extractor",
     description="Upload a image and download all detected image regions as a zip file.",
-    allow_flagging="never"
+    flagging_mode="never",
+    batch=True,
+    max_batch_size=config.GRADIO_MAX_BATCH_SIZE,
+    concurrency_limit=config.GRADIO_CONCURRENCY,
+    # Gradio keeps its own copy of every returned file, bounded by age as well
+    delete_cache=(config.GRADIO_RESULT_MAX_AGE, config.GRADIO_RESULT_MAX_AGE),
 )
+demo.queue(max_size=config.GRADIO_QUEUE_SIZE)
 
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    load_and_warm_up()
+    demo.launch()
@@ -0,0 +1,438 @@
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import utility.config as config
+import utility.pdf as pdf_utils
+import utility.utils as utils
+from utility import metrics
+from app.executor import QueueFullError
+from inference import pdf_pipeline
+
+logger = utils.get_logger(__name__)
+
+# This module runs long PDF jobs in the background, outside of the HTTP request.
+# Jobs live in a SQLite database next to their uploaded PDF and results in JOB_SPOOL_DIR,
+# so they outlive API restarts and are worked on by any number of `python -m app.jobs` processes
+# sharing the spool directory. The API process only runs jobs itself if JOB_WORKERS is set: its job
+# threads share the predictor and batch queue with interactive requests, and a long PDF would then
+# delay them.
+# A running job records a heartbeat every JOB_HEARTBEAT_INTERVAL seconds from a thread of its
+# worker, however long its pages take, and with every page; jobs whose worker stopped sending
+# heartbeats are requeued.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobCancelled(Exception):
+    """Raised in a worker when its job was deleted or handed to another worker."""
+
+
+class JobQueue:
+    """
+    Persistent queue of PDF jobs backed by SQLite and a spool directory.
+    """
+
+    def __init__(self, spool_dir: str):
+        self.spool_dir = spool_dir
+        self.db_path = os.path.join(spool_dir, "jobs.sqlite")
+        os.makedirs(spool_dir, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT,
+                    mode TEXT NOT NULL,
+                    dpi INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    pages_total INTEGER,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    heartbeat_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # one short-lived autocommit connection per operation, threads and processes are serialized by SQLite's locking
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, job_id)
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir(job_id), "input.pdf")
+
+    def result_path(self, job_id: str, mode: str) -> str:
+        return os.path.join(self.job_dir(job_id), "results.json" if mode == "bbox" else "results.zip")
+
+    def submit(self, pdf_path: str, filename: str, mode: str, dpi: int) -> str:
+        """
+        Move a spooled PDF into the job spool and queue a job for it.
+
+        Args:
+            pdf_path (str): Path to the PDF file, moved by the call.
+            filename (str): Name of the uploaded file.
+            mode (str): "bbox", "draw" or "extract".
+            dpi (int): Resolution pages are rendered at.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFullError: If `config.JOB_MAX_QUEUED` jobs are already waiting.
+        """
+        if self.counts().get(QUEUED, 0) >= config.JOB_MAX_QUEUED:
+            raise QueueFullError(f"Job queue is full ({config.JOB_MAX_QUEUED} waiting)")
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        shutil.move(pdf_path, self.input_path(job_id))
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, filename, mode, dpi, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, filename, mode, dpi, QUEUED, time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        """
+        Returns:
+            dict: Status, progress and timings of the job, None if it does not exist.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    @staticmethod
+    def _describe(row: sqlite3.Row) -> dict:
+        now = time.time()
+        started_at, finished_at = row["started_at"], row["finished_at"]
+        running = (finished_at or now) - started_at if started_at else None
+        return {
+            "job_id": row["id"],
+            "filename": row["filename"],
+            "mode": row["mode"],
+            "dpi": row["dpi"],
+            "status": row["status"],
+            "pages_total": row["pages_total"],
+            "pages_done": row["pages_done"],
+            "attempts": row["attempts"],
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "timings": {
+                "queued_s": round((started_at or now) - row["created_at"], 3),
+                "running_s": round(running, 3) if running is not None else None,
+                "per_page_s": round(running / row["pages_done"], 3) if running and row["pages_done"] else None,
+            },
+        }
+
+    def claim(self, worker: str) -> dict:
+        """
+        Take the oldest queued job, requeueing the running jobs of workers that stopped first.
+
+        Args:
+            worker (str): Id of the claiming worker.
+
+        Returns:
+            dict: The claimed job, None if no job is waiting.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            # takes the write lock up front, so two workers never claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                stale = now - config.JOB_STALE_AFTER
+                connection.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = 'Job worker stopped responding' "
+                    "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                    (FAILED, now, RUNNING, stale, config.JOB_MAX_ATTEMPTS),
+                )
+                requeued = connection.execute(
+                    "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                    (QUEUED, RUNNING, stale),
+                ).rowcount
+                if requeued:
+                    logger.warning(f"[Jobs] Requeued {requeued} jobs of stopped workers")
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, pages_done = 0, "
+                        "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                        (RUNNING, worker, now, now, row["id"]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            if row is None:
+                return None
+            return self._describe(connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def progress(self, job_id: str, worker: str, pages_done: int, pages_total: int = None):
+        """
+        Record the progress of a running job, which also serves as its heartbeat.
+
+        Raises:
+            JobCancelled: If the job was deleted or requeued to another worker.
+        """
+        with self._connect() as connection:
+            updated = connection.execute(
+                "UPDATE jobs SET pages_done = ?, pages_total = COALESCE(?, pages_total), heartbeat_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (pages_done, pages_total, time.time(), job_id, worker, RUNNING),
+            ).rowcount
+        if not updated:
+            raise JobCancelled(f"Job {job_id} is no longer assigned to worker {worker}")
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """
+        Record that a running job's worker is alive.
+
+        Returns:
+            bool: False if the job was deleted or requeued to another worker.
+        """
+        with self._connect() as connection:
+            return bool(connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time(), job_id, worker, RUNNING),
+            ).rowcount)
+
+    def finish(self, job_id: str, worker: str, error: str = None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (FAILED if error else DONE, error, time.time(), job_id, worker, RUNNING),
+            )
+
+    def release(self, job_id: str, worker: str):
+        """
+        Put a running job back in the queue, e.g. when its worker shuts down.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - 1 WHERE id = ? AND worker = ? AND status = ?",
+                (QUEUED, job_id, worker, RUNNING),
+            )
+
+    def delete(self, job_id: str) -> bool:
+        """
+        Delete a job and its files. A running job stops at its next page.
+
+        Returns:
+            bool: False if the job does not exist.
+        """
+        with self._connect() as connection:
+            deleted = connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return bool(deleted)
+
+    def purge(self) -> int:
+        """
+        Delete the jobs that finished more than `config.JOB_RETENTION` seconds ago.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - config.JOB_RETENTION),
+            ).fetchall()
+        for row in rows:
+            self.delete(row["id"])
+        return len(rows)
+
+    def counts(self) -> dict:
+        """
+        Returns the number of jobs per status.
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobWorker:
+    """
+    Thread that runs queued jobs one at a time through `process(queue, job, progress)`.
+    `progress(pages_done, pages_total=None)` must be called with every processed page.
+    """
+
+    def __init__(self, queue: JobQueue, process, poll_interval: float = config.JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.process = process
+        self.poll_interval = poll_interval
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=f"job-worker-{self.worker_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_purge > 60:
+                    self.queue.purge()
+                    last_purge = time.monotonic()
+                job = self.queue.claim(self.worker_id)
+            except sqlite3.Error as e:
+                logger.error(f"[Jobs] Failed to read the job queue: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        job_id = job["job_id"]
+        logger.info(f"[Jobs] Worker {self.worker_id} started job {job_id} ({job['filename']}, mode '{job['mode']}')")
+
+        running = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            # keeps the job claimed while a single page takes longer than JOB_STALE_AFTER
+            while not running.wait(config.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    if not self.queue.heartbeat(job_id, self.worker_id):
+                        lost.set()
+                        return
+                except sqlite3.Error as e:
+                    logger.warning(f"[Jobs] Failed to record the heartbeat of job {job_id}: {e}")
+
+        def progress(pages_done: int, pages_total: int = None):
+            if self._stop.is_set():
+                raise JobCancelled(f"Worker {self.worker_id} is shutting down")
+            if lost.is_set():
+                raise JobCancelled(f"Job {job_id} is no longer assigned to worker {self.worker_id}")
+            self.queue.progress(job_id, self.worker_id, pages_done, pages_total)
+
+        heartbeat_thread = threading.Thread(target=heartbeat, name=f"job-heartbeat-{job_id[:8]}", daemon=True)
+        heartbeat_thread.start()
+        try:
+            self.process(self.queue, job, progress)
+        except JobCancelled as e:
+            logger.info(f"[Jobs] Stopped job {job_id}: {e}")
+            if self._stop.is_set():
+                self.queue.release(job_id, self.worker_id)
+            return
+        except Exception as e:
+            logger.error(f"[Jobs] Job {job_id} failed: {e}")
+            self.queue.finish(job_id, self.worker_id, error=str(e) or type(e).__name__)
+            return
+        finally:
+            running.set()
+            heartbeat_thread.join()
+        self.queue.finish(job_id, self.worker_id)
+        logger.info(f"[Jobs] Finished job {job_id}")
+
+
+def run_job(queue: JobQueue, job: dict, progress):
+    """
+    Processes a PDF job and writes its results to the job's spool directory. Runs on a job worker.
+    """
+    job_id, mode, dpi = job["job_id"], job["mode"], job["dpi"]
+    input_path = queue.input_path(job_id)
+    result_path = queue.result_path(job_id, mode)
+    progress(0, pdf_utils.get_page_count(input_path))
+    tmp_path = f"{result_path}.tmp"
+    with open(tmp_path, "wb") as fp:
+        if mode == "bbox":
+            results = [
+                {"page": page, "results": result if result else []}
+                for page, _, _, result in pdf_pipeline.iter_pdf_detections(input_path, dpi, on_page=progress)
+            ]
+            fp.write(json.dumps(results).encode())
+        else:
+            for chunk in utils.stream_zip(pdf_pipeline.iter_pdf_entries(input_path, mode, dpi, on_page=progress)):
+                fp.write(chunk)
+    # results only appear once complete
+    os.replace(tmp_path, result_path)
+
+
+job_queue = None
+workers = []
+
+def get_job_queue() -> JobQueue:
+    """
+    Returns the process-wide job queue, creating it on first use.
+    """
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(config.JOB_SPOOL_DIR)
+        logger.info(f"[Jobs] Spooling jobs in {config.JOB_SPOOL_DIR}")
+    return job_queue
+
+def start_workers(process, num_workers: int = config.JOB_WORKERS):
+    """
+    Start `num_workers` job worker threads in this process.
+    """
+    for _ in range(num_workers):
+        worker = JobWorker(get_job_queue(), process)
+        worker.start()
+        workers.append(worker)
+    if num_workers:
+        logger.info(f"[Jobs] Started {num_workers} job workers")
+    else:
+        logger.info("[Jobs] No job workers in this process, jobs are run by `python -m app.jobs`")
+
+def stop_workers():
+    """
+    Stop the job worker threads of this process. Their running jobs go back to the queue.
+    """
+    for worker in workers:
+        worker.stop()
+    workers.clear()
+
+metrics.Gauge("imgextract_jobs_queued", "PDF jobs waiting for a job worker", lambda: get_job_queue().counts().get(QUEUED, 0))
+
+
+def main():
+    """
+    Dedicated job worker process, e.g. `JOB_WORKERS=2 python -m app.jobs`, for
+    running batch jobs on other cores or machines than the API serving interactive requests.
+    """
+    from inference.load_model import load_and_warm_up
+
+    load_and_warm_up()
+    start_workers(run_job, max(1, config.JOB_WORKERS))
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    stop_workers()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 from fastapi import APIRouter, File, HTTPException, Query, UploadFile
-from fastapi.responses import JSONResponse, StreamingResponse
-from PIL import Image
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import os
+import utility.config as config
 import utility.utils as utils
-from inference import inference
-from pdf2image import convert_from_bytes
+from utility import metrics
+from app.executor import QueueFullError, get_executor, get_pixel_budget
+from app import uploads
+from app.uploads import InvalidUploadError, UploadTooLargeError
+from app.jobs import DONE, get_job_queue
+from inference import inference, pdf_pipeline
+import inference.load_model as load_model
+from inference.load_model import get_detection_cache, get_near_duplicate_index
+from inference.prefilter import get_page_filter
 
 app = APIRouter()
 
@@ -12,15 +23,216 @@ logger = utils.get_logger(__name__)
 @app.get("/health", include_in_schema=False)
 async def health_check():
     """
-    Health check endpoint to verify if the service is running.
+    Health check endpoint to verify if the service is running (liveness), see `/ready` for readiness.
+    Does no I/O, so that a busy job database cannot fail the liveness of the service.
     ** Internal Use Only **
     """
-    return JSONResponse(content={"status": "ok"}, status_code=200)
+    cache = get_detection_cache()
+    near_duplicates = get_near_duplicate_index()
+    page_filter = get_page_filter()
+    return JSONResponse(
+        content={
+            "status": "ok",
+            "model": load_model.model_status(),
+            "queue": get_executor().stats(),
+            "pixel_budget": get_pixel_budget().stats(),
+            "cache": cache.stats() if cache else None,
+            "near_duplicates": near_duplicates.stats() if near_duplicates else None,
+            "prefilter": page_filter.stats() if page_filter else None,
+        },
+        status_code=200,
+    )
+
+@app.get("/ready", include_in_schema=False)
+async def ready_check():
+    """
+    Readiness check: responds with 503 until the model is loaded and warmed up,
+    so load balancers only route requests to replicas serving at full speed.
+    ** Internal Use Only **
+    """
+    status = load_model.model_status()
+    # the job counts are informational, readiness does not wait on a busy job database
+    try:
+        jobs = await asyncio.wait_for(run_in_threadpool(get_job_queue().counts), timeout=config.JOB_COUNTS_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"[Jobs] Job counts unavailable: {e!r}")
+        jobs = None
+    return JSONResponse(
+        content={"status": status, "startup": load_model.startup_timings, "error": load_model.startup_error, "jobs": jobs},
+        status_code=200 if status == "ready" else 503,
+    )
+
+@app.get("/load", include_in_schema=False)
+async def load_check():
+    """
+    Reports the inference queue depth and wait times.
+    Responds with 503 while the queue is full so load balancers can route around this replica.
+    ** Internal Use Only **
+    """
+    executor = get_executor()
+    status_code = 503 if executor.saturated() else 200
+    return JSONResponse(content=executor.stats(), status_code=status_code)
+
+def _queue_full(e: QueueFullError) -> HTTPException:
+    logger.warning(f"[Inference] Rejecting request: {e}")
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry later.",
+        headers={"Retry-After": str(config.EXECUTOR_RETRY_AFTER)},
+    )
+
+def _rejected_upload(e: Exception) -> HTTPException:
+    status_code = 413 if isinstance(e, UploadTooLargeError) else 400
+    logger.warning(f"[Inference] Rejecting upload ({status_code}): {e}")
+    return HTTPException(status_code=status_code, detail=str(e))
+
+async def _admit(files: list, endpoint: str, count_pixels, *args, max_files: int = None) -> uploads.Admission:
+    """
+    Spools the uploaded files to disk, prices them with `count_pixels(spooled, *args)` and waits
+    for the pixels in the process budget, see `app/uploads.py`. Nothing is decoded yet.
+
+    Raises:
+        UploadTooLargeError: If the request is past a size or pixel limit.
+        InvalidUploadError: If a file is not a readable image or PDF.
+        QueueFullError: If the pixel budget did not free up in time.
+    """
+    spooled = await uploads.spool(files, endpoint, max_files=max_files)
+    try:
+        with metrics.timer("preflight"):
+            pixels = await run_in_threadpool(count_pixels, spooled, *args)
+        uploads.check_request(pixels)
+        await get_pixel_budget().acquire(pixels)
+    except BaseException:
+        for upload in spooled:
+            upload.remove()
+        raise
+    return uploads.Admission(spooled, get_pixel_budget(), pixels)
+
+def _pdf_pixels(spooled: list, dpi: int, render_dpi: int) -> int:
+    return uploads.pdf_pixels(spooled[0], dpi, render_dpi, max_pages=config.PDF_MAX_PAGES)
+
+def _decode(path: str):
+    with metrics.timer("decode"):
+        return utils.read_image(path)
+
+def _json_response(content, endpoint: str) -> JSONResponse:
+    response = JSONResponse(content=content, status_code=200)
+    metrics.BYTES_OUT.inc(len(response.body), endpoint=endpoint)
+    return response
+
+async def _count_bytes_out(chunks, endpoint: str):
+    async for chunk in chunks:
+        metrics.BYTES_OUT.inc(len(chunk.encode() if isinstance(chunk, str) else chunk), endpoint=endpoint)
+        yield chunk
+
+def _process_images(spooled: list) -> list:
+    """
+    Decodes the uploaded images and returns their detections. Runs on the inference executor.
+    """
+    results = []
+    for upload in spooled:
+        image = _decode(upload.path)
+        logger.info(f"[Inference] Processing image: {upload.filename}")
+        result = inference.inference_image(image, draw=False)
+        results.append({"filename": upload.filename, "results": result if result else []})
+    return results
+
+def _iter_image_entries(spooled: list, mode: str):
+    """
+    Yields (filename, image) zip entries for the uploaded images in `draw` or `extract` mode.
+    """
+    for upload in spooled:
+        filename = upload.filename
+        image = _decode(upload.path)
+        logger.info(f"[Inference] Processing image: {filename}")
+        if mode == "draw":
+            # boxes are drawn on the decoded image itself
+            inference.inference_image(image, draw=True)
+            yield filename, image
+            continue
+        bbox = inference.inference_image(image, draw=False)
+        if bbox is None or not bbox:
+            logger.warning(f"[Inference] No drawings found in image: {filename}")
+            continue
+        for i, img in enumerate(utils.get_images(image, bbox)):
+            yield f"{filename}_extracted_{i}.png", img
+
+def _process_pdf(pdf_path: str, dpi: int) -> list:
+    """
+    Returns the detections of every PDF page. Runs on the inference executor.
+    """
+    return [
+        {"page": page, "results": result if result else []}
+        for page, _, _, result in pdf_pipeline.iter_pdf_detections(pdf_path, dpi)
+    ]
+
+def _iter_pdf_bbox(pdf_path: str, dpi: int):
+    """
+    Yields one NDJSON line per PDF page as soon as the page is processed.
+    """
+    for page, _, _, result in pdf_pipeline.iter_pdf_detections(pdf_path, dpi):
+        yield json.dumps({"page": page, "results": result if result else []}) + "\n"
+
+def _encoding(image_format: str, quality: int, manifest: bool) -> dict:
+    """
+    Validates the output format parameters of a request, see `utils.encode_params`.
+    """
+    try:
+        utils.encode_params(image_format, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"image_format": image_format, "quality": quality, "manifest": manifest}
+
+def _zip_entries(encoding: dict, iter_entries, *args):
+    """
+    Streams the entries produced by `iter_entries(*args)` as a zip file. Runs on the inference executor.
+    """
+    return utils.stream_zip(iter_entries(*args), **encoding)
+
+async def _start_stream(chunks):
+    """
+    Waits for the first chunk of a stream before the response is started,
+    so that failures before any output still produce an error status code.
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def stream():
+        if first is None:
+            return
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    return stream()
+
+async def _zip_response(chunks, filename: str, endpoint: str) -> StreamingResponse:
+    return StreamingResponse(
+        _count_bytes_out(await _start_stream(chunks), endpoint),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+async def _ndjson_stream(lines):
+    """
+    Forwards streamed lines to the client. Errors after the response has started
+    are reported as a final `{"error": ...}` line since the status code is already sent.
+    """
+    try:
+        async for line in lines:
+            yield line
+    except Exception as e:
+        logger.error(f"[Inference] Error during streamed PDF inference: {e}")
+        yield json.dumps({"error": "Internal Server Error"}) + "\n"
 
 @app.post("/image")
 async def inference_image(
     images: list[UploadFile] = File(...),
     mode: str = Query("bbox", enum = ["bbox", "draw", "extract"]),
+    image_format: str = Query("png", alias="format", enum=config.ENCODE_FORMATS),
+    quality: int = Query(None, ge=0, le=100),
+    manifest: bool = Query(False),
 ):
     """
     Performs inference on a image using a model trained using detectron2.
@@ -34,6 +246,9 @@ async def inference_image(
     ## Parameters:
         - `images` (UploadFile): List of images to be processed.
         - `mode` string: operation to perform
+        - `format` string: format of the images in the zip file: `png`, lossless `webp` or `jpeg`
+        - `quality` int: PNG compression level (0-9) or JPEG quality (1-100), server defaults if not given
+        - `manifest` bool: add a `manifest.json` with the size in pixels and bytes of every image to the zip file
 
     ## Returns:
         - `JSONResponse` : if mode is `bounding_box`
@@ -41,6 +256,9 @@ async def inference_image(
     
     ## Raises: 
         - HTTPException : For any errors while processing
+        - HTTPException (400) : If a file is not a readable image
+        - HTTPException (413) : If the request is past `UPLOAD_MAX_FILES`, `UPLOAD_MAX_BYTES` or a pixel limit
+        - HTTPException (503) : If the inference queue is full or no pixel budget freed up in time; retry after the `Retry-After` header
     
     ## Example:
     ```
@@ -53,42 +271,29 @@ async def inference_image(
         if mode not in ["bbox", "draw", "extract"]:
             raise HTTPException(status_code=400, detail="Invalid mode specified. Choose from 'bbox', 'draw', or 'extract'.")
         logger.info(f"[Inference] Received {len(images)} images for processing in mode '{mode}'")
-        if mode == "bbox":
-            results = []
-            for image_file in images:
-                image = Image.open(image_file.file).convert("RGB")
-                logger.info(f"[Inference] Processing image: {image_file.filename}")
-                result = inference.inference_image(image, draw=False)
-                results.append({"filename": image_file.filename, "results": result if result else []})
-            return JSONResponse(content=results, status_code=200)
-        elif mode == "draw":
-            images_with_boxes = []
-            for image_file in images:
-                image = Image.open(image_file.file).convert("RGB")
-                logger.info(f"[Inference] Processing image: {image_file.filename}")
-                result_image = inference.inference_image(image, draw=True)
-                images_with_boxes.append((image_file.filename, result_image if isinstance(result_image, Image.Image) else image))
-            return StreamingResponse(
-                utils.create_zip(images_with_boxes),
-                media_type="application/zip",
-                headers={"Content-Disposition": "attachment; filename=images_with_boxes.zip"}
-            )
-        elif mode == "extract":
-            images = []
-            for image_file in images:
-                image = Image.open(image_file.file).convert("RGB")
-                logger.info(f"[Inference] Processing image: {image_file.filename}")
-                bbox = inference.inference_image(image, draw=False)
-                if bbox is None or not bbox:
-                    logger.warning(f"[Inference] No drawings found in image: {image_file.filename}")
-                    continue
-                extracted_images = utils.get_images(image, bbox)
-                images.extend([(f"{image_file.filename}_extracted_{i}.png", img) for i, img in enumerate(extracted_images)])
-            return StreamingResponse(
-                utils.create_zip(images),
-                media_type="application/zip",
-                headers={"Content-Disposition": "attachment; filename=extracted_images.zip"}
-            )
+        metrics.REQUESTS.inc(endpoint="image", mode=mode)
+        encoding = _encoding(image_format, quality, manifest) if mode != "bbox" else None
+        # uploads are closed once the endpoint returns, before a streamed response is sent
+        admission = await _admit(images, "image", uploads.image_pixels, max_files=config.UPLOAD_MAX_FILES)
+        try:
+            if mode == "bbox":
+                try:
+                    results = await get_executor().run(_process_images, admission.uploads)
+                finally:
+                    admission.release()
+                return _json_response(results, "image")
+            filename = "images_with_boxes.zip" if mode == "draw" else "extracted_images.zip"
+            chunks = get_executor().iterate(_zip_entries, encoding, _iter_image_entries, admission.uploads, mode)
+            return await _zip_response(uploads.release_after(chunks, admission), filename, "image")
+        except BaseException:
+            admission.release()
+            raise
+    except (UploadTooLargeError, InvalidUploadError) as e:
+        raise _rejected_upload(e)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[Inference] Error during inference: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -97,6 +302,11 @@ async def inference_image(
 async def inference_pdf(
     pdf: UploadFile = File(...),
     mode: str = Query("bbox", enum=["bbox", "draw", "extract"]),
+    stream: bool = Query(False),
+    dpi: int = Query(config.PDF_DPI, ge=config.PDF_MIN_DPI, le=config.PDF_MAX_DPI),
+    image_format: str = Query("png", alias="format", enum=config.ENCODE_FORMATS),
+    quality: int = Query(None, ge=0, le=100),
+    manifest: bool = Query(False),
 ):
     """
     Performs inference on a PDF file using a model trained using detectron2.
@@ -110,15 +320,28 @@ async def inference_pdf(
     ## Parameters:
         - `pdf` (UploadFile): PDF file to be processed.
         - `mode` string: operation to perform
+        - `stream` bool: in `bbox` mode, stream one JSON line per page (NDJSON) as soon as it is processed
+        - `dpi` int: resolution of the boxes, drawn pages and extracted images; detection runs on pages
+          rendered at `PDF_DETECT_DPI` and only the detected regions are rendered at this resolution
+        - `format`, `quality`, `manifest`: output format of the zip file, as for `/inference/image`
 
     ## Returns:
         - `JSONResponse` : if mode is `bounding_box`
-        - `StreamingResponse` : otherwise
+        - `StreamingResponse` : if mode is `bounding_box` with `stream=true` (`application/x-ndjson`), otherwise a zip file
+
+    ## Raises:
+        - HTTPException : For any errors while processing
+        - HTTPException (400) : If the file is not a readable PDF
+        - HTTPException (413) : If the PDF is past `UPLOAD_MAX_BYTES`, `PDF_MAX_PAGES` or a pixel limit
+        - HTTPException (503) : If the inference queue is full or no pixel budget freed up in time; retry after the `Retry-After` header
 
     ## Example:
     ```
         curl --location 'http://localhost:8000/inference/pdf?mode=draw' \
         --form 'pdf=@"/path/to/file/input.pdf"'
+
+        curl --no-buffer --location 'http://localhost:8000/inference/pdf?mode=bbox&stream=true' \
+        --form 'pdf=@"/path/to/file/input.pdf"'
     ```
     """
     try:
@@ -126,44 +349,142 @@ async def inference_pdf(
             raise HTTPException(status_code=400, detail="Invalid mode specified. Choose from 'bbox', 'draw', or 'extract'.")
         
         logger.info(f"[Inference] Received PDF file '{pdf.filename}' for processing in mode '{mode}'")
-        pdf_bytes = await pdf.read()
-        images = convert_from_bytes(pdf_bytes, dpi=300, fmt="png")
-        logger.info(f"[Inference] Converted PDF to {len(images)} images for processing")
-
-        if mode == "bbox":
-            results = []
-            for i, image in enumerate(images):
-                logger.info(f"[Inference] Processing page {i+1} of PDF")
-                result = inference.inference_image(image, draw=False)
-                results.append({"page": i+1, "results": result if result else []})
-            return JSONResponse(content=results, status_code=200)
-        elif mode == "draw":
-            images_with_boxes = []
-            for i, image in enumerate(images):
-                logger.info(f"[Inference] Processing page {i+1} of PDF")
-                result_image = inference.inference_image(image, draw=True)
-                images_with_boxes.append((f"page_{i+1}.png", result_image if isinstance(result_image, Image.Image) else image))
-            return StreamingResponse(
-                utils.create_zip(images_with_boxes),
-                media_type="application/zip",
-                headers={"Content-Disposition": "attachment; filename=pdf_with_boxes.zip"}
-            )
-        elif mode == "extract":
-            extracted_images = []
-            for i, image in enumerate(images):
-                logger.info(f"[Inference] Processing page {i+1} of PDF")
-                bbox = inference.inference_image(image, draw=False)
-                if bbox is None or not bbox:
-                    logger.warning(f"[Inference] No drawings found in page {i+1}")
-                    continue
-                page_images = utils.get_images(image, bbox)
-                extracted_images.extend([(f"page_{i+1}_extracted_{j}.png", img) for j, img in enumerate(page_images)])
-            return StreamingResponse(
-                utils.create_zip(extracted_images),
-                media_type="application/zip",
-                headers={"Content-Disposition": "attachment; filename=extracted_images.zip"}
-            )
-    
+        metrics.REQUESTS.inc(endpoint="pdf", mode=mode)
+        encoding = _encoding(image_format, quality, manifest) if mode != "bbox" else None
+        # whole pages are rendered at the requested resolution in draw mode only
+        admission = await _admit([pdf], "pdf", _pdf_pixels, dpi, dpi if mode == "draw" else pdf_pipeline.detect_dpi(dpi))
+        pdf_path = admission.uploads[0].path
+        try:
+            if mode == "bbox" and stream:
+                lines = get_executor().iterate(_iter_pdf_bbox, pdf_path, dpi)
+                lines = await _start_stream(uploads.release_after(lines, admission))
+                return StreamingResponse(
+                    _count_bytes_out(_ndjson_stream(lines), "pdf"),
+                    media_type="application/x-ndjson",
+                )
+            if mode == "bbox":
+                try:
+                    results = await get_executor().run(_process_pdf, pdf_path, dpi)
+                finally:
+                    admission.release()
+                return _json_response(results, "pdf")
+            filename = "pdf_with_boxes.zip" if mode == "draw" else "extracted_images.zip"
+            chunks = get_executor().iterate(_zip_entries, encoding, pdf_pipeline.iter_pdf_entries, pdf_path, mode, dpi)
+            return await _zip_response(uploads.release_after(chunks, admission), filename, "pdf")
+        except BaseException:
+            admission.release()
+            raise
+    except (UploadTooLargeError, InvalidUploadError) as e:
+        raise _rejected_upload(e)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"[Inference] Error during PDF inference: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    pdf: UploadFile = File(...),
+    mode: str = Query("bbox", enum=["bbox", "draw", "extract"]),
+    dpi: int = Query(config.PDF_DPI, ge=config.PDF_MIN_DPI, le=config.PDF_MAX_DPI),
+):
+    """
+    Queues a PDF for background inference, for documents that take longer than a request may stay open.
+
+    ## Description:
+    The PDF is spooled to disk and processed by a job worker, separately from the inference queue of
+    the `/image` and `/pdf` endpoints. Poll `GET /inference/jobs/{job_id}` for the status, per-page
+    progress and timings, then fetch `GET /inference/jobs/{job_id}/result` once the status is `done`.
+    Jobs and their results are kept for `JOB_RETENTION` seconds after they finish.
+
+    ## Parameters:
+        - `pdf` (UploadFile): PDF file to be processed.
+        - `mode` string: operation to perform, as for `/inference/pdf`
+        - `dpi` int: resolution of the boxes, drawn pages and extracted images, as for `/inference/pdf`
+
+    ## Returns:
+        - `JSONResponse` (202) : the `job_id` and the URLs of its status and result
+
+    ## Raises:
+        - HTTPException (400) : If the file is not a readable PDF
+        - HTTPException (413) : If the PDF is past `UPLOAD_MAX_BYTES` or a page past `MAX_PAGE_PIXELS`
+        - HTTPException (503) : If too many jobs are waiting; retry after the `Retry-After` header
+
+    ## Example:
+    ```
+        curl --location 'http://localhost:8000/inference/jobs?mode=extract' \
+        --form 'pdf=@"/path/to/file/input.pdf"'
+    ```
+    """
+    try:
+        if mode not in ["bbox", "draw", "extract"]:
+            raise HTTPException(status_code=400, detail="Invalid mode specified. Choose from 'bbox', 'draw', or 'extract'.")
+        metrics.REQUESTS.inc(endpoint="jobs", mode=mode)
+        # jobs render one page at a time on their own workers, so only their pages are limited
+        upload, = await uploads.spool([pdf], "jobs")
+        try:
+            await run_in_threadpool(uploads.pdf_pixels, upload, dpi, dpi)
+            job_id = await run_in_threadpool(get_job_queue().submit, upload.path, upload.filename, mode, dpi)
+        finally:
+            upload.remove()
+        logger.info(f"[Jobs] Queued job {job_id} for PDF file '{upload.filename}' in mode '{mode}'")
+        return JSONResponse(
+            content={
+                "job_id": job_id,
+                "status_url": f"/inference/jobs/{job_id}",
+                "result_url": f"/inference/jobs/{job_id}/result",
+            },
+            status_code=202,
+        )
+    except (UploadTooLargeError, InvalidUploadError) as e:
+        raise _rejected_upload(e)
+    except QueueFullError as e:
+        raise _queue_full(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[Jobs] Error while queueing PDF job: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def _get_job(job_id: str) -> dict:
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    Returns the status (`queued`, `running`, `done` or `failed`), page progress, error and timings of a job.
+    """
+    return JSONResponse(content=_get_job(job_id), status_code=200)
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    """
+    Returns the results of a finished job: the detections per page in `bbox` mode, otherwise a zip file.
+
+    ## Raises:
+        - HTTPException (404) : If the job does not exist
+        - HTTPException (409) : If the job is not done yet or failed
+    """
+    job = _get_job(job_id)
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+    result_path = get_job_queue().result_path(job_id, job["mode"])
+    metrics.BYTES_OUT.inc(os.path.getsize(result_path), endpoint="jobs")
+    if job["mode"] == "bbox":
+        return FileResponse(result_path, media_type="application/json")
+    filename = "pdf_with_boxes.zip" if job["mode"] == "draw" else "extracted_images.zip"
+    return FileResponse(result_path, media_type="application/zip", filename=filename)
+
+@app.delete("/jobs/{job_id}", status_code=204)
+def delete_job(job_id: str):
+    """
+    Deletes a job and its results. A running job stops at its next page.
+    """
+    if not get_job_queue().delete(job_id):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return Response(status_code=204)
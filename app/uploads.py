@@ -0,0 +1,228 @@
+import os
+import tempfile
+import warnings
+
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException
+from PIL import Image
+
+import utility.config as config
+import utility.pdf as pdf_utils
+import utility.utils as utils
+from utility import metrics
+
+logger = utils.get_logger(__name__)
+
+# Uploads are spooled to disk and priced before anything expensive happens.
+# Request bodies are cut off by `RequestSizeLimit` as soon as they pass REQUEST_MAX_BYTES, while
+# they are received. Starlette's multipart parser keeps each file in an anonymous temporary file,
+# which cannot be linked or moved and is closed with the request, so files within UPLOAD_MAX_BYTES
+# are copied in chunks to UPLOAD_SPOOL_DIR, where they outlive the request for streamed responses.
+# Their cost in pixels is then read from image headers or PDF metadata (page count and page
+# sizes, without rendering), and checked against per-page and per-request limits. Requests within
+# the limits are admitted against the per-process `PixelBudget` of `app/executor.py`, and wait
+# while it is used up.
+
+CHUNK_SIZE = 1024 * 1024 # Bytes read from an upload at a time
+POINTS_PER_INCH = 72
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload is past a size, page or pixel limit (413)."""
+
+
+class InvalidUploadError(Exception):
+    """Raised when an upload is not a readable image or PDF (400)."""
+
+
+class SpooledUpload:
+    """
+    An uploaded file spooled to disk.
+    """
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self.size = 0
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"[Uploads] Failed to delete spooled upload {self.path}: {e}")
+
+
+async def spool(files: list, endpoint: str, max_files: int = None) -> list:
+    """
+    Copies the uploaded files to disk, `config.UPLOAD_MAX_BYTES` per file and `config.REQUEST_MAX_BYTES` in total.
+    Files whose size is known already are checked before anything is copied.
+
+    Returns:
+        list: The `SpooledUpload` of every file, to be removed by the caller.
+
+    Raises:
+        UploadTooLargeError: If there are more than `max_files` files or a size limit is exceeded.
+    """
+    if max_files is not None and len(files) > max_files:
+        raise UploadTooLargeError(f"At most {max_files} files are accepted per request")
+    for file in files:
+        if file.size is not None and file.size > config.UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(f"{file.filename} is larger than {config.UPLOAD_MAX_BYTES} bytes")
+    uploads = []
+    total = 0
+    try:
+        with metrics.timer("upload_read"):
+            for file in files:
+                fd, path = tempfile.mkstemp(prefix="upload-", dir=config.UPLOAD_SPOOL_DIR)
+                upload = SpooledUpload(file.filename, path)
+                uploads.append(upload)
+                with os.fdopen(fd, "wb") as fp:
+                    while chunk := await file.read(CHUNK_SIZE):
+                        upload.size += len(chunk)
+                        total += len(chunk)
+                        if upload.size > config.UPLOAD_MAX_BYTES:
+                            raise UploadTooLargeError(f"{file.filename} is larger than {config.UPLOAD_MAX_BYTES} bytes")
+                        if total > config.REQUEST_MAX_BYTES:
+                            raise UploadTooLargeError(f"Request is larger than {config.REQUEST_MAX_BYTES} bytes")
+                        fp.write(chunk)
+    except BaseException:
+        for upload in uploads:
+            upload.remove()
+        raise
+    metrics.BYTES_IN.inc(total, endpoint=endpoint)
+    return uploads
+
+
+def _check_page(name: str, width: int, height: int) -> int:
+    pixels = width * height
+    if pixels > config.MAX_PAGE_PIXELS:
+        raise UploadTooLargeError(f"{name} is {width}x{height} pixels, more than {config.MAX_PAGE_PIXELS}")
+    return pixels
+
+def image_pixels(uploads: list) -> int:
+    """
+    Reads the size of the uploaded images from their headers, without decoding them.
+
+    Returns:
+        int: Pixels decoded for the request.
+    """
+    total = 0
+    for upload in uploads:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                with Image.open(upload.path) as image:
+                    width, height = image.size
+        except Image.DecompressionBombError:
+            raise UploadTooLargeError(f"{upload.filename} is larger than {config.MAX_PAGE_PIXELS} pixels")
+        except Exception:
+            raise InvalidUploadError(f"{upload.filename} is not a supported image")
+        total += _check_page(upload.filename, width, height)
+    return total
+
+def pdf_pixels(upload: SpooledUpload, dpi: int, render_dpi: int, max_pages: int = None) -> int:
+    """
+    Reads the page count and page sizes of an uploaded PDF from its metadata, without rendering it.
+
+    Args:
+        upload (SpooledUpload): The PDF.
+        dpi (int): Resolution requested, at which every page must be within `config.MAX_PAGE_PIXELS`.
+        render_dpi (int): Resolution whole pages are rendered at, which the request costs.
+        max_pages (int): Most pages accepted, unlimited if None.
+
+    Returns:
+        int: Pixels rendered for the request.
+    """
+    try:
+        num_pages = pdf_utils.get_page_count(upload.path)
+        sizes = pdf_utils.get_page_sizes(upload.path, num_pages)
+    except Exception:
+        raise InvalidUploadError(f"{upload.filename} is not a readable PDF")
+    if len(sizes) != num_pages:
+        # an unpriced page must not be admitted for free
+        raise InvalidUploadError(f"{upload.filename} has {num_pages} pages but pdfinfo reported the size of {len(sizes)}")
+    if max_pages is not None and num_pages > max_pages:
+        raise UploadTooLargeError(f"{upload.filename} has {num_pages} pages, more than {max_pages}")
+    total = 0
+    for page, (width, height) in enumerate(sizes, start=1):
+        _check_page(
+            f"Page {page} of {upload.filename}",
+            round(width * dpi / POINTS_PER_INCH),
+            round(height * dpi / POINTS_PER_INCH),
+        )
+        total += round(width * render_dpi / POINTS_PER_INCH) * round(height * render_dpi / POINTS_PER_INCH)
+    return total
+
+def check_request(pixels: int):
+    if pixels > config.REQUEST_MAX_PIXELS:
+        raise UploadTooLargeError(f"Request needs {pixels} pixels, more than {config.REQUEST_MAX_PIXELS}")
+
+
+class Admission:
+    """
+    The spooled uploads of an admitted request and the pixels it holds in the budget,
+    released once the request is done with them. Releasing more than once has no effect.
+    """
+
+    def __init__(self, uploads: list, budget, pixels: int):
+        self.uploads = uploads
+        self.budget = budget
+        self.pixels = pixels
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.budget.release(self.pixels)
+        for upload in self.uploads:
+            upload.remove()
+
+
+async def release_after(chunks, admission: Admission):
+    """
+    Forwards a streamed response and releases the admission of its request once it ends,
+    including when the client goes away mid-stream.
+    """
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        admission.release()
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware rejecting request bodies past `max_bytes` with 413: before they are read if
+    their Content-Length is larger, otherwise (chunked bodies) as soon as more has been received.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request is larger than {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # raised into the body parser, and turned into the response by the exception handlers
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
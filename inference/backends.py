@@ -0,0 +1,236 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import utility.config as config
+from utility.utils import get_logger
+
+logger = get_logger(__name__)
+
+# This module holds the inference backends that `get_predictor` can serve.
+# Every backend exposes `predict_batch(images)`, taking HxWxC uint8 BGR arrays (the input format
+# the model was trained with, as for detectron2's `DefaultPredictor`) and returning
+# one list of {"box", "score", "class"} detections per image, so callers do not depend
+# on which runtime executes the model.
+#   - "detectron2"  : the detectron2 `DefaultPredictor` built from the training config
+#   - "torchscript" : the model exported by `inference/export_model.py`, run by torch.jit
+#   - "onnxruntime" : the model exported by `inference/export_model.py`, run by ONNX Runtime
+
+BACKENDS = ["detectron2", "torchscript", "onnxruntime"]
+
+# Order in which detectron2's TracingAdapter flattens the predicted `Instances`
+EXPORT_OUTPUTS = ["pred_boxes", "pred_classes", "scores", "image_size"]
+
+
+def shortest_edge_size(height: int, width: int, min_size: int, max_size: int) -> tuple:
+    """
+    Size an image is resized to by detectron2's `ResizeShortestEdge` test-time augmentation.
+
+    Returns:
+        tuple: (height, width) after resizing.
+    """
+    scale = min_size / min(height, width)
+    if max(height, width) * scale > max_size:
+        scale = max_size / max(height, width)
+    return int(height * scale + 0.5), int(width * scale + 0.5)
+
+def resize_shortest_edge(image: np.ndarray, min_size: int, max_size: int) -> np.ndarray:
+    """
+    Resize an image like detectron2's `ResizeShortestEdge` test-time augmentation,
+    including its PIL bilinear interpolation.
+
+    Args:
+        image (np.ndarray): HxWxC uint8 image.
+        min_size (int): Target length of the shortest edge.
+        max_size (int): Maximum length of the longest edge.
+
+    Returns:
+        np.ndarray: The resized image.
+    """
+    height, width = image.shape[:2]
+    new_height, new_width = shortest_edge_size(height, width, min_size, max_size)
+    if (new_height, new_width) == (height, width):
+        return image
+    return np.asarray(Image.fromarray(image).resize((new_width, new_height), Image.BILINEAR))
+
+def to_detections(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, scale_x: float, scale_y: float, height: int, width: int) -> list:
+    """
+    Map boxes predicted on the resized image back to the original image,
+    like detectron2's `detector_postprocess`.
+
+    Returns:
+        list: A list of {"box", "score", "class"} dicts.
+    """
+    boxes = boxes.astype(np.float32) * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+    boxes[:, 0::2] = boxes[:, 0::2].clip(0, width)
+    boxes[:, 1::2] = boxes[:, 1::2].clip(0, height)
+    keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+    results = []
+    for box, score, cls in zip(boxes[keep], scores[keep], classes[keep]):
+        results.append({
+            "box": box.tolist(),  # [xmin, ymin, xmax, ymax]
+            "score": float(score),
+            "class": int(cls)
+        })
+    return results
+
+
+class Detectron2Backend:
+    """
+    Serves the detectron2 `DefaultPredictor` built from the training config.
+    """
+
+    name = "detectron2"
+    batched = True
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+
+    def predict_batch(self, images: list) -> list:
+        from inference.batching import predict_batch
+
+        return predict_batch(self.predictor, images)
+
+
+class ExportedBackend:
+    """
+    Base class of the backends serving a model exported by `inference/export_model.py`.
+    Subclasses implement `_run(image)` returning the flattened outputs for one CHW float32 image.
+    The export is traced on a single image, so `predict_batch` runs the images one at a time.
+    """
+
+    name = None
+    batched = False
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.metadata = load_export_metadata(model_path)
+        self.min_size = config.MODEL_INPUT_MIN_SIZE
+        self.max_size = config.MODEL_INPUT_MAX_SIZE
+        for key, value in (("score_threshold", config.SCORE_THRESHOLD), ("nms_threshold", config.NMS_THRESHOLD)):
+            if self.metadata.get(key) != value:
+                logger.warning(
+                    f"[Backend] {model_path} was exported with {key}={self.metadata.get(key)}, "
+                    f"config has {value}; thresholds are baked into exported models, re-export to apply"
+                )
+
+    def predict_batch(self, images: list) -> list:
+        all_results = []
+        for original_image in images:
+            height, width = original_image.shape[:2]
+            image = resize_shortest_edge(original_image, self.min_size, self.max_size)
+            tensor = np.ascontiguousarray(image.astype(np.float32).transpose(2, 0, 1))
+            outputs = dict(zip(EXPORT_OUTPUTS, self._run(tensor)))
+            scale_x = width / image.shape[1]
+            scale_y = height / image.shape[0]
+            all_results.append(to_detections(
+                outputs["pred_boxes"], outputs["scores"], outputs["pred_classes"], scale_x, scale_y, height, width
+            ))
+        return all_results
+
+    def _run(self, image: np.ndarray) -> list:
+        raise NotImplementedError
+
+
+class TorchScriptBackend(ExportedBackend):
+    """
+    Serves the TorchScript export of the model.
+    """
+
+    name = "torchscript"
+
+    def __init__(self, model_path: str):
+        import torch
+
+        super().__init__(model_path)
+        self._torch = torch
+        self.model = torch.jit.load(model_path, map_location="cpu")
+        self.model.eval()
+
+    def _run(self, image: np.ndarray) -> list:
+        with self._torch.no_grad():
+            outputs = self.model(self._torch.from_numpy(image))
+        return [output.numpy() for output in outputs]
+
+
+class OnnxRuntimeBackend(ExportedBackend):
+    """
+    Serves the ONNX export of the model through ONNX Runtime on CPU.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, model_path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("The onnxruntime backend requires the 'onnx' extra: poetry install -E onnx") from e
+
+        super().__init__(model_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _run(self, image: np.ndarray) -> list:
+        return self.session.run(EXPORT_OUTPUTS, {self.input_name: image})
+
+
+def export_metadata_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+def load_export_metadata(model_path: str) -> dict:
+    """
+    Load the metadata written next to an exported model by `inference/export_model.py`.
+
+    Args:
+        model_path (str): Path to the exported model.
+
+    Returns:
+        dict: Preprocessing parameters and thresholds the model was exported with.
+    """
+    metadata_path = export_metadata_path(model_path)
+    if not os.path.exists(model_path) or not os.path.exists(metadata_path):
+        raise RuntimeError(f"Exported model not found at {model_path}; run `python inference/export_model.py` first")
+    with open(metadata_path, "r") as fp:
+        return json.load(fp)
+
+def onnx_model_path() -> str:
+    """
+    Path of the ONNX model served by the onnxruntime backend: the INT8 model
+    built by `inference/quantize.py` if `config.QUANTIZATION` is set.
+    """
+    if config.QUANTIZATION:
+        if config.QUANTIZATION not in config.QUANTIZED_MODEL_PATHS:
+            raise ValueError(f"Unknown quantization '{config.QUANTIZATION}'. Choose from {list(config.QUANTIZED_MODEL_PATHS)}.")
+        return config.QUANTIZED_MODEL_PATHS[config.QUANTIZATION]
+    return config.ONNX_MODEL_PATH
+
+def create_backend(name: str, detectron2_predictor_factory=None):
+    """
+    Create the inference backend selected by `name`.
+
+    Args:
+        name (str): One of `BACKENDS`.
+        detectron2_predictor_factory (Callable): Builds the `DefaultPredictor` for the detectron2 backend.
+
+    Only the detectron2 backend runs a batch in a single forward pass. The exported models take
+    one image, and their `predict_batch` loops over the batch: with "torchscript" and
+    "onnxruntime", `config.BATCH_MAX_SIZE` groups requests but does not speed up the model.
+    Backends report which it is in their `batched` attribute.
+
+    Returns:
+        The backend exposing `predict_batch(images)`.
+    """
+    if config.QUANTIZATION and name != "onnxruntime":
+        raise ValueError("Quantized models are served by the onnxruntime backend only.")
+    if name == "detectron2":
+        return Detectron2Backend(detectron2_predictor_factory())
+    if name == "torchscript":
+        return TorchScriptBackend(config.TORCHSCRIPT_MODEL_PATH)
+    if name == "onnxruntime":
+        return OnnxRuntimeBackend(onnx_model_path())
+    raise ValueError(f"Unknown inference backend '{name}'. Choose from {BACKENDS}.")
@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from utility.utils import get_logger
+
+logger = get_logger(__name__)
+
+# This module batches images coming from concurrent callers (and all pages of a PDF)
+# into a single forward pass of the underlying detectron2 model.
+# A batch is dispatched once it reaches `max_batch_size` or the oldest image
+# in it has waited `max_wait_ms` since it was submitted, whichever comes first. Images that
+# waited longer for a free forward slot are dispatched with whatever is queued as soon as
+# a slot frees up.
+
+
+def to_results(instances) -> list:
+    """
+    Convert detectron2 `Instances` into the list of detections returned by the API.
+
+    Args:
+        instances (Instances): Predicted instances for one image.
+
+    Returns:
+        list: A list of {"box", "score", "class"} dicts.
+    """
+    boxes = instances.pred_boxes.tensor.cpu().numpy()
+    scores = instances.scores.cpu().numpy()
+    classes = instances.pred_classes.cpu().numpy()
+
+    results = []
+    for box, score, cls in zip(boxes, scores, classes):
+        results.append({
+            "box": box.tolist(),  # [xmin, ymin, xmax, ymax]
+            "score": float(score),
+            "class": int(cls)
+        })
+    return results
+
+
+def predict_batch(predictor, images: list) -> list:
+    """
+    Run a list of images through the model of a `DefaultPredictor` in one forward pass.
+
+    Mirrors the preprocessing of `DefaultPredictor.__call__` (channel flip, resize
+    augmentation, CHW tensor) so that results match single-image calls.
+
+    Args:
+        predictor (DefaultPredictor): The initialized predictor.
+        images (list): List of HxWxC uint8 numpy arrays in BGR.
+
+    Returns:
+        list: One list of detections per input image.
+    """
+    import torch
+
+    with torch.no_grad():
+        inputs = []
+        for original_image in images:
+            if predictor.input_format == "RGB":
+                original_image = original_image[:, :, ::-1]
+            height, width = original_image.shape[:2]
+            image = predictor.aug.get_transform(original_image).apply_image(original_image)
+            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+            image = image.to(predictor.cfg.MODEL.DEVICE)
+            inputs.append({"image": image, "height": height, "width": width})
+        outputs = predictor.model(inputs)
+    return [to_results(output["instances"]) for output in outputs]
+
+
+class BatchPredictor:
+    """
+    Gathers images submitted from any thread into size- and time-bounded batches
+    and runs each batch through the model in a single forward pass.
+    """
+
+    def __init__(self, forward, max_batch_size: int, max_wait_ms: float, concurrency: int = 1):
+        """
+        Args:
+            forward (Callable): Runs a list of images through the model and returns one list of detections per image.
+            max_batch_size (int): Maximum number of images per forward pass.
+            max_wait_ms (float): Maximum time the first image of a batch waits for the batch to fill up,
+                counted from its submission.
+            concurrency (int): Number of batches allowed in the model at the same time.
+        """
+        self.forward = forward
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max(1, concurrency))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch-forward")
+        self._thread = threading.Thread(target=self._run, name="batch-predictor", daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        Queue an image for inference.
+
+        Args:
+            image (np.ndarray): HxWxC uint8 image.
+
+        Returns:
+            Future: Resolves to the list of detections for the image.
+        """
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def predict(self, images: list) -> list:
+        """
+        Queue several images at once (e.g. all pages of a PDF) and wait for their results.
+
+        Args:
+            images (list): List of HxWxC uint8 images.
+
+        Returns:
+            list: One list of detections per input image, in input order.
+        """
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Run the images queued so far and stop the batching thread and the forward threads.
+        Images must not be submitted afterwards.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        # None is queued by `close` and ends the batch
+        if batch[0] is None:
+            return batch
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size and batch[-1] is not None:
+            remaining = deadline - time.perf_counter()
+            try:
+                # past the deadline, only the images queued already join the batch
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            # wait for a free slot first so that the batch keeps filling while the model is busy
+            self._slots.acquire()
+            batch = self._collect()
+            closed = batch[-1] is None
+            if closed:
+                batch.pop()
+            batch = [(image, future) for image, future, _ in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._pool.submit(self._forward, batch)
+            else:
+                self._slots.release()
+            if closed:
+                return
+
+    def _forward(self, batch: list):
+        images = [image for image, _ in batch]
+        try:
+            start_time = time.perf_counter()
+            results = self.forward(images)
+            end_time = time.perf_counter()
+            logger.info(f"[Batching] Processed batch of {len(images)} images in {end_time - start_time:.2f} seconds.")
+        except Exception as e:
+            logger.error(f"[Batching] Error during batched inference: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+import utility.config as config
+from utility.utils import get_logger
+
+logger = get_logger(__name__)
+
+# This module caches detections by the content of the decoded image.
+# Keys combine a hash of the pixels with a fingerprint of the model weights and
+# thresholds, so a new checkpoint or threshold never serves stale detections.
+# Concurrent requests for the same key share a single model run.
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Compute a content hash of a file, reading it in chunks.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_fingerprint() -> str:
+    """
+    Fingerprint of everything besides the image that changes detections:
+    the model weights file, the backend serving it, the model input size and the thresholds.
+    """
+    weights = file_fingerprint(config.MODEL_PATH)
+    backend = config.BACKEND
+    if backend == "torchscript":
+        backend = f"{backend}-{file_fingerprint(config.TORCHSCRIPT_MODEL_PATH)}"
+    elif backend == "onnxruntime":
+        from inference.backends import onnx_model_path
+
+        backend = f"{backend}-{file_fingerprint(onnx_model_path())}"
+    input_size = f"{config.MODEL_INPUT_MIN_SIZE}x{config.MODEL_INPUT_MAX_SIZE}"
+    return f"{weights}-{backend}-{input_size}-{config.SCORE_THRESHOLD}-{config.NMS_THRESHOLD}"
+
+
+class DetectionCache:
+    """
+    Two-tier detection cache (bounded in-memory LRU and optional on-disk store)
+    with single-flight coalescing of identical in-flight requests.
+    """
+
+    def __init__(self, fingerprint: str, max_entries: int, cache_dir: str = None):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image: np.ndarray) -> str:
+        """
+        Compute the cache key of a decoded image.
+
+        Args:
+            image (np.ndarray): HxWxC uint8 image.
+
+        Returns:
+            str: Hex digest of the pixels, shape and model fingerprint.
+        """
+        image = np.ascontiguousarray(image)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.shape}-{image.dtype}-{self.fingerprint}".encode())
+        digest.update(memoryview(image).cast("B"))
+        return digest.hexdigest()
+
+    def get_or_submit(self, key: str, submit) -> Future:
+        """
+        Return the detections for `key`, running `submit()` only if no cache tier
+        has them and no identical request is already in flight.
+
+        Args:
+            key (str): Cache key from `key()`.
+            submit (Callable): Starts inference and returns a `Future` of the detections.
+
+        Returns:
+            Future: Resolves to the list of detections. Results are shared between callers and must not be mutated.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._resolved(self._entries[key])
+            if key in self._in_flight:
+                self._coalesced += 1
+                return self._in_flight[key]
+
+        results = self._read_disk(key)
+        with self._lock:
+            if results is not None:
+                self._disk_hits += 1
+                self._store(key, results)
+                return self._resolved(results)
+            if key in self._in_flight:
+                self._coalesced += 1
+                return self._in_flight[key]
+            self._misses += 1
+            future = Future()
+            self._in_flight[key] = future
+
+        try:
+            model_future = submit()
+        except Exception as e:
+            self._finish(key, future, None, e)
+            return future
+
+        def on_done(done: Future):
+            error = done.exception()
+            self._finish(key, future, None if error else done.result(), error)
+
+        model_future.add_done_callback(on_done)
+        return future
+
+    def _finish(self, key: str, future: Future, results, error):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None:
+                self._store(key, results)
+        if error is None:
+            future.set_result(results)
+            self._write_disk(key, results)
+        else:
+            future.set_exception(error)
+
+    @staticmethod
+    def _resolved(results) -> Future:
+        future = Future()
+        future.set_result(results)
+        return future
+
+    def _store(self, key: str, results):
+        self._entries[key] = results
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Cache] Failed to read cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, results):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as fp:
+                json.dump(results, fp)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[Cache] Failed to write cache entry {key}: {e}")
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counts of the cache.
+        """
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses + self._coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "hit_rate": round((lookups - self._misses) / lookups, 4) if lookups else 0.0,
+            }
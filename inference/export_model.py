@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import sys
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import torch
+
+import utility.config as config
+from inference.backends import EXPORT_OUTPUTS, export_metadata_path, resize_shortest_edge
+from inference.load_model import build_cfg, load_checkpoint
+from utility.utils import get_logger, read_image
+
+logger = get_logger(__name__)
+
+# Exports `model_v2.pth` to TorchScript and ONNX so that `get_predictor` can serve it
+# without detectron2's Python overhead (see `INFERENCE_BACKEND` in `utility/config.py`).
+#
+#   python inference/export_model.py --format torchscript onnx
+#
+# The model is traced with detectron2's TracingAdapter on a sample page. Preprocessing
+# (resizing) and postprocessing (rescaling boxes) stay outside of the exported graph and
+# are done by `inference/backends.py`; the score and NMS thresholds are baked in.
+
+
+def load_model():
+    """
+    Builds the detectron2 model on CPU and loads the trained weights.
+    """
+    from detectron2.modeling import build_model
+
+    cfg = build_cfg()
+    cfg.MODEL.DEVICE = "cpu"
+    model = build_model(cfg)
+    load_checkpoint(model, cfg.MODEL.WEIGHTS)
+    model.eval()
+    return cfg, model
+
+def sample_input(cfg, image_path: str) -> torch.Tensor:
+    """
+    Prepares a sample page the way the backends do: resized and as a CHW float tensor.
+    """
+    image = read_image(image_path)
+    image = resize_shortest_edge(image, cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MAX_SIZE_TEST)
+    return torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+
+def tracing_adapter(model, image: torch.Tensor):
+    from detectron2.export import TracingAdapter
+
+    def inference(model, inputs):
+        # boxes stay in the resized image coordinates, the backends rescale them
+        instances = model.inference(inputs, do_postprocess=False)[0]
+        return [{"instances": instances}]
+
+    return TracingAdapter(model, [{"image": image}], inference)
+
+def write_metadata(cfg, model_path: str, export_format: str):
+    metadata = {
+        "format": export_format,
+        "source": config.MODEL_PATH,
+        "min_size_test": cfg.INPUT.MIN_SIZE_TEST,
+        "max_size_test": cfg.INPUT.MAX_SIZE_TEST,
+        "score_threshold": config.SCORE_THRESHOLD,
+        "nms_threshold": config.NMS_THRESHOLD,
+    }
+    with open(export_metadata_path(model_path), "w") as fp:
+        json.dump(metadata, fp, indent=4)
+
+def export_torchscript(cfg, model, image: torch.Tensor, output_path: str):
+    adapter = tracing_adapter(model, image)
+    with torch.no_grad():
+        traced = torch.jit.trace(adapter, (image,))
+    traced.save(output_path)
+    write_metadata(cfg, output_path, "torchscript")
+    logger.info(f"[Export] Saved TorchScript model to {output_path}")
+
+def export_onnx(cfg, model, image: torch.Tensor, output_path: str):
+    from detectron2.export import STABLE_ONNX_OPSET_VERSION
+
+    adapter = tracing_adapter(model, image)
+    with torch.no_grad():
+        torch.onnx.export(
+            adapter,
+            (image,),
+            output_path,
+            input_names=["image"],
+            output_names=EXPORT_OUTPUTS,
+            dynamic_axes={"image": {1: "height", 2: "width"}},
+            opset_version=STABLE_ONNX_OPSET_VERSION,
+        )
+    write_metadata(cfg, output_path, "onnx")
+    logger.info(f"[Export] Saved ONNX model to {output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the detection model to TorchScript and/or ONNX.")
+    parser.add_argument("--format", nargs="+", choices=["torchscript", "onnx"], default=["torchscript", "onnx"])
+    parser.add_argument("--sample", default=os.path.join(config.TEST_IMAGE_DIR, "0.png"), help="Page used to trace the model")
+    args = parser.parse_args()
+
+    os.makedirs(config.EXPORT_DIR, exist_ok=True)
+    cfg, model = load_model()
+    image = sample_input(cfg, args.sample)
+    if "torchscript" in args.format:
+        export_torchscript(cfg, model, image, config.TORCHSCRIPT_MODEL_PATH)
+    if "onnx" in args.format:
+        export_onnx(cfg, model, image, config.ONNX_MODEL_PATH)
+
+if __name__ == "__main__":
+    main()
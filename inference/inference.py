@@ -1,61 +1,254 @@
-from utility.utils import configure_warnings, get_logger
-from inference.load_model import get_predictor
+from utility.utils import configure_warnings, get_logger, scale_detections
+from inference.backends import resize_shortest_edge, shortest_edge_size
+from inference.load_model import get_batch_predictor, get_detection_cache, get_near_duplicate_index
+from inference.prefilter import get_page_filter
+from inference.tiling import cut_by_seam, merge_detections, tile_grid
+import utility.config as config
+from utility import metrics
+from collections import deque
+from concurrent.futures import Future
+import cv2
 import numpy as np
 import time
-from PIL import ImageDraw, ImageFont, Image
 
 configure_warnings()
 logger = get_logger(__name__)
 
-def inference_image(image: Image, draw: bool) -> list:
+def inference_image(image: np.ndarray, draw: bool) -> list:
     """
     Performs inference on a single image using a model trained with detectron2.
+    The image is batched together with images from concurrent requests.
 
     Args:
-        image (Image): The input image to be processed.
+        image (np.ndarray): The input image to be processed, in BGR (see `utility.utils.decode_image`).
 
     Returns:
         list: A list containing bbox of drawings, scores and class[currently one].
     """
-    predictor = get_predictor()
-    
-    logger.info("[Inference] Starting inference on the image...")
+    return inference_images([image], draw)[0]
+
+def inference_images(images: list, draw: bool) -> list:
+    """
+    Performs inference on a list of images (e.g. all pages of a PDF) in batched forward passes.
+
+    Args:
+        images (list): The input BGR images to be processed.
+
+    Returns:
+        list: One entry per image, shaped as returned by `inference_image`.
+    """
+    logger.info(f"[Inference] Starting inference on {len(images)} image(s)...")
 
     start_time = time.perf_counter()
-    outputs = predictor(np.array(image))
+    futures = [_submit(image) for image in images]
+    all_results = [future.result() for future in futures]
     end_time = time.perf_counter()
 
-    boxes = outputs["instances"].pred_boxes.tensor.cpu().numpy()
-    scores = outputs["instances"].scores.cpu().numpy()
-    classes = outputs["instances"].pred_classes.cpu().numpy()
+    logger.info(f"[Inference] Processed in {end_time - start_time:.2f} seconds.")
+    return [_postprocess(image, results, draw) for image, results in zip(images, all_results)]
 
-    results = []
-    for box, score, cls in zip(boxes, scores, classes):
-        results.append({
-            "box": box.tolist(),  # [xmin, ymin, xmax, ymax]
-            "score": float(score),
-            "class": int(cls)
-        })
+def iter_inference(images, draw: bool, prefilter: bool = False):
+    """
+    Performs inference on a stream of images (e.g. PDF pages as they are rendered).
 
-    logger.info(f"[Inference] Processed in {end_time - start_time:.2f} seconds.")
+    Up to `config.BATCH_MAX_SIZE` images are kept in flight so that they can share a
+    forward pass, while the producer of `images` keeps working on the next ones.
+
+    Args:
+        images (Iterable): The input BGR images to be processed.
+        prefilter (bool): Skip the model for blank and text-only pages (see `inference/prefilter.py`).
+
+    Yields:
+        tuple: (image, result) in input order, with result shaped as returned by `inference_image`.
+    """
+    page_filter = get_page_filter() if prefilter else None
+    in_flight = deque()
+    pages = skipped = 0
+    for image in images:
+        pages += 1
+        if page_filter is not None and not _has_candidates(page_filter, image):
+            skipped += 1
+            metrics.PAGES.inc(skipped="true")
+            future = Future()
+            future.set_result([])
+        else:
+            metrics.PAGES.inc(skipped="false")
+            future = _submit(image)
+        in_flight.append((image, future))
+        if len(in_flight) >= config.BATCH_MAX_SIZE:
+            image, future = in_flight.popleft()
+            yield image, _postprocess(image, future.result(), draw)
+    while in_flight:
+        image, future = in_flight.popleft()
+        yield image, _postprocess(image, future.result(), draw)
+    if page_filter is not None:
+        logger.info(f"[Inference] Pre-filter skipped {skipped} of {pages} pages")
+
+def _has_candidates(page_filter, image: np.ndarray) -> bool:
+    with metrics.timer("prefilter"):
+        return page_filter.has_candidates(image)
+
+def _submit(image: np.ndarray) -> Future:
+    """
+    Queues an image for batched inference, unless the detection cache already
+    has its detections or an identical image is in flight.
+
+    Images larger than the model input size are resized here, exactly as the model
+    would resize them, so that hashing and transport work on the small image;
+    the boxes are mapped back to the original image. Oversized pages are tiled
+    if `config.TILING_ENABLED` is set, see `_detect_tiled`, and near-duplicates of
+    earlier pages reuse their detections if `config.NEAR_DUPLICATE_ENABLED` is set.
+    """
+    metrics.IMAGES.inc()
+    start_time = time.perf_counter()
+    index = get_near_duplicate_index()
+    if index is None:
+        future = _submit_page(image)
+    else:
+        future = _submit_near_duplicate(index, image)
+    # time from submission to detections, including batching and queueing
+    future.add_done_callback(
+        lambda _: metrics.STAGE_SECONDS.observe(time.perf_counter() - start_time, stage="inference")
+    )
+    return future
+
+def _submit_near_duplicate(index, image: np.ndarray) -> Future:
+    """
+    Reuses the detections of a near-duplicate page from `index`, rescaled to this page,
+    or runs the page through the model and indexes its detections.
+    """
+    height, width = image.shape[:2]
+    with metrics.timer("near_duplicate"):
+        image_hash = index.hash(image)
+        results = index.lookup(image_hash, height, width)
+    if results is not None:
+        future = Future()
+        future.set_result(results)
+        return future
+
+    def on_done(done: Future):
+        if done.exception() is None:
+            index.add(image_hash, height, width, done.result())
+
+    future = _submit_page(image)
+    future.add_done_callback(on_done)
+    return future
+
+def _submit_page(image: np.ndarray) -> Future:
+    if not (config.TILING_ENABLED and max(image.shape[:2]) > config.TILE_MIN_EDGE):
+        return _submit_resized(image)
+    future = Future()
+    try:
+        future.set_result(_detect_tiled(image))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def _submit_resized(image: np.ndarray) -> Future:
+    height, width = image.shape[:2]
+    with metrics.timer("resize"):
+        model_image = _fit_input_size(image)
+    future = _submit_model(model_image)
+    if model_image is image:
+        return future
+
+    scale_x = width / model_image.shape[1]
+    scale_y = height / model_image.shape[0]
+    scaled = Future()
+
+    def on_done(done: Future):
+        if done.exception() is not None:
+            scaled.set_exception(done.exception())
+        else:
+            scaled.set_result(scale_detections(done.result(), scale_x, scale_y))
+
+    future.add_done_callback(on_done)
+    return scaled
+
+def _detect_tiled(image: np.ndarray) -> list:
+    """
+    Detects on an oversized page as overlapping tiles, each resized to the model input size on its own
+    so that details survive, plus the whole page downscaled for drawings larger than a tile.
+    Detections of the same drawing on several tiles and on the whole page are merged
+    (see `inference/tiling.py`).
+
+    Tiles are cut and submitted lazily with at most `config.BATCH_MAX_SIZE` in flight, which fills
+    the batches while memory stays bounded by the tile size whatever the size of the page.
+    Blocks until the page is done.
+    """
+    height, width = image.shape[:2]
+    tiles = tile_grid(height, width, config.TILE_SIZE, config.TILE_OVERLAP)
+    metrics.TILES.inc(len(tiles))
+    logger.info(f"[Inference] Tiling a {width}x{height} page into {len(tiles)} tiles")
+    results, cut = [], []
+
+    def collect(tile, future: Future):
+        xmin, ymin = tile[:2]
+        for result in future.result():
+            box = result["box"]
+            box = [box[0] + xmin, box[1] + ymin, box[2] + xmin, box[3] + ymin]
+            results.append({**result, "box": box})
+            # the whole page has no edges inside the page, its detections are never cut
+            cut.append(cut_by_seam(box, tile, height, width))
+
+    in_flight = deque([((0, 0, width, height), _submit_resized(image))])
+    for tile in tiles:
+        xmin, ymin, xmax, ymax = tile
+        in_flight.append((tile, _submit_resized(np.ascontiguousarray(image[ymin:ymax, xmin:xmax]))))
+        if len(in_flight) > config.BATCH_MAX_SIZE:
+            collect(*in_flight.popleft())
+    while in_flight:
+        collect(*in_flight.popleft())
+    return merge_detections(results, cut, config.TILE_MERGE, config.TILE_MERGE_THRESHOLD)
+
+def _fit_input_size(image: np.ndarray) -> np.ndarray:
+    height, width = image.shape[:2]
+    new_height, new_width = shortest_edge_size(height, width, config.MODEL_INPUT_MIN_SIZE, config.MODEL_INPUT_MAX_SIZE)
+    if new_height >= height:
+        # the model upsamples small images itself
+        return image
+    return resize_shortest_edge(image, config.MODEL_INPUT_MIN_SIZE, config.MODEL_INPUT_MAX_SIZE)
+
+def _submit_model(image: np.ndarray) -> Future:
+    batch_predictor = get_batch_predictor()
+    cache = get_detection_cache()
+    if cache is None:
+        return batch_predictor.submit(image)
+    return cache.get_or_submit(cache.key(image), lambda: batch_predictor.submit(image))
+
+def _postprocess(image: np.ndarray, results: list, draw: bool):
     if not results:
         logger.info("[Inference] No drawings detected in the image.")
         return None
+    metrics.DETECTIONS.inc(len(results))
     if not draw:
         return results
-    else:
-        logger.info("[Inference] Drawing boxes on the image...")
-        draw_image = image.copy()
-        draw_obj = ImageDraw.Draw(draw_image)
-        font = ImageFont.load_default()
+    return draw_boxes(image, results)
 
-        for result in results:
-            box = result["box"]
-            score = result["score"]
-            class_id = result["class"]
-            label = f"Class {class_id} ({score:.2f})"
-            draw_obj.rectangle(box, outline="red", width=2)
-            draw_obj.text((box[0]+5, box[1]-15), label, fill="red", font=font)
-
-        logger.info("[Inference] Completed drawing boxes on the image.")
-        return draw_image
\ No newline at end of file
+def draw_boxes(image: np.ndarray, results: list) -> np.ndarray:
+    """
+    Draws detected boxes and their scores on the image itself, without copying it.
+
+    Args:
+        image (np.ndarray): The input BGR image.
+        results (list): Detections as returned by `inference_image`.
+
+    Returns:
+        np.ndarray: The annotated image.
+    """
+    logger.info("[Inference] Drawing boxes on the image...")
+    with metrics.timer("draw"):
+        draw_image = _draw_boxes(image, results)
+    logger.info("[Inference] Completed drawing boxes on the image.")
+    return draw_image
+
+def _draw_boxes(image: np.ndarray, results: list) -> np.ndarray:
+    red = (0, 0, 255)
+    for result in results:
+        xmin, ymin, xmax, ymax = map(int, result["box"])
+        score = result["score"]
+        class_id = result["class"]
+        label = f"Class {class_id} ({score:.2f})"
+        cv2.rectangle(image, (xmin, ymin), (xmax, ymax), red, 2)
+        cv2.putText(image, label, (xmin + 5, ymin - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, red, 1, cv2.LINE_AA)
+    return image
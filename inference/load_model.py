@@ -1,26 +1,249 @@
+import functools
+import threading
+import time
 import utility.config as config
+from utility import metrics
+from utility.utils import get_logger
 
-# This module initializes a Detectron2 predictor with the specified configuration.
+logger = get_logger(__name__)
+
+# This module initializes the inference backend (detectron2, TorchScript or ONNX Runtime) with the specified configuration.
 # It ensures that the predictor is created only once and can be reused across multiple calls.
 predictor = None
+predictor_lock = threading.Lock()
+batch_predictor = None
+worker_pool = None
+batch_predictor_lock = threading.Lock()
+detection_cache = None
+detection_cache_lock = threading.Lock()
+near_duplicate_index = None
+near_duplicate_index_lock = threading.Lock()
+# Set once the model is loaded and warmed up, see `warm_up`
+model_ready = threading.Event()
+startup_timings = {}
+startup_error = None
+
+@functools.lru_cache(maxsize=None)
+def _base_cfg(base_config_path: str):
+    from detectron2.config import get_cfg
+    from detectron2 import model_zoo
+
+    cfg = get_cfg()
+    cfg.merge_from_file(model_zoo.get_config_file(base_config_path))
+    return cfg
+
+def build_cfg():
+    """
+    Builds the detectron2 config of the model from the base config and `utility/config.py`.
+    The base config is merged once per process, later calls start from a copy of it.
+    """
+    cfg = _base_cfg(config.BASE_CONFIG_PATH).clone()
+    cfg.MODEL.WEIGHTS = config.MODEL_PATH
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = config.SCORE_THRESHOLD
+    cfg.MODEL.ROI_HEADS.NMS_THRESH_TEST = config.NMS_THRESHOLD
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = config.NUM_CLASSES
+    cfg.MODEL.DEVICE = config.device
+    cfg.INPUT.MIN_SIZE_TEST = config.MODEL_INPUT_MIN_SIZE
+    cfg.INPUT.MAX_SIZE_TEST = config.MODEL_INPUT_MAX_SIZE
+    return cfg
+
+def load_checkpoint(model, weights_path: str):
+    """
+    Loads the weights of a detectron2 checkpoint into `model`.
+
+    Checkpoints in the zip format of `torch.save` are memory-mapped instead of read and
+    unpickled into memory, so tensors are only paged in as they are copied into the model.
+    Legacy checkpoints, and torch versions without `mmap`, are read as usual.
+    """
+    import torch
+    from detectron2.checkpoint import DetectionCheckpointer
+
+    class MmapCheckpointer(DetectionCheckpointer):
+        def _torch_load(self, f):
+            try:
+                return torch.load(f, map_location="cpu", mmap=True)
+            except (RuntimeError, TypeError) as e:
+                logger.info(f"[Model] Reading {f} without memory-mapping: {e}")
+                return super()._torch_load(f)
+
+    MmapCheckpointer(model).load(weights_path)
+
+def build_detectron2_predictor():
+    from detectron2.engine import DefaultPredictor
+
+    cfg = build_cfg()
+    weights_path = cfg.MODEL.WEIGHTS
+    # the predictor starts from randomly initialized weights, overwritten by `load_checkpoint`
+    cfg.MODEL.WEIGHTS = ""
+    model = DefaultPredictor(cfg)
+    load_checkpoint(model.model, weights_path)
+    model.cfg.MODEL.WEIGHTS = weights_path
+    return model
 
 def get_predictor():
+    """
+    Returns the inference backend selected by `config.BACKEND`.
+    Every backend exposes `predict_batch(images)`, see `inference/backends.py`.
+    """
     global predictor
     if predictor is None:
-        try:
-            from detectron2.engine import DefaultPredictor
-            from detectron2.config import get_cfg
-            from detectron2 import model_zoo
-
-            cfg = get_cfg()
-            cfg.merge_from_file(model_zoo.get_config_file(config.BASE_CONFIG_PATH))
-            cfg.MODEL.WEIGHTS = config.MODEL_PATH
-            cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = config.SCORE_THRESHOLD
-            cfg.MODEL.ROI_HEADS.NMS_THRESH_TEST = config.NMS_THRESHOLD
-            cfg.MODEL.ROI_HEADS.NUM_CLASSES = config.NUM_CLASSES
-            cfg.MODEL.DEVICE = config.device
-
-            predictor = DefaultPredictor(cfg)
-        except Exception as e:
-            raise RuntimeError(f"Failed to initialize predictor: {str(e)}")
-    return predictor
\ No newline at end of file
+        with predictor_lock:
+            if predictor is None:
+                try:
+                    from inference.backends import create_backend
+
+                    predictor = create_backend(config.BACKEND, build_detectron2_predictor)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to initialize predictor: {str(e)}")
+    return predictor
+
+def get_batch_predictor():
+    """
+    Returns the shared `BatchPredictor` wrapping the model of `get_predictor()`.
+    Images submitted to it from concurrent requests are run through the model together,
+    either in this process or, if `config.INFERENCE_WORKERS` is set, in a pool of worker processes.
+    """
+    global batch_predictor, worker_pool
+    if batch_predictor is None:
+        with batch_predictor_lock:
+            if batch_predictor is None:
+                from inference.batching import BatchPredictor
+
+                model = get_predictor()
+                if config.INFERENCE_WORKERS > 0:
+                    from inference.worker_pool import WorkerPool
+
+                    worker_pool = WorkerPool(config.INFERENCE_WORKERS, config.INFERENCE_THREADS_PER_WORKER)
+                    forward = worker_pool.run_batch
+                    concurrency = config.INFERENCE_WORKERS
+                else:
+                    forward = model.predict_batch
+                    concurrency = 1
+                batch_predictor = BatchPredictor(
+                    forward,
+                    max_batch_size=config.BATCH_MAX_SIZE,
+                    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+                    concurrency=concurrency,
+                )
+    return batch_predictor
+
+def get_detection_cache():
+    """
+    Returns the shared `DetectionCache`, or None if caching is disabled.
+    """
+    global detection_cache
+    if not config.DETECTION_CACHE_ENABLED:
+        return None
+    if detection_cache is None:
+        with detection_cache_lock:
+            if detection_cache is None:
+                from inference.cache import DetectionCache, model_fingerprint
+
+                detection_cache = DetectionCache(
+                    model_fingerprint(),
+                    max_entries=config.DETECTION_CACHE_MAX_ENTRIES,
+                    cache_dir=config.DETECTION_CACHE_DIR,
+                )
+    return detection_cache
+
+def get_near_duplicate_index():
+    """
+    Returns the shared `NearDuplicateIndex`, or None if near-duplicate reuse is disabled.
+    """
+    global near_duplicate_index
+    if not config.NEAR_DUPLICATE_ENABLED:
+        return None
+    if near_duplicate_index is None:
+        with near_duplicate_index_lock:
+            if near_duplicate_index is None:
+                from inference.near_duplicates import NearDuplicateIndex
+
+                near_duplicate_index = NearDuplicateIndex(
+                    config.NEAR_DUPLICATE_MAX_DISTANCE,
+                    max_entries=config.NEAR_DUPLICATE_MAX_ENTRIES,
+                    hash_size=config.NEAR_DUPLICATE_HASH_SIZE,
+                )
+    return near_duplicate_index
+
+def warmup_page(height: int, width: int):
+    """
+    Synthetic BGR page with a framed drawing above a few lines of text, for the warm-up passes.
+    """
+    import cv2
+    import numpy as np
+
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    cv2.rectangle(page, (width // 8, height // 10), (width * 7 // 8, height // 2), (0, 0, 0), 3)
+    cv2.circle(page, (width // 2, height * 3 // 10), min(height, width) // 8, (0, 0, 0), 3)
+    for y in range(height * 6 // 10, height * 9 // 10, max(1, height // 40)):
+        cv2.putText(page, "FIG. 1 " * 8, (width // 8, y), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+    return page
+
+def warm_up_model(model) -> float:
+    """
+    Runs `model` on synthetic pages of every size in `config.WARMUP_PAGE_SIZES`, then on a full batch
+    of the first size if it runs batches in one pass, so that kernel selection and allocator growth
+    happen before the first request.
+
+    Returns:
+        float: Seconds spent.
+    """
+    start_time = time.perf_counter()
+    pages = [warmup_page(height, width) for height, width in config.WARMUP_PAGE_SIZES]
+    for page in pages:
+        model.predict_batch([page])
+    if pages and config.BATCH_MAX_SIZE > 1 and model.batched:
+        model.predict_batch([pages[0]] * config.BATCH_MAX_SIZE)
+    return time.perf_counter() - start_time
+
+def load() -> float:
+    """
+    Loads the model and starts the inference worker processes, if any.
+
+    Returns:
+        float: Seconds spent, also kept in `startup_timings`.
+    """
+    start_time = time.perf_counter()
+    get_predictor()
+    get_batch_predictor()
+    startup_timings["model_load_s"] = round(time.perf_counter() - start_time, 3)
+    return startup_timings["model_load_s"]
+
+def warm_up() -> float:
+    """
+    Runs the warm-up passes of `warm_up_model`, in this process or in every inference worker,
+    and sets `model_ready` once done.
+
+    Returns:
+        float: Seconds spent, also kept in `startup_timings`.
+    """
+    start_time = time.perf_counter()
+    if worker_pool is not None:
+        # every worker runs the warm-up passes itself, see `inference/worker_pool.py`
+        worker_pool.wait_ready()
+    else:
+        warm_up_model(get_predictor())
+    startup_timings["warmup_s"] = round(time.perf_counter() - start_time, 3)
+    model_ready.set()
+    return startup_timings["warmup_s"]
+
+def load_and_warm_up() -> dict:
+    """
+    Loads the model and runs the warm-up passes.
+
+    Returns:
+        dict: Seconds spent per step.
+    """
+    load()
+    warm_up()
+    return dict(startup_timings)
+
+def model_status() -> str:
+    """
+    Returns "ready", "loading" or "failed".
+    """
+    if model_ready.is_set():
+        return "ready"
+    return "failed" if startup_error else "loading"
+
+metrics.Gauge("imgextract_model_ready", "1 once the model is loaded and warmed up", lambda: int(model_ready.is_set()))
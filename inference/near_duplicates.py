@@ -0,0 +1,128 @@
+import threading
+
+import cv2
+import numpy as np
+
+from utility.utils import scale_detections
+
+# This module reuses detections across near-duplicate pages.
+# Patent families repeat the same drawing sheets across publications, rasterized with small
+# differences (resolution, anti-aliasing, compression), so their pixels never hash alike.
+# Pages are compared by a difference hash (dHash): the page is averaged down to a small grid of
+# gray levels and every bit tells whether a cell is brighter than its right neighbour. Pages whose
+# hashes differ in at most `max_distance` bits, and whose aspect ratios match, share detections,
+# rescaled to the size of the new page.
+#
+# `test/evaluate.py --near-duplicate-distances ...` measures the hit rate and the change in
+# accuracy for a set of distance thresholds.
+
+MAX_ASPECT_DIFF = 0.02 # Pages whose aspect ratios differ by more than this fraction are never near-duplicates
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8) # Bits set per byte, for numpy < 2.0
+
+
+def page_hash(image: np.ndarray, hash_size: int = 16) -> np.ndarray:
+    """
+    Difference hash of a page.
+
+    Args:
+        image (np.ndarray): The page in BGR.
+        hash_size (int): Size of the grid; the hash has `hash_size` ** 2 bits.
+
+    Returns:
+        np.ndarray: The bits of the hash packed into bytes.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # an exact integer factor first, for which INTER_AREA is fast, then the small grid
+    height, width = gray.shape
+    factor = max(1, min(height, width) // (hash_size * 16))
+    if factor > 1:
+        gray = cv2.resize(
+            gray[:height // factor * factor, :width // factor * factor],
+            (width // factor, height // factor),
+            interpolation=cv2.INTER_AREA,
+        )
+    grid = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(grid[:, 1:] > grid[:, :-1])
+
+
+class NearDuplicateIndex:
+    """
+    Bounded index of page hashes and their detections, searched by Hamming distance.
+    Once full, the oldest pages are replaced first.
+    """
+
+    def __init__(self, max_distance: int, max_entries: int, hash_size: int = 16):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.hash_size = hash_size
+        # hashes are padded to whole 64-bit words, which are compared at once
+        self._hashes = np.zeros((max_entries, (hash_size * hash_size + 63) // 64), dtype=np.uint64)
+        self._aspects = np.zeros(max_entries, dtype=np.float64)
+        self._entries = [None] * max_entries
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def hash(self, image: np.ndarray) -> np.ndarray:
+        return page_hash(image, self.hash_size)
+
+    def _words(self, image_hash: np.ndarray) -> np.ndarray:
+        words = np.zeros(self._hashes.shape[1], dtype=np.uint64)
+        words.view(np.uint8)[:len(image_hash)] = image_hash
+        return words
+
+    @staticmethod
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+        return POPCOUNT[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+    def lookup(self, image_hash: np.ndarray, height: int, width: int):
+        """
+        Find the closest indexed page within `max_distance` bits of `image_hash`.
+
+        Returns:
+            list: Its detections rescaled to a `height` x `width` page, or None if there is no such page.
+        """
+        aspect = width / height
+        with self._lock:
+            count = self._count
+            distances = self._popcount(np.bitwise_xor(self._hashes[:count], self._words(image_hash)))
+            candidates = np.abs(self._aspects[:count] - aspect) <= MAX_ASPECT_DIFF * aspect
+            distances[~candidates] = self.max_distance + 1
+            best = int(np.argmin(distances)) if count else -1
+            if best < 0 or distances[best] > self.max_distance:
+                self._misses += 1
+                return None
+            self._hits += 1
+            source_height, source_width, results = self._entries[best]
+        return scale_detections(results, width / source_width, height / source_height)
+
+    def add(self, image_hash: np.ndarray, height: int, width: int, results: list):
+        """
+        Index the detections of a `height` x `width` page.
+        """
+        with self._lock:
+            slot = self._next
+            self._hashes[slot] = self._words(image_hash)
+            self._aspects[slot] = width / height
+            self._entries[slot] = (height, width, results)
+            self._next = (slot + 1) % self.max_entries
+            self._count = min(self._count + 1, self.max_entries)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counts of the index.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,73 @@
+import math
+
+import utility.config as config
+import utility.pdf as pdf_utils
+import utility.utils as utils
+from inference import inference
+
+logger = utils.get_logger(__name__)
+
+# PDF pipeline shared by the `/inference/pdf` endpoint, PDF jobs and `image-extract batch`:
+# pages are rendered and run through the model as they come, detection runs at
+# PDF_DETECT_DPI and only the detected regions are rendered again at the requested resolution.
+
+
+def iter_pdf_results(pdf_path: str, draw: bool, dpi: int, on_page=None):
+    """
+    Rasterizes the PDF page by page and runs the pages through the model as they are rendered.
+    Blank and text-only pages skip the model. `on_page(page)` is called as each page is processed.
+    """
+    pages = pdf_utils.iter_file_pages(pdf_path, dpi=dpi)
+    images = (image for _, image in pages)
+    for i, (image, result) in enumerate(inference.iter_inference(images, draw=draw, prefilter=True)):
+        logger.info(f"[Inference] Processed page {i+1} of PDF")
+        if on_page is not None:
+            on_page(i+1)
+        yield i+1, image, result
+
+def detect_dpi(dpi: int) -> int:
+    """
+    Returns the resolution pages are rendered at for detection when `dpi` is requested.
+    """
+    return min(dpi, config.PDF_DETECT_DPI) if config.PDF_DETECT_DPI else dpi
+
+def iter_pdf_detections(pdf_path: str, dpi: int, on_page=None):
+    """
+    Detects on pages rendered at the detection resolution (`config.PDF_DETECT_DPI`), which is
+    enough for the model, and scales the boxes to `dpi`.
+
+    Yields:
+        tuple: (page, image at the detection resolution, scale to `dpi`, detections at `dpi`)
+    """
+    scale = dpi / detect_dpi(dpi)
+    for page, image, result in iter_pdf_results(pdf_path, draw=False, dpi=detect_dpi(dpi), on_page=on_page):
+        if result and scale != 1:
+            result = utils.scale_detections(result, scale, scale)
+        yield page, image, scale, result
+
+def iter_pdf_entries(pdf_path: str, mode: str, dpi: int, on_page=None):
+    """
+    Yields (filename, image) zip entries for the pages of a PDF file in `draw` or `extract` mode.
+    In `extract` mode, only the detected regions are rendered at `dpi`.
+    """
+    if mode == "draw":
+        for page, image, _ in iter_pdf_results(pdf_path, draw=True, dpi=dpi, on_page=on_page):
+            yield f"page_{page}.png", image
+        return
+    for page, image, scale, result in iter_pdf_detections(pdf_path, dpi, on_page=on_page):
+        if result is None or not result:
+            logger.warning(f"[Inference] No drawings found in page {page}")
+            continue
+        for j, img in enumerate(page_crops(pdf_path, page, image, scale, result, dpi)):
+            yield f"page_{page}_extracted_{j}.png", img
+
+def page_crops(pdf_path: str, page: int, image, scale: float, result: list, dpi: int) -> list:
+    """
+    Returns the regions of `result` on a page yielded by `iter_pdf_detections`, at `dpi`.
+    """
+    if scale == 1:
+        return utils.get_images(image, result)
+    page_size = (round(image.shape[0] * scale), round(image.shape[1] * scale))
+    boxes = [detection["box"] for detection in result]
+    # boxes detected at the lower resolution are only accurate to one of its pixels
+    return pdf_utils.render_boxes(pdf_path, page, dpi, boxes, page_size, padding=math.ceil(scale))
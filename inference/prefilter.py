@@ -0,0 +1,117 @@
+import math
+import threading
+
+import cv2
+import numpy as np
+
+import utility.config as config
+from utility.utils import get_logger
+
+logger = get_logger(__name__)
+
+# This module decides cheaply whether a page can contain anything the model detects.
+# Most pages of a patent are claims and description: only glyph-sized connected components
+# laid out in text lines. Drawings, tables and displayed equations always bring components
+# that are much taller or wider than a glyph (strokes, rules, fraction bars, integral and
+# sum signs). Pages without any such component, and blank pages, skip the model.
+#
+# `test/prefilter_recall.py` measures how many pages with detections the filter keeps.
+
+PAGE_BLANK = "blank"
+PAGE_TEXT = "text"
+PAGE_CANDIDATE = "candidate"
+
+
+def classify_page(
+    image: np.ndarray,
+    width: int = config.PREFILTER_WIDTH,
+    ink_threshold: int = config.PREFILTER_INK_THRESHOLD,
+    min_ink_ratio: float = config.PREFILTER_MIN_INK_RATIO,
+    tall_factor: float = config.PREFILTER_TALL_FACTOR,
+    wide_factor: float = config.PREFILTER_WIDE_FACTOR,
+) -> str:
+    """
+    Classify a page from the layout of its ink.
+
+    Args:
+        image (np.ndarray): The page in BGR.
+        width (int): Maximum width the page is downsampled to before the analysis.
+        ink_threshold (int): Gray level below which a pixel is ink.
+        min_ink_ratio (float): Pages with a smaller fraction of ink pixels are blank.
+        tall_factor (float): Components taller than this many glyph heights are candidates.
+        wide_factor (float): Components wider than this many glyph heights are candidates.
+
+    Returns:
+        str: `PAGE_BLANK`, `PAGE_TEXT` or `PAGE_CANDIDATE`.
+    """
+    # box-filtered integer downsampling is the cheapest resize of the full page; OpenCV only
+    # takes its fast path for exact integer factors, so the last few rows and columns are dropped
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    factor = max(1, math.ceil(gray.shape[1] / width))
+    height, page_width = gray.shape[0] // factor, gray.shape[1] // factor
+    gray = cv2.resize(gray[:height * factor, :page_width * factor], (page_width, height), interpolation=cv2.INTER_AREA)
+    ink = (gray < ink_threshold).astype(np.uint8)
+    if ink.mean() < min_ink_ratio:
+        return PAGE_BLANK
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:]  # label 0 is the background
+    stats = stats[stats[:, cv2.CC_STAT_AREA] > 2]  # specks and scan noise
+    if len(stats) == 0:
+        return PAGE_BLANK
+
+    # glyphs make up most components of a text page, so their median height is the glyph height
+    glyph_height = max(2.0, float(np.median(stats[:, cv2.CC_STAT_HEIGHT])))
+    tall = stats[:, cv2.CC_STAT_HEIGHT] > tall_factor * glyph_height
+    wide = stats[:, cv2.CC_STAT_WIDTH] > wide_factor * glyph_height
+    if np.any(tall | wide):
+        return PAGE_CANDIDATE
+    return PAGE_TEXT
+
+
+class PageFilter:
+    """
+    Skips the model for pages classified as blank or text only, and counts them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {PAGE_BLANK: 0, PAGE_TEXT: 0, PAGE_CANDIDATE: 0}
+
+    def has_candidates(self, image: np.ndarray) -> bool:
+        """
+        Returns:
+            bool: False if the page can be skipped.
+        """
+        page_class = classify_page(image)
+        with self._lock:
+            self._counts[page_class] += 1
+        return page_class == PAGE_CANDIDATE
+
+    def stats(self) -> dict:
+        with self._lock:
+            pages = sum(self._counts.values())
+            skipped = self._counts[PAGE_BLANK] + self._counts[PAGE_TEXT]
+            return {
+                "pages": pages,
+                "skipped": skipped,
+                "skipped_blank": self._counts[PAGE_BLANK],
+                "skipped_text": self._counts[PAGE_TEXT],
+                "skip_rate": round(skipped / pages, 4) if pages else 0.0,
+            }
+
+
+page_filter = None
+page_filter_lock = threading.Lock()
+
+def get_page_filter():
+    """
+    Returns the page pre-filter, or None if it is disabled.
+    """
+    global page_filter
+    if not config.PREFILTER_ENABLED:
+        return None
+    with page_filter_lock:
+        if page_filter is None:
+            page_filter = PageFilter()
+        return page_filter
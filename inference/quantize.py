@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import numpy as np
+
+import utility.config as config
+from inference.backends import OnnxRuntimeBackend, export_metadata_path, resize_shortest_edge
+from utility.utils import get_logger, read_image
+
+# the accuracy gate reuses the validation scripts in test/
+sys.path.append(config.TEST_DIR)
+
+logger = get_logger(__name__)
+
+# Builds an INT8 copy of the ONNX export (see `inference/export_model.py`) with ONNX Runtime's
+# quantization tools and only keeps it if it passes an accuracy gate against test/ground_truth.json.
+#
+#   python inference/quantize.py --mode static --calibration-dir /path/to/sample/pages
+#
+# - "dynamic": INT8 weights of the fully connected layers (ROI box head); activations stay float.
+#   No calibration needed.
+# - "static" : INT8 weights and activations of the convolutions (ResNet-50 FPN backbone) and the
+#   fully connected layers, with activation ranges calibrated over sample pages.
+#
+# The quantized model is served by the onnxruntime backend when `QUANTIZATION` is set:
+#   INFERENCE_BACKEND=onnxruntime QUANTIZATION=static poetry run service
+
+
+class PageCalibrationReader:
+    """
+    Feeds sample pages, preprocessed like the onnxruntime backend, to ONNX Runtime's calibrator.
+    """
+
+    def __init__(self, image_paths: list, input_name: str, min_size: int, max_size: int):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.min_size = min_size
+        self.max_size = max_size
+        self._index = 0
+
+    def get_next(self):
+        if self._index >= len(self.image_paths):
+            return None
+        image = read_image(self.image_paths[self._index])
+        self._index += 1
+        image = resize_shortest_edge(image, self.min_size, self.max_size)
+        return {self.input_name: np.ascontiguousarray(image.astype(np.float32).transpose(2, 0, 1))}
+
+    def rewind(self):
+        self._index = 0
+
+
+def list_images(directory: str, limit: int) -> list:
+    images = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff"))
+    )
+    return images[:limit]
+
+def quantize(mode: str, source_path: str, output_path: str, calibration_images: list):
+    """
+    Quantize an ONNX model to INT8.
+
+    Args:
+        mode (str): "dynamic" or "static".
+        source_path (str): Path to the float ONNX export.
+        output_path (str): Path to write the quantized model to.
+        calibration_images (list): Sample pages used to calibrate activations in static mode.
+    """
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    preprocessed_path = output_path + ".pre.onnx"
+    # shape inference and graph cleanups that the quantizer relies on
+    quant_pre_process(source_path, preprocessed_path, skip_symbolic_shape=True)
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(
+                preprocessed_path,
+                output_path,
+                op_types_to_quantize=["MatMul", "Gemm"],
+                weight_type=QuantType.QInt8,
+            )
+        else:
+            if not calibration_images:
+                raise ValueError("Static quantization needs calibration pages")
+            logger.info(f"[Quantize] Calibrating on {len(calibration_images)} pages")
+            reader = PageCalibrationReader(calibration_images, "image", config.MODEL_INPUT_MIN_SIZE, config.MODEL_INPUT_MAX_SIZE)
+            quantize_static(
+                preprocessed_path,
+                output_path,
+                reader,
+                quant_format=QuantFormat.QDQ,
+                op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+    finally:
+        if os.path.exists(preprocessed_path):
+            os.unlink(preprocessed_path)
+    shutil.copyfile(export_metadata_path(source_path), export_metadata_path(output_path))
+    logger.info(f"[Quantize] Saved {mode} INT8 model to {output_path}")
+
+def accuracy_gate(model_path: str) -> bool:
+    """
+    Check a quantized model against test/ground_truth.json with the tolerances of
+    `test/validate_model_iou.py` (BBOX_DIFF_THRESH, SCORE_DIFF_THRESH) and report
+    its metrics from `test/calculate_metrics.py`.
+
+    Returns:
+        bool: True if every test image matches ground truth within tolerances.
+    """
+    from calculate_metrics import DetectionEvaluator
+    from validate_model_iou import validate_entries
+
+    backend = OnnxRuntimeBackend(model_path)
+    predictions = []
+
+    def predict(image):
+        results = backend.predict_batch([image])[0]
+        predictions.append(results)
+        return results
+
+    with open(config.TEST_JSON_PATH, "r") as fp:
+        test_data = json.load(fp)
+    failures = validate_entries(predict, test_data)
+
+    evaluator = DetectionEvaluator()
+    for results, gt_data in zip(predictions, test_data.values()):
+        evaluator.add(results, [{"box": box} for box in gt_data["boxes"]])
+    summary = evaluator.summarize()
+    logger.info(
+        f"[Quantize] Precision: {summary['Precision@0.50']:.3f}, Recall: {summary['Recall@0.50']:.3f}, "
+        f"F1: {summary['F1@0.50']:.3f}, mAP@[0.50:0.95]: {summary['mAP@[0.50:0.95]']:.3f}"
+    )
+
+    if failures:
+        logger.error(f"[Quantize] Accuracy gate failed for {failures}")
+        return False
+    logger.info("[Quantize] Accuracy gate passed")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and validate an INT8 quantized model.")
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    parser.add_argument("--calibration-dir", default=config.TEST_IMAGE_DIR, help="Directory of sample pages for calibration")
+    parser.add_argument("--calibration-size", type=int, default=64, help="Maximum number of calibration pages")
+    args = parser.parse_args()
+
+    output_path = config.QUANTIZED_MODEL_PATHS[args.mode]
+    calibration_images = list_images(args.calibration_dir, args.calibration_size)
+    quantize(args.mode, config.ONNX_MODEL_PATH, output_path, calibration_images)
+
+    if not accuracy_gate(output_path):
+        # never leave a model behind that the service could pick up
+        os.unlink(output_path)
+        os.unlink(export_metadata_path(output_path))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
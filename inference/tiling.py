@@ -0,0 +1,125 @@
+import numpy as np
+
+# This module holds the geometry of tiled inference on oversized pages (large-format scans,
+# A0 engineering drawings), see `_detect_tiled` in `inference/inference.py`.
+# Such pages are run as overlapping tiles at close to their full resolution, next to the whole
+# page downscaled to the model input size, so the same drawing is usually detected several
+# times: whole on the downscaled page, and in pieces by the tiles it spans. The pieces are
+# matched by their intersection over the smaller box (a piece lies mostly inside the whole
+# box), and pieces cut by a tile seam are matched with any box they touch across the seam.
+
+MERGE_METHODS = ["nms", "fusion"]
+SEAM_MARGIN = 0.01 # Boxes this close to an inner tile edge, as a fraction of the tile size, are cut by the seam
+
+
+def tile_grid(height: int, width: int, tile_size: int, overlap: int) -> list:
+    """
+    Overlapping tiles covering a page. Tiles are `tile_size` square, except on pages smaller
+    than a tile, and the last tile of every row and column is aligned to the page border.
+
+    Returns:
+        list: Tiles as (xmin, ymin, xmax, ymax).
+    """
+    if overlap >= tile_size:
+        raise ValueError(f"Tile overlap ({overlap}) must be smaller than the tile size ({tile_size})")
+
+    def starts(length: int) -> list:
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, tile_size - overlap))
+        return positions + [length - tile_size]
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+def cut_by_seam(box: list, tile: tuple, height: int, width: int) -> bool:
+    """
+    Whether a box detected on `tile` touches one of its edges inside the page, i.e. was
+    probably cut by the tile and continues on a neighbouring tile.
+    """
+    xmin, ymin, xmax, ymax = tile
+    margin = SEAM_MARGIN * max(xmax - xmin, ymax - ymin)
+    return (
+        (xmin > 0 and box[0] - xmin <= margin)
+        or (ymin > 0 and box[1] - ymin <= margin)
+        or (xmax < width and xmax - box[2] <= margin)
+        or (ymax < height and ymax - box[3] <= margin)
+    )
+
+def merge_detections(results: list, cut: list, method: str = "fusion", threshold: float = 0.5) -> list:
+    """
+    Merge the detections of a tiled page that belong to the same object.
+
+    Two detections of the same class match if their intersection covers at least `threshold`
+    of the smaller box, or if both were cut by a tile seam and intersect.
+
+    Args:
+        results (list): Detections in page coordinates, from all tiles and the whole page.
+        cut (list): Per detection, whether it was cut by a tile seam (see `cut_by_seam`).
+        method (str): "nms" keeps the highest scoring detection of every group of matching ones,
+            "fusion" replaces the group, including chains of matches, by its enclosing box with the highest score.
+        threshold (float): Intersection over the smaller box at which detections match.
+
+    Returns:
+        list: The merged detections, by decreasing score.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Unknown merge method '{method}'. Choose from {MERGE_METHODS}.")
+    if not results:
+        return []
+
+    order = sorted(range(len(results)), key=lambda i: results[i]["score"], reverse=True)
+    results = [results[i] for i in order]
+    cut = np.array([cut[i] for i in order])
+    boxes = np.array([result["box"] for result in results], dtype=np.float64)
+    classes = np.array([result["class"] for result in results])
+
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    inter_w = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    inter_h = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    smaller = np.maximum(np.minimum(areas[:, None], areas[None, :]), 1e-9)
+    match = (intersection / smaller >= threshold) | ((intersection > 0) & cut[:, None] & cut[None, :])
+    match &= classes[:, None] == classes[None, :]
+
+    if method == "nms":
+        suppressed = np.zeros(len(results), dtype=bool)
+        merged = []
+        for i, result in enumerate(results):
+            if suppressed[i]:
+                continue
+            merged.append(result)
+            suppressed |= match[i]
+        return merged
+
+    # fusion: connected groups of matching detections, the first of a group has its highest score
+    group = list(range(len(results)))
+
+    def find(i: int) -> int:
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(match, 1))):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            group[max(root_i, root_j)] = min(root_i, root_j)
+
+    merged = {}
+    for i, result in enumerate(results):
+        root = find(i)
+        if root not in merged:
+            merged[root] = {**result, "box": boxes[i].tolist()}
+            continue
+        box = merged[root]["box"]
+        merged[root]["box"] = [
+            float(min(box[0], boxes[i, 0])),
+            float(min(box[1], boxes[i, 1])),
+            float(max(box[2], boxes[i, 2])),
+            float(max(box[3], boxes[i, 3])),
+        ]
+    return list(merged.values())
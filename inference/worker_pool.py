@@ -0,0 +1,249 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection, resource_tracker, shared_memory
+
+import numpy as np
+
+from utility.utils import get_logger
+
+logger = get_logger(__name__)
+
+# This module runs inference in a pool of worker processes.
+# Workers are forked after the model weights are loaded in the parent, so the weights
+# are shared copy-on-write instead of being loaded once per worker. Each worker is
+# pinned to its own slice of cores with a matching torch thread count, and runs the warm-up
+# passes itself: kernels selected and memory allocated by a forward pass in the parent would not
+# carry over to the workers, and torch's thread pools must not be started before forking.
+# Images travel to the workers through shared memory; only small descriptors and the
+# resulting detections are pickled, on a pipe of each worker: a worker killed while writing to a
+# queue shared with the others would leave its lock held and stall them all.
+# A worker that dies is replaced by a spawned process rather than a fork: by then the API
+# process runs many threads and an initialized torch runtime, and forking it could deadlock
+# the child. The replacement loads the weights itself and warms up before taking batches.
+
+
+class WorkerError(RuntimeError):
+    """Raised for batches whose worker process died before returning results."""
+
+
+def _worker_main(index: int, cores: list, num_threads: int, task_queue, result_pipe, ready, load_predictor=None):
+    """
+    Entry point of a worker process: runs the batches sent on `task_queue`
+    through the predictor of `load_predictor` (by default the inherited one of `get_predictor`)
+    and sends detections on `result_pipe`. Sets `ready` once the warm-up passes are done.
+    """
+    import torch
+    from inference.load_model import get_predictor, warm_up_model
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    predictor = (load_predictor or get_predictor)()
+    warmup_s = warm_up_model(predictor)
+    ready.set()
+    logger.info(f"[Worker {index}] Ready on cores {cores} with {num_threads} threads after {warmup_s:.2f}s of warm-up (pid {os.getpid()})")
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, frames = task
+        segments = []
+        images = []
+        try:
+            for name, shape, dtype in frames:
+                segment = shared_memory.SharedMemory(name=name)
+                segments.append(segment)
+                images.append(np.ndarray(shape, dtype=dtype, buffer=segment.buf))
+            results = predictor.predict_batch(images)
+            result_pipe.send((task_id, results, None))
+        except Exception as e:
+            result_pipe.send((task_id, None, f"{type(e).__name__}: {e}"))
+        finally:
+            # views must be released before the segments can be closed
+            images.clear()
+            for segment in segments:
+                segment.close()
+
+
+def split_cores(num_workers: int) -> list:
+    """
+    Split the cores available to this process into one contiguous slice per worker.
+
+    Args:
+        num_workers (int): Number of worker processes.
+
+    Returns:
+        list: One list of core ids per worker.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cores) // num_workers)
+    return [cores[i * per_worker:(i + 1) * per_worker] or cores for i in range(num_workers)]
+
+
+class WorkerPool:
+    """
+    Pool of inference processes fed through shared memory.
+    Call `run_batch` from any thread; each call is served by one idle worker.
+    """
+
+    def __init__(self, num_workers: int, threads_per_worker: int = 0, load_predictor=None):
+        """
+        Args:
+            num_workers (int): Number of worker processes.
+            threads_per_worker (int): Torch threads per worker, defaults to the size of its core slice.
+            load_predictor: Function called in every worker to get its predictor, defaults to
+                `inference.load_model.get_predictor`. It must be picklable, for the spawned replacements.
+        """
+        self.num_workers = num_workers
+        self._load_predictor = load_predictor
+        # queues and events must also be usable by spawned replacements
+        self._context = mp.get_context("spawn")
+        self._core_slices = split_cores(num_workers)
+        self._threads = [threads_per_worker or len(cores) for cores in self._core_slices]
+        self._task_queues = [None] * num_workers
+        self._result_pipes = [None] * num_workers
+        self._processes = [None] * num_workers
+        self._ready = [None] * num_workers
+        self._assigned = [dict() for _ in range(num_workers)]
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+
+        # make workers share the parent's tracker so they don't unlink segments they only attach to
+        resource_tracker.ensure_running()
+        fork = mp.get_context("fork")
+        for index in range(num_workers):
+            self._task_queues[index], self._result_pipes[index], self._processes[index], self._ready[index] = self._start_worker(index, fork)
+            self._idle.put(index)
+        self._collector = threading.Thread(target=self._collect, name="worker-pool-results", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, index: int, context) -> tuple:
+        """
+        Start worker `index` as a process of `context` ("fork" or "spawn").
+
+        Returns:
+            tuple: (task queue, result pipe, process, ready event) of the worker.
+        """
+        task_queue = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        ready = self._context.Event()
+        process = context.Process(
+            target=_worker_main,
+            args=(index, self._core_slices[index], self._threads[index], task_queue, writer, ready, self._load_predictor),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # the worker holds the only write end, so that its pipe reports EOF once it dies
+        writer.close()
+        return task_queue, reader, process, ready
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        """
+        Wait until every worker has finished its warm-up passes.
+
+        Returns:
+            bool: False if `timeout` seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for index in range(self.num_workers):
+            # a worker restarted meanwhile is waited for through its new event
+            while not self._ready[index].wait(timeout=1.0):
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+        return True
+
+    def run_batch(self, images: list) -> list:
+        """
+        Run a batch of images on an idle worker and wait for its detections.
+
+        Args:
+            images (list): List of HxWxC uint8 numpy arrays.
+
+        Returns:
+            list: One list of detections per input image.
+        """
+        segments = []
+        index = self._idle.get()
+        try:
+            frames = []
+            for image in images:
+                segment = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+                segments.append(segment)
+                np.ndarray(image.shape, dtype=image.dtype, buffer=segment.buf)[...] = image
+                frames.append((segment.name, image.shape, image.dtype.str))
+
+            future = Future()
+            task_id = next(self._task_ids)
+            # under the lock, so that a task is never sent to a worker being replaced after its futures were failed
+            with self._lock:
+                self._assigned[index][task_id] = future
+                self._task_queues[index].put((task_id, frames))
+            return future.result()
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+            self._idle.put(index)
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while not self._closed:
+            if time.monotonic() - last_check > 1.0:
+                self._check_workers()
+                last_check = time.monotonic()
+            with self._lock:
+                pipes = {pipe: index for index, pipe in enumerate(self._result_pipes) if pipe is not None}
+            for pipe in connection.wait(list(pipes), timeout=1.0):
+                index = pipes[pipe]
+                try:
+                    task_id, results, error = pipe.recv()
+                except (EOFError, OSError):
+                    # the worker died, `_check_workers` replaces it
+                    with self._lock:
+                        if self._result_pipes[index] is pipe:
+                            self._result_pipes[index] = None
+                    pipe.close()
+                    continue
+                with self._lock:
+                    future = self._assigned[index].pop(task_id, None)
+                if future is None:
+                    continue
+                if error is None:
+                    future.set_result(results)
+                else:
+                    future.set_exception(RuntimeError(error))
+
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if process.is_alive() or self._closed:
+                continue
+            logger.error(f"[WorkerPool] Worker {index} exited with code {process.exitcode}, restarting")
+            replacement = self._start_worker(index, self._context)
+            with self._lock:
+                lost = self._assigned[index]
+                self._assigned[index] = {}
+                old_pipe = self._result_pipes[index]
+                self._task_queues[index], self._result_pipes[index], self._processes[index], self._ready[index] = replacement
+            if old_pipe is not None:
+                old_pipe.close()
+            for future in lost.values():
+                future.set_exception(WorkerError(f"Inference worker {index} died"))
+
+    def shutdown(self):
+        self._closed = True
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
@@ -0,0 +1,291 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import numpy as np
+from PIL import Image
+
+import inference.load_model as load_model
+import utility.config as config
+import utility.pdf as pdf_utils
+import utility.utils as utils
+from inference.inference import draw_boxes, inference_image, inference_images, iter_inference
+
+# In-process performance benchmark of the inference paths, compared against a committed baseline.
+#
+#   python test/benchmark.py                                  # run, write test/benchmark_results.json, compare
+#   python test/benchmark.py --batch-sizes 1 4 8 --threads 1 4
+#   python test/benchmark.py --update-baseline                # record test/benchmark_baseline.json
+#
+# Reports:
+#   - cold start: imports, model load, warm-up passes and first inference, measured in a fresh process
+#   - p50/p95/p99 latency per stage over test/samples: decode, inference, draw, extract (crop + zip),
+#     and per page for synthetic multi-page PDFs built from test/samples: render, end to end
+#   - throughput for every batch size (BATCH_MAX_SIZE) x torch thread count; the exported backends
+#     run batches one image at a time, which `environment.batched_forward` records
+#   - encoding throughput and size of every output format, serial and on the encoding threads
+#   - peak RSS of the benchmark process
+#
+# The model runs in this process (INFERENCE_WORKERS is ignored) and the detection cache is
+# disabled so that every image reaches the model. Any metric that is more than `--tolerance`
+# worse than the baseline is reported as a regression and the script exits with status 1, as it
+# does when the baseline has no metrics to compare against.
+
+BASELINE_PATH = os.path.join(config.TEST_DIR, "benchmark_baseline.json")
+RESULTS_PATH = os.path.join(config.TEST_DIR, "benchmark_results.json")
+SAMPLE_DPI = 300 # Resolution the sample pages are assumed to be scanned at
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def percentiles(name: str, samples: list) -> dict:
+    samples_ms = np.array(samples) * 1000
+    return {
+        f"{name}.p50_ms": round(float(np.percentile(samples_ms, 50)), 1),
+        f"{name}.p95_ms": round(float(np.percentile(samples_ms, 95)), 1),
+        f"{name}.p99_ms": round(float(np.percentile(samples_ms, 99)), 1),
+    }
+
+def load_samples() -> list:
+    samples = []
+    for image_fname in sorted(os.listdir(config.TEST_IMAGE_DIR)):
+        if image_fname.lower().endswith(".png"):
+            with open(os.path.join(config.TEST_IMAGE_DIR, image_fname), "rb") as fp:
+                samples.append(fp.read())
+    return samples
+
+def synthetic_pdf(samples: list, num_pages: int) -> bytes:
+    """
+    Build a PDF of `num_pages` pages cycling through the samples, at `SAMPLE_DPI`.
+    """
+    pages = [Image.open(io.BytesIO(samples[i % len(samples)])).convert("RGB") for i in range(num_pages)]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=SAMPLE_DPI)
+    return buffer.getvalue()
+
+def timed(fn, *args):
+    start_time = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start_time
+
+def timed_iter(iterable):
+    """
+    Yields (item, seconds spent producing it).
+    """
+    iterator = iter(iterable)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item, time.perf_counter() - start_time
+
+def cold_start() -> dict:
+    """
+    Runs in a fresh process (`--cold-start`): times imports, model load, warm-up passes and the first inference.
+    """
+    import_s = time.perf_counter() - PROCESS_START
+    model_load_s = load_model.load()
+    warmup_s = load_model.warm_up()
+    image = utils.decode_image(load_samples()[0])
+    _, first_inference_s = timed(inference_image, image, False)
+    return {
+        "cold_start.import_s": round(import_s, 3),
+        "cold_start.model_load_s": round(model_load_s, 3),
+        "cold_start.warmup_s": round(warmup_s, 3),
+        "cold_start.ready_s": round(import_s + model_load_s + warmup_s, 3),
+        "cold_start.first_inference_s": round(first_inference_s, 3),
+    }
+
+def run_cold_start() -> dict:
+    start_time = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--cold-start"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    metrics = json.loads(output.strip().splitlines()[-1])
+    metrics["cold_start.process_s"] = round(time.perf_counter() - start_time, 3)
+    return metrics
+
+def benchmark_stages(samples: list, repeats: int) -> dict:
+    stages = {"decode": [], "inference": [], "draw": [], "extract": []}
+    for _ in range(repeats):
+        for data in samples:
+            image, seconds = timed(utils.decode_image, data)
+            stages["decode"].append(seconds)
+            results, seconds = timed(inference_image, image, False)
+            stages["inference"].append(seconds)
+            if not results:
+                continue
+            _, seconds = timed(draw_boxes, image, results)
+            stages["draw"].append(seconds)
+            entries = ((f"{i}.png", crop) for i, crop in enumerate(utils.get_images(image, results)))
+            _, seconds = timed(lambda: sum(len(chunk) for chunk in utils.stream_zip(entries)))
+            stages["extract"].append(seconds)
+
+    metrics = {}
+    for name, samples_s in stages.items():
+        if samples_s:
+            metrics.update(percentiles(name, samples_s))
+    return metrics
+
+def benchmark_pdf(samples: list, num_pages: int, repeats: int) -> dict:
+    pdf_bytes = synthetic_pdf(samples, num_pages)
+    render, page = [], []
+    pdf_s = 0.0
+    for _ in range(repeats):
+        render.extend(seconds for _, seconds in timed_iter(pdf_utils.iter_pages(pdf_bytes)))
+        pages = (image for _, image in pdf_utils.iter_pages(pdf_bytes))
+        start_time = time.perf_counter()
+        page.extend(seconds for _, seconds in timed_iter(iter_inference(pages, draw=False, prefilter=True)))
+        pdf_s += time.perf_counter() - start_time
+    metrics = {**percentiles("pdf_render", render), **percentiles("pdf_page", page)}
+    metrics["pdf.pages_per_s"] = round(num_pages * repeats / pdf_s, 2)
+    return metrics
+
+def benchmark_throughput(samples: list, batch_sizes: list, threads: list, repeats: int) -> dict:
+    import torch
+
+    images = [utils.decode_image(data) for data in samples] * repeats
+    default_threads = torch.get_num_threads()
+    if not load_model.get_predictor().batched:
+        print(f"Note: the {config.BACKEND} backend runs batches one image at a time, batch sizes only change the queueing")
+    metrics = {}
+    for num_threads in threads:
+        torch.set_num_threads(num_threads or default_threads)
+        for batch_size in batch_sizes:
+            config.BATCH_MAX_SIZE = batch_size
+            if load_model.batch_predictor is not None:
+                # stops its batching thread, which would otherwise keep running next to the new one
+                load_model.batch_predictor.close()
+                load_model.batch_predictor = None
+            load_model.get_batch_predictor()
+            # images are submitted concurrently so that batches fill up
+            with ThreadPoolExecutor(max_workers=batch_size) as pool:
+                start_time = time.perf_counter()
+                list(pool.map(lambda image: inference_images([image], False), images))
+                seconds = time.perf_counter() - start_time
+            key = f"throughput.batch_{batch_size}.threads_{num_threads or default_threads}.images_per_s"
+            metrics[key] = round(len(images) / seconds, 2)
+    torch.set_num_threads(default_threads)
+    return metrics
+
+def benchmark_encoding(samples: list, repeats: int) -> dict:
+    """
+    Encoding throughput of every output format, on one thread and on the encoding pool (`config.ENCODE_WORKERS`).
+    """
+    images = [utils.decode_image(data) for data in samples] * repeats
+    pool = utils.get_encode_pool()
+    metrics = {}
+    for image_format in config.ENCODE_FORMATS:
+        encoded, serial_s = timed(lambda: [utils.encode_image(image, image_format) for image in images])
+        _, parallel_s = timed(lambda: list(pool.map(lambda image: utils.encode_image(image, image_format), images)))
+        metrics[f"encode.{image_format}.serial.images_per_s"] = round(len(images) / serial_s, 2)
+        metrics[f"encode.{image_format}.workers_{config.ENCODE_WORKERS}.images_per_s"] = round(len(images) / parallel_s, 2)
+        metrics[f"encode.{image_format}.kb_per_image"] = round(sum(map(len, encoded)) / len(encoded) / 1024, 1)
+    return metrics
+
+def environment() -> dict:
+    import torch
+
+    return {
+        "device": config.device,
+        "backend": config.BACKEND,
+        "batched_forward": load_model.get_predictor().batched,
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare the metrics of `results` with `baseline`.
+
+    Returns:
+        list: Names of the metrics that are more than `tolerance` worse than the baseline.
+    """
+    if baseline.get("environment") != results["environment"]:
+        print(f"Warning: the baseline was recorded on {baseline.get('environment')}")
+
+    regressions = []
+    print(f"{'metric':>55} | {'baseline':>10} | {'current':>10} | change")
+    for name, current in results["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if reference is None:
+            continue
+        change = (current - reference) / reference if reference else 0.0
+        if name.endswith(HIGHER_IS_BETTER):
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>55} | {reference:>10} | {current:>10} | {change:+.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference paths and compare against a baseline.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--pdf-pages", type=int, default=10, help="Pages of the synthetic PDF")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--threads", nargs="+", type=int, default=[0], help="Torch threads, 0 keeps the default")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results to the baseline instead of comparing")
+    parser.add_argument("--cold-start", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    config.INFERENCE_WORKERS = 0
+    config.DETECTION_CACHE_ENABLED = False
+    if args.cold_start:
+        print(json.dumps(cold_start()))
+        return
+
+    samples = load_samples()
+    metrics = run_cold_start()
+    load_model.load_and_warm_up()
+    inference_image(utils.decode_image(samples[0]), draw=False)  # warm-up, not measured
+    metrics.update(benchmark_stages(samples, args.repeats))
+    metrics.update(benchmark_pdf(samples, args.pdf_pages, args.repeats))
+    metrics.update(benchmark_throughput(samples, args.batch_sizes, args.threads, args.repeats))
+    metrics.update(benchmark_encoding(samples, args.repeats))
+    # ru_maxrss is in KB on Linux
+    metrics["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    results = {"environment": environment(), "metrics": metrics}
+    output_path = args.baseline if args.update_baseline else args.output
+    with open(output_path, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"Results written to {output_path}")
+    if args.update_baseline:
+        return
+
+    with open(args.baseline, "r") as fp:
+        baseline = json.load(fp)
+    if not baseline.get("metrics"):
+        print(f"No baseline metrics in {args.baseline}; record them with --update-baseline")
+        sys.exit(1)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Performance regressions: {regressions}")
+        sys.exit(1)
+    print("No performance regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import numpy as np
+from PIL import Image
+
+import inference.load_model as load_model
+import utility.config as config
+import utility.pdf as pdf_utils
+from calculate_metrics import DetectionEvaluator
+from inference.inference import inference_image, iter_inference
+from utility.utils import compare_detections, read_image, scale_detections
+
+# Compares latency and accuracy on test/samples across model input sizes
+# (MODEL_INPUT_MIN_SIZE:MODEL_INPUT_MAX_SIZE) and PDF rendering resolutions.
+#
+#   python test/benchmark_resolution.py --sizes 800:1333 640:1066 480:800 --dpis 300 200 150
+#
+# Accuracy is measured against test/ground_truth.json: precision/recall/F1 at IoU 0.5, mAP@[0.50:0.95] and the
+# number of images matching within BBOX_DIFF_THRESH / SCORE_DIFF_THRESH.
+
+SAMPLE_DPI = 300 # Resolution the sample pages are assumed to be scanned at
+
+
+def reload_model(min_size: int, max_size: int):
+    """
+    Rebuild the model with a new input size; the detection cache is disabled so every run hits the model.
+    """
+    config.MODEL_INPUT_MIN_SIZE = min_size
+    config.MODEL_INPUT_MAX_SIZE = max_size
+    config.DETECTION_CACHE_ENABLED = False
+    load_model.predictor = None
+    load_model.batch_predictor = None
+    load_model.get_batch_predictor()
+
+def score(predictions: dict, test_data: dict, latencies: list) -> dict:
+    evaluator = DetectionEvaluator()
+    matches = 0
+    for image_fname, gt_data in test_data.items():
+        results = predictions.get(image_fname) or []
+        evaluator.add(results, [{"box": box} for box in gt_data["boxes"]])
+        boxes = [result["box"] for result in results]
+        scores = [result["score"] for result in results]
+        if len(boxes) == len(gt_data["boxes"]) and compare_detections(
+            boxes, gt_data["boxes"], scores, gt_data["scores"],
+            bbox_diff_th=config.BBOX_DIFF_THRESH, score_diff_th=config.SCORE_DIFF_THRESH
+        ):
+            matches += 1
+    summary = evaluator.summarize()
+    return {
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_mean_ms": round(float(np.mean(latencies)) * 1000, 1),
+        "precision": round(summary["Precision@0.50"], 3),
+        "recall": round(summary["Recall@0.50"], 3),
+        "f1": round(summary["F1@0.50"], 3),
+        "map": round(summary["mAP@[0.50:0.95]"], 3),
+        "matching_ground_truth": f"{matches}/{len(test_data)}",
+    }
+
+def benchmark_sizes(sizes: list, test_data: dict, repeats: int) -> list:
+    images = {
+        image_fname: read_image(os.path.join(config.TEST_IMAGE_DIR, image_fname))
+        for image_fname in test_data
+    }
+    rows = []
+    for min_size, max_size in sizes:
+        reload_model(min_size, max_size)
+        # warm-up pass, not measured
+        inference_image(next(iter(images.values())), draw=False)
+        predictions, latencies = {}, []
+        for _ in range(repeats):
+            for image_fname, image in images.items():
+                start_time = time.perf_counter()
+                predictions[image_fname] = inference_image(image, draw=False)
+                latencies.append(time.perf_counter() - start_time)
+        rows.append({"input_size": f"{min_size}:{max_size}", **score(predictions, test_data, latencies)})
+    return rows
+
+def sample_pdf(test_data: dict) -> bytes:
+    """
+    Build a PDF with one sample per page, at `SAMPLE_DPI` so that a 300 dpi render reproduces the samples.
+    """
+    pages = [Image.open(os.path.join(config.TEST_IMAGE_DIR, image_fname)).convert("RGB") for image_fname in test_data]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=SAMPLE_DPI)
+    return buffer.getvalue()
+
+def benchmark_dpis(dpis: list, test_data: dict, repeats: int, input_size: tuple) -> list:
+    reload_model(*input_size)
+    pdf_bytes = sample_pdf(test_data)
+    image_fnames = list(test_data)
+    rows = []
+    for dpi in dpis:
+        scale = SAMPLE_DPI / dpi
+        predictions, latencies = {}, []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            pages = pdf_utils.iter_pages(pdf_bytes, dpi=dpi)
+            for i, (_, result) in enumerate(iter_inference((image for _, image in pages), draw=False)):
+                # compare in the coordinates of the samples
+                predictions[image_fnames[i]] = scale_detections(result, scale, scale) if result else None
+            latencies.append((time.perf_counter() - start_time) / len(image_fnames))
+        rows.append({"dpi": dpi, **score(predictions, test_data, latencies)})
+    return rows
+
+def print_table(rows: list):
+    if not rows:
+        return
+    columns = list(rows[0])
+    print(" | ".join(f"{column:>21}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{str(row[column]):>21}" for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency and accuracy across input sizes and PDF DPIs.")
+    parser.add_argument("--sizes", nargs="*", default=["800:1333", "640:1066", "480:800"], help="MIN:MAX model input sizes")
+    parser.add_argument("--dpis", nargs="*", type=int, default=[300, 200, 150], help="PDF rendering resolutions")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with open(config.TEST_JSON_PATH, "r") as fp:
+        test_data = json.load(fp)
+
+    default_size = (config.MODEL_INPUT_MIN_SIZE, config.MODEL_INPUT_MAX_SIZE)
+    sizes = [tuple(int(value) for value in size.split(":")) for size in args.sizes]
+    size_rows = benchmark_sizes(sizes, test_data, args.repeats)
+    print("\nModel input size (per image):")
+    print_table(size_rows)
+
+    dpi_rows = benchmark_dpis(args.dpis, test_data, args.repeats, default_size) if args.dpis else []
+    print("\nPDF rendering resolution (render + inference, per page):")
+    print_table(dpi_rows)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"input_sizes": size_rows, "dpis": dpi_rows}, fp, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
+import argparse
 import json
 import os
 import sys
-from PIL import Image
 import numpy as np
 from typing import List, Tuple
 
@@ -9,155 +9,370 @@ from typing import List, Tuple
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
-from inference.inference import inference_image
 from utility.config import TEST_IMAGE_DIR, TEST_JSON_PATH
-from utility.utils import bbox_iou
+from utility.utils import read_image
+
+# COCO-style evaluation of the detections: predictions are matched to ground truth greedily by
+# score, at every IoU threshold at once, and accumulated over the whole dataset before precision,
+# recall and average precision are computed (instead of averaging per-image scores).
+#
+#   python test/calculate_metrics.py                                   # run the model on test/samples
+#   python test/calculate_metrics.py --predictions predictions.json    # evaluate stored predictions
+#
+# Predictions files map image file names to {"boxes": [...], "scores": [...]}, like test/ground_truth.json.
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+MAX_DETECTIONS = 100
+AREA_RANGES = {
+    "all": (0.0, float("inf")),
+    "small": (0.0, 32.0 ** 2),
+    "medium": (32.0 ** 2, 96.0 ** 2),
+    "large": (96.0 ** 2, float("inf")),
+}
+
+
+def to_boxes(detections: List[dict]) -> np.ndarray:
+    """
+    Stack the "box" of detections into an (N, 4) array of [xmin, ymin, xmax, ymax].
+    """
+    return np.array([detection["box"] for detection in detections], dtype=np.float64).reshape(-1, 4)
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    return (boxes[..., 2] - boxes[..., 0]).clip(0) * (boxes[..., 3] - boxes[..., 1]).clip(0)
+
+def pairwise_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    IoU of every box of `boxes1` with every box of `boxes2`, batched over leading dimensions.
+
+    Args:
+        boxes1: (..., N, 4) array of [xmin, ymin, xmax, ymax]
+        boxes2: (..., M, 4) array of [xmin, ymin, xmax, ymax]
+
+    Returns:
+        (..., N, M) array of IoUs
+    """
+    top_left = np.maximum(boxes1[..., :, None, :2], boxes2[..., None, :, :2])
+    bottom_right = np.minimum(boxes1[..., :, None, 2:], boxes2[..., None, :, 2:])
+    intersection = (bottom_right - top_left).clip(0).prod(axis=-1)
+    union = box_areas(boxes1)[..., :, None] + box_areas(boxes2)[..., None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+def match_detections(ious: np.ndarray, gt_ignore: np.ndarray, iou_thresholds: np.ndarray) -> np.ndarray:
+    """
+    Greedily match score-sorted predictions to ground truth like pycocotools: each prediction takes
+    the unmatched ground truth box with the highest IoU above the threshold, preferring boxes that
+    are not ignored. Predictions of the same rank are matched in every image, area range and IoU
+    threshold at once, so the only loop is over the (at most `MAX_DETECTIONS`) ranks.
+
+    Args:
+        ious: (N, D, G) IoUs of the predictions of N images, sorted by decreasing score, with their
+              ground truth; padding predictions and boxes have an IoU of -1
+        gt_ignore: (N, R, G) ground truth boxes ignored in each row, e.g. outside an area range
+        iou_thresholds: (R,) IoU threshold of each row
+
+    Returns:
+        (N, R, D) index of the matched ground truth box, -1 if none
+    """
+    num_images, num_preds, num_gt = ious.shape
+    num_rows = len(iou_thresholds)
+    matches = np.full((num_images, num_rows, num_preds), -1, dtype=np.int64)
+    if num_gt == 0 or num_preds == 0:
+        return matches
+    matched_gt = np.zeros((num_images, num_rows, num_gt), dtype=bool)
+    images, rows = np.meshgrid(np.arange(num_images), np.arange(num_rows), indexing="ij")
+    for d in range(num_preds):
+        pred_ious = ious[:, d, None, :]  # (N, 1, G)
+        candidates = (pred_ious >= iou_thresholds[None, :, None]) & ~matched_gt
+        # prefer ground truth that is not ignored, fall back to ignored boxes
+        preferred = candidates & ~gt_ignore
+        candidates = np.where(preferred.any(axis=2, keepdims=True), preferred, candidates)
+        best = np.where(candidates, pred_ious, -1.0).argmax(axis=2)  # (N, R)
+        found = candidates[images, rows, best]
+        matches[found, d] = best[found]
+        matched_gt[images[found], rows[found], best[found]] = True
+    return matches
+
+
+class DetectionEvaluator:
+    """
+    Accumulates predictions and ground truth over a dataset and computes COCO detection metrics.
+    """
+
+    def __init__(self, iou_thresholds: np.ndarray = IOU_THRESHOLDS, max_detections: int = MAX_DETECTIONS, chunk_cells: int = 2 ** 22):
+        """
+        Args:
+            iou_thresholds: IoU thresholds to evaluate at
+            max_detections: Highest-scoring predictions kept per image
+            chunk_cells: Maximum (images x predictions x boxes) matched together in one vectorized pass
+        """
+        self.iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+        self.max_detections = max_detections
+        self.chunk_cells = chunk_cells
+        self.num_images = 0
+        self._images = []  # (scores, predicted boxes, ground truth boxes) per image
+        self._evaluated = None
+
+    def add(self, predictions: List[dict], ground_truth: List[dict]):
+        """
+        Add the predictions and ground truth boxes of one image.
+
+        Args:
+            predictions: List of predicted boxes and scores
+            ground_truth: List of ground truth boxes
+        """
+        self.num_images += 1
+        predictions = sorted(predictions or [], key=lambda x: x["score"], reverse=True)[:self.max_detections]
+        scores = np.array([prediction["score"] for prediction in predictions], dtype=np.float64)
+        self._images.append((scores, to_boxes(predictions), to_boxes(ground_truth or [])))
+        self._evaluated = None
+
+    def _evaluate_chunk(self, images: list) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Match a chunk of images, padded to the same number of predictions and boxes.
+
+        Returns:
+            Tuple of the scores (P,), true positive and ignore flags (A, T, P) of the P predictions
+            in the chunk, and the number of ground truth boxes per area range (A,)
+        """
+        num_images = len(images)
+        num_preds = max(len(scores) for scores, _, _ in images)
+        num_gt = max(len(gt_boxes) for _, _, gt_boxes in images)
+        pred_boxes = np.zeros((num_images, num_preds, 4))
+        gt_boxes = np.zeros((num_images, num_gt, 4))
+        pred_valid = np.zeros((num_images, num_preds), dtype=bool)
+        gt_valid = np.zeros((num_images, num_gt), dtype=bool)
+        for i, (scores, preds, gts) in enumerate(images):
+            pred_boxes[i, :len(preds)], pred_valid[i, :len(preds)] = preds, True
+            gt_boxes[i, :len(gts)], gt_valid[i, :len(gts)] = gts, True
+
+        ious = np.where(pred_valid[:, :, None] & gt_valid[:, None, :], pairwise_iou(pred_boxes, gt_boxes), -1.0)
+        pred_areas, gt_areas = box_areas(pred_boxes), box_areas(gt_boxes)
+
+        # every area range and IoU threshold is a row: row = area * T + threshold
+        num_areas, num_thresholds = len(AREA_RANGES), len(self.iou_thresholds)
+        bounds = np.array(list(AREA_RANGES.values()))
+        gt_outside = (gt_areas[:, None, :] < bounds[None, :, :1]) | (gt_areas[:, None, :] > bounds[None, :, 1:])
+        pred_outside = (pred_areas[:, None, :] < bounds[None, :, :1]) | (pred_areas[:, None, :] > bounds[None, :, 1:])
+        matches = match_detections(
+            ious, np.repeat(gt_outside, num_thresholds, axis=1), np.tile(self.iou_thresholds, num_areas)
+        ).reshape(num_images, num_areas, num_thresholds, num_preds)
+
+        matched = matches >= 0
+        matched_ignored = matched & np.take_along_axis(
+            gt_outside[:, :, None, :], matches.clip(0), axis=3
+        ) if num_gt else matched
+        # unmatched predictions outside the area range don't count as false positives
+        ignored = matched_ignored | (~matched & pred_outside[:, :, None, :])
+        true_positives = matched & ~ignored
+
+        # keep the real predictions, in image order: (N, A, T, D) -> (A, T, P)
+        true_positives = true_positives.transpose(1, 2, 0, 3)[:, :, pred_valid]
+        ignored = ignored.transpose(1, 2, 0, 3)[:, :, pred_valid]
+        scores = np.concatenate([scores for scores, _, _ in images])
+        num_gt_per_area = (~gt_outside & gt_valid[:, None, :]).sum(axis=(0, 2))
+        return scores, true_positives, ignored, num_gt_per_area
+
+    def _chunks(self) -> list:
+        """
+        Group images of similar sizes, so that padding them to the same size stays cheap.
+        """
+        sizes = [(max(1, len(scores)), max(1, len(gt_boxes))) for scores, _, gt_boxes in self._images]
+        chunks, chunk = [], []
+        for i in sorted(range(len(sizes)), key=lambda i: sizes[i]):
+            # images are sorted by size, so the padded size is set by the last one
+            if chunk and (len(chunk) + 1) * sizes[i][0] * sizes[i][1] > self.chunk_cells:
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(i)
+        return chunks + [chunk] if chunk else chunks
+
+    def _evaluate(self):
+        if self._evaluated is not None:
+            return self._evaluated
+        num_areas, num_thresholds = len(AREA_RANGES), len(self.iou_thresholds)
+        chunks = self._chunks()
+        results = [self._evaluate_chunk([self._images[i] for i in chunk]) for chunk in chunks]
+        if results:
+            # position of every prediction in image order, so that ties are broken like pycocotools
+            offsets = np.cumsum([0] + [len(scores) for scores, _, _ in self._images])
+            positions = np.concatenate([
+                np.arange(offsets[i], offsets[i + 1]) for chunk in chunks for i in chunk
+            ]).astype(np.int64)
+            scores = np.empty(len(positions))
+            scores[positions] = np.concatenate([result[0] for result in results])
+            true_positives = np.empty((num_areas, num_thresholds, len(positions)), dtype=bool)
+            true_positives[:, :, positions] = np.concatenate([result[1] for result in results], axis=2)
+            ignored = np.empty_like(true_positives)
+            ignored[:, :, positions] = np.concatenate([result[2] for result in results], axis=2)
+            num_gt = np.sum([result[3] for result in results], axis=0)
+        else:
+            scores = np.zeros(0)
+            true_positives = ignored = np.zeros((num_areas, num_thresholds, 0), dtype=bool)
+            num_gt = np.zeros(num_areas, dtype=np.int64)
+        order = np.argsort(-scores, kind="mergesort")
+        self._evaluated = (true_positives[:, :, order], ignored[:, :, order], num_gt)
+        return self._evaluated
+
+    def _accumulate(self, area: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Returns:
+            Tuple of cumulative true positives and false positives, (T, P) over all predictions
+            sorted by decreasing score, and the number of ground truth boxes in the area range
+        """
+        true_positives, ignored, num_gt = self._evaluate()
+        a = list(AREA_RANGES).index(area)
+        false_positives = ~true_positives[a] & ~ignored[a]
+        return np.cumsum(true_positives[a], axis=1), np.cumsum(false_positives, axis=1), int(num_gt[a])
+
+    def average_precision(self, area: str = "all") -> np.ndarray:
+        """
+        Returns:
+            (T,) 101-point interpolated average precision per IoU threshold, nan without ground truth
+        """
+        tp_sum, fp_sum, num_gt = self._accumulate(area)
+        if num_gt == 0:
+            return np.full(len(self.iou_thresholds), np.nan)
+        average_precisions = np.zeros(len(self.iou_thresholds))
+        for t in range(len(self.iou_thresholds)):
+            recall = tp_sum[t] / num_gt
+            precision = tp_sum[t] / np.maximum(tp_sum[t] + fp_sum[t], np.finfo(np.float64).eps)
+            # precision envelope: best precision at this recall or any higher one
+            precision = np.maximum.accumulate(precision[::-1])[::-1]
+            indices = np.searchsorted(recall, RECALL_THRESHOLDS, side="left")
+            valid = indices < len(precision)
+            average_precisions[t] = precision[indices[valid]].sum() / len(RECALL_THRESHOLDS)
+        return average_precisions
+
+    def average_recall(self, area: str = "all") -> np.ndarray:
+        """
+        Returns:
+            (T,) recall with up to `max_detections` predictions per image, nan without ground truth
+        """
+        tp_sum, _, num_gt = self._accumulate(area)
+        if num_gt == 0:
+            return np.full(len(self.iou_thresholds), np.nan)
+        return (tp_sum[:, -1] if tp_sum.shape[1] else np.zeros(len(self.iou_thresholds))) / num_gt
+
+    def _threshold_index(self, iou_threshold: float) -> int:
+        matches = np.flatnonzero(np.isclose(self.iou_thresholds, iou_threshold))
+        if len(matches) == 0:
+            raise ValueError(f"IoU threshold {iou_threshold} is not evaluated, choose from {self.iou_thresholds.tolist()}")
+        return int(matches[0])
+
+    def precision_recall_f1(self, iou_threshold: float = 0.5) -> Tuple[float, float, float]:
+        """
+        Precision, recall and F1 score of all predictions at `iou_threshold`.
+        """
+        tp_sum, fp_sum, num_gt = self._accumulate("all")
+        t = self._threshold_index(iou_threshold)
+        true_positives = int(tp_sum[t, -1]) if tp_sum.shape[1] else 0
+        false_positives = int(fp_sum[t, -1]) if fp_sum.shape[1] else 0
+        if true_positives + false_positives == 0 and num_gt == 0:
+            return 1.0, 1.0, 1.0  # Perfect score if both are empty
+        precision = true_positives / (true_positives + false_positives) if (true_positives + false_positives) > 0 else 0.0
+        recall = true_positives / num_gt if num_gt > 0 else 0.0
+        f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0.0
+        return precision, recall, f1_score
+
+    def summarize(self) -> dict:
+        """
+        Returns:
+            dict: The COCO summary metrics reported in the README, plus precision/recall/F1 at IoU 0.5
+        """
+        average_precisions = self.average_precision("all")
+        precision, recall, f1_score = self.precision_recall_f1(0.5)
+        summary = {
+            "mAP@[0.50:0.95]": float(np.mean(average_precisions)),
+            "mAP@0.50": float(average_precisions[self._threshold_index(0.5)]),
+            "mAP@0.75": float(average_precisions[self._threshold_index(0.75)]),
+        }
+        for area in ("small", "medium", "large"):
+            summary[f"AP ({area})"] = float(np.mean(self.average_precision(area)))
+        summary[f"AR@[0.50:0.95] (max {self.max_detections} detections)"] = float(np.mean(self.average_recall("all")))
+        summary.update({"Precision@0.50": precision, "Recall@0.50": recall, "F1@0.50": f1_score})
+        return summary
+
 
 def calculate_metrics(predictions: List[dict], ground_truth: List[dict], iou_threshold: float = 0.5) -> Tuple[float, float, float]:
     """
-    Calculate precision, recall, and F1 score for object detection.
-    
+    Calculate precision, recall, and F1 score for object detection on one image.
+
     Args:
         predictions: List of predicted boxes and scores
         ground_truth: List of ground truth boxes
         iou_threshold: IoU threshold for considering a detection as correct
-        
+
     Returns:
         Tuple of (precision, recall, f1_score)
     """
-    if not predictions and not ground_truth:
-        return 1.0, 1.0, 1.0  # Perfect score if both are empty
-    if not predictions or not ground_truth:
-        return 0.0, 0.0, 0.0  # Zero score if one is empty
-    
-    # Sort predictions by confidence score
-    predictions = sorted(predictions, key=lambda x: x["score"], reverse=True)
-    
-    # Initialize arrays to track matched predictions and ground truth
-    matched_preds = [False] * len(predictions)
-    matched_gt = [False] * len(ground_truth)
-    
-    # Match predictions to ground truth
-    for i, pred in enumerate(predictions):
-        for j, gt in enumerate(ground_truth):
-            if not matched_gt[j] and bbox_iou(pred["box"], gt["box"]) >= iou_threshold:
-                matched_preds[i] = True
-                matched_gt[j] = True
-                break
-    
-    # Calculate metrics
-    true_positives = sum(matched_preds)
-    false_positives = len(predictions) - true_positives
-    false_negatives = len(ground_truth) - sum(matched_gt)
-    
-    precision = true_positives / (true_positives + false_positives) if (true_positives + false_positives) > 0 else 0
-    recall = true_positives / (true_positives + false_negatives) if (true_positives + false_negatives) > 0 else 0
-    f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-    
-    return precision, recall, f1_score
+    evaluator = DetectionEvaluator(iou_thresholds=[iou_threshold], max_detections=len(predictions or []))
+    evaluator.add(predictions, ground_truth)
+    return evaluator.precision_recall_f1(iou_threshold)
 
 def calculate_map(predictions: List[dict], ground_truth: List[dict], iou_threshold: float = 0.5) -> float:
     """
-    Calculate mean Average Precision (mAP) for object detection.
-    
+    Calculate the average precision (101-point interpolated, as in COCO) for object detection on one image.
+
     Args:
         predictions: List of predicted boxes and scores
         ground_truth: List of ground truth boxes
         iou_threshold: IoU threshold for considering a detection as correct
-        
+
     Returns:
         mAP score
     """
     if not predictions and not ground_truth:
         return 1.0  # Perfect score if both are empty
-    if not predictions or not ground_truth:
-        return 0.0  # Zero score if one is empty
-    
-    # Sort predictions by confidence score
-    predictions = sorted(predictions, key=lambda x: x["score"], reverse=True)
-    
-    # Initialize arrays to track matched predictions and ground truth
-    matched_preds = [False] * len(predictions)
-    matched_gt = [False] * len(ground_truth)
-    
-    # Calculate precision and recall at each threshold
-    precisions = []
-    recalls = []
-    
-    for i, pred in enumerate(predictions):
-        # Match prediction to ground truth
-        for j, gt in enumerate(ground_truth):
-            if not matched_gt[j] and bbox_iou(pred["box"], gt["box"]) >= iou_threshold:
-                matched_preds[i] = True
-                matched_gt[j] = True
-                break
-        
-        # Calculate precision and recall at current threshold
-        true_positives = sum(matched_preds[:i+1])
-        false_positives = (i + 1) - true_positives
-        false_negatives = len(ground_truth) - sum(matched_gt)
-        
-        precision = true_positives / (true_positives + false_positives) if (true_positives + false_positives) > 0 else 0
-        recall = true_positives / (true_positives + false_negatives) if (true_positives + false_negatives) > 0 else 0
-        
-        precisions.append(precision)
-        recalls.append(recall)
-    
-    # Calculate AP using 11-point interpolation
-    ap = 0
-    for t in np.arange(0, 1.1, 0.1):
-        if len([r for r in recalls if r >= t]) == 0:
-            p = 0
-        else:
-            p = max([p for r, p in zip(recalls, precisions) if r >= t])
-        ap += p / 11.0
-    
-    return ap
+    evaluator = DetectionEvaluator(iou_thresholds=[iou_threshold], max_detections=len(predictions or []))
+    evaluator.add(predictions, ground_truth)
+    average_precision = evaluator.average_precision("all")[0]
+    return 0.0 if np.isnan(average_precision) else float(average_precision)
+
+def to_detections(entry: dict) -> List[dict]:
+    """
+    Convert a {"boxes", "scores"} entry of a ground truth or predictions file to detections.
+    """
+    scores = entry.get("scores") or [1.0] * len(entry["boxes"])
+    return [{"box": box, "score": score} for box, score in zip(entry["boxes"], scores)]
+
+def predict_samples(ground_truth_data: dict) -> dict:
+    from inference.inference import inference_image
+
+    predictions = {}
+    for image_fname in ground_truth_data:
+        image_path = os.path.join(TEST_IMAGE_DIR, image_fname)
+        image = read_image(image_path)
+        predictions[image_fname] = inference_image(image, draw=False) or []
+    return predictions
 
 def main():
+    parser = argparse.ArgumentParser(description="COCO-style evaluation of the model against ground truth.")
+    parser.add_argument("--ground-truth", default=TEST_JSON_PATH, help="Ground truth file")
+    parser.add_argument("--predictions", help="Stored predictions file; runs the model on test/samples if not given")
+    args = parser.parse_args()
+
     # Load ground truth data
-    with open(TEST_JSON_PATH, 'r') as fp:
+    with open(args.ground_truth, 'r') as fp:
         ground_truth_data = json.load(fp)
-    
-    # Initialize metrics
-    total_precision = 0
-    total_recall = 0
-    total_f1 = 0
-    total_map = 0
-    num_images = len(ground_truth_data)
-    
-    # Process each image
+
+    if args.predictions:
+        with open(args.predictions, 'r') as fp:
+            predictions = {image_fname: to_detections(entry) for image_fname, entry in json.load(fp).items()}
+    else:
+        predictions = predict_samples(ground_truth_data)
+
+    evaluator = DetectionEvaluator()
     for image_fname, gt_data in ground_truth_data.items():
-        image_path = os.path.join(TEST_IMAGE_DIR, image_fname)
-        image = Image.open(image_path).convert("RGB")
-        
-        # Get predictions
-        predictions = inference_image(image, draw=False)
-        if predictions is None:
-            predictions = []
-        
-        # Calculate metrics for this image
-        precision, recall, f1 = calculate_metrics(predictions, gt_data)
-        map_score = calculate_map(predictions, gt_data)
-        
-        total_precision += precision
-        total_recall += recall
-        total_f1 += f1
-        total_map += map_score
-    
-    # Calculate average metrics
-    avg_precision = total_precision / num_images
-    avg_recall = total_recall / num_images
-    avg_f1 = total_f1 / num_images
-    avg_map = total_map / num_images
-    
-    print("\nModel Performance Metrics:")
-    print(f"Precision: {avg_precision:.3f}")
-    print(f"Recall: {avg_recall:.3f}")
-    print(f"F1 Score: {avg_f1:.3f}")
-    print(f"mAP: {avg_map:.3f}")
-    
-    return avg_precision, avg_recall, avg_f1, avg_map
+        evaluator.add(predictions.get(image_fname, []), to_detections(gt_data))
+    summary = evaluator.summarize()
+
+    print(f"\nModel Performance Metrics ({evaluator.num_images} images):")
+    print(f"| {'Metric':<35} | {'Value':>6} |")
+    print(f"|{'-' * 37}|{'-' * 8}|")
+    for name, value in summary.items():
+        print(f"| {name:<35} | {'n/a' if np.isnan(value) else f'{value:.1%}':>6} |")
+    return summary
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import utility.config as config
+from calculate_metrics import DetectionEvaluator, to_detections
+from inference.cache import file_fingerprint, model_fingerprint
+from inference.near_duplicates import NearDuplicateIndex, page_hash
+from prediction_store import PredictionStore
+from utility.utils import read_image
+
+# Evaluation harness for large labeled directories.
+#
+#   python test/evaluate.py --image-dir /data/pages --ground-truth /data/pages.json --processes 8
+#   python test/evaluate.py --model /path/to/new_checkpoint.pth --score-thresholds 0.5 0.7 0.9
+#   python test/evaluate.py --near-duplicate-distances 0 4 8 12 16
+#
+# Raw predictions (down to --min-score) are stored per (image hash, model version) in
+# EVAL_STORE_PATH. The model only runs, in a pool of processes, on images that have no stored
+# predictions for the current model version, i.e. new or changed images and new checkpoints,
+# backends, input sizes or NMS thresholds. Metrics are then computed from the stored predictions
+# for every score threshold of the sweep.
+# With --near-duplicate-distances, the images are also replayed in order through a near-duplicate
+# index (see `inference/near_duplicates.py`) for every distance threshold, serving the stored
+# predictions of an earlier near-duplicate image where the index finds one, to measure the hit rate
+# and accuracy of reusing detections at config.SCORE_THRESHOLD against running the model on every image.
+# Ground truth files map image file names to {"boxes": [...]}, like test/ground_truth.json.
+
+predictor = None
+
+
+def _init_worker(overrides: dict, num_threads: int):
+    """
+    Loads the model once per evaluation process.
+    """
+    global predictor
+    import torch
+    from inference.load_model import get_predictor
+
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    torch.set_num_threads(num_threads)
+    predictor = get_predictor()
+
+def _predict(item: tuple) -> tuple:
+    image_path, image_hash = item
+    return image_hash, predictor.predict_batch([read_image(image_path)])[0]
+
+def hash_images(image_paths: list, num_threads: int = 8) -> list:
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return list(pool.map(file_fingerprint, image_paths))
+
+def run_missing(store: PredictionStore, model_version: str, missing: list, overrides: dict, processes: int):
+    """
+    Run the model on the (image path, image hash) pairs in `missing` and store the predictions as they come in.
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // processes)
+    start_time = time.perf_counter()
+    pending = {}
+    with mp.Pool(processes, initializer=_init_worker, initargs=(overrides, num_threads)) as pool:
+        for done, (image_hash, results) in enumerate(pool.imap_unordered(_predict, missing, chunksize=4), 1):
+            pending[image_hash] = results
+            # flush regularly so an interrupted run keeps its progress
+            if len(pending) >= 256 or done == len(missing):
+                store.put_many(pending, model_version)
+                pending = {}
+                elapsed = time.perf_counter() - start_time
+                print(f"Predicted {done}/{len(missing)} images ({done / elapsed:.1f} images/s)")
+
+def sweep(predictions: dict, ground_truth: dict, score_thresholds: list) -> list:
+    """
+    Evaluate the stored predictions at every score threshold.
+
+    Args:
+        predictions (dict): Raw predictions per image file name.
+        ground_truth (dict): Ground truth detections per image file name.
+        score_thresholds (list): Minimum scores of the predictions kept.
+
+    Returns:
+        list: The metrics of `DetectionEvaluator.summarize` per score threshold.
+    """
+    rows = []
+    for score_threshold in score_thresholds:
+        evaluator = DetectionEvaluator()
+        for image_fname, gt_detections in ground_truth.items():
+            kept = [result for result in predictions[image_fname] if result["score"] >= score_threshold]
+            evaluator.add(kept, gt_detections)
+        rows.append({"score_threshold": score_threshold, **evaluator.summarize()})
+    return rows
+
+def _page_hash(image_path: str) -> tuple:
+    image = read_image(image_path)
+    return page_hash(image, config.NEAR_DUPLICATE_HASH_SIZE), image.shape[0], image.shape[1]
+
+def near_duplicate_sweep(image_paths: list, predictions: dict, ground_truth: dict, distances: list, score_threshold: float) -> list:
+    """
+    Replay the images in order through a `NearDuplicateIndex` per distance threshold.
+
+    Args:
+        image_paths (list): Paths of the images, in the order of `ground_truth`.
+        predictions (dict): Raw predictions per image file name.
+        ground_truth (dict): Ground truth detections per image file name.
+        distances (list): Hamming distance thresholds of the index.
+        score_threshold (float): Minimum score of the predictions kept.
+
+    Returns:
+        list: The hit rate and metrics of `DetectionEvaluator.summarize` per distance threshold,
+            after a first row without reuse (distance None).
+    """
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        page_hashes = list(pool.map(_page_hash, image_paths))
+    rows = []
+    for max_distance in [None] + distances:
+        index = None
+        if max_distance is not None:
+            index = NearDuplicateIndex(max_distance, max_entries=max(1, len(image_paths)), hash_size=config.NEAR_DUPLICATE_HASH_SIZE)
+        evaluator = DetectionEvaluator()
+        for (image_fname, gt_detections), (image_hash, height, width) in zip(ground_truth.items(), page_hashes):
+            kept = [result for result in predictions[image_fname] if result["score"] >= score_threshold]
+            served = index.lookup(image_hash, height, width) if index else None
+            if served is None:
+                served = kept
+                if index:
+                    index.add(image_hash, height, width, kept)
+            evaluator.add(served, gt_detections)
+        hit_rate = index.stats()["hit_rate"] if index else 0.0
+        rows.append({"max_distance": max_distance, "hit_rate": hit_rate, **evaluator.summarize()})
+    return rows
+
+def print_sweep(rows: list):
+    columns = ["score_threshold", "Precision@0.50", "Recall@0.50", "F1@0.50", "mAP@0.50", "mAP@[0.50:0.95]"]
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{row[column]:>16.3f}" for column in columns))
+
+def print_near_duplicate_sweep(rows: list):
+    columns = ["max_distance", "hit_rate", "Precision@0.50", "Recall@0.50", "F1@0.50", "mAP@0.50", "mAP@[0.50:0.95]"]
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for row in rows:
+        values = ["off" if row["max_distance"] is None else row["max_distance"]] + [f"{row[column]:.3f}" for column in columns[1:]]
+        print(" | ".join(f"{value:>16}" for value in values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the model on a labeled directory, reusing stored predictions.")
+    parser.add_argument("--image-dir", default=config.TEST_IMAGE_DIR)
+    parser.add_argument("--ground-truth", default=config.TEST_JSON_PATH)
+    parser.add_argument("--model", default=config.MODEL_PATH, help="Model weights to evaluate")
+    parser.add_argument("--store", default=config.EVAL_STORE_PATH, help="SQLite prediction store")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--min-score", type=float, default=0.05, help="Score threshold of the stored raw predictions")
+    parser.add_argument("--score-thresholds", nargs="+", type=float, default=[0.5, 0.7, 0.8, 0.9, 0.95])
+    parser.add_argument("--near-duplicate-distances", nargs="*", type=int, default=[], help="Hamming distance thresholds of the near-duplicate replay")
+    parser.add_argument("--output", help="Write the sweep as JSON to this file")
+    args = parser.parse_args()
+
+    with open(args.ground_truth, "r") as fp:
+        ground_truth = {image_fname: to_detections(entry) for image_fname, entry in json.load(fp).items()}
+
+    # detections are served at the configured threshold, raw predictions are stored down to --min-score
+    score_threshold = config.SCORE_THRESHOLD
+    # the model version covers everything that changes raw predictions, see `model_fingerprint`
+    overrides = {
+        "MODEL_PATH": args.model,
+        "SCORE_THRESHOLD": args.min_score,
+        "INFERENCE_WORKERS": 0,
+        "DETECTION_CACHE_ENABLED": False,
+    }
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    model_version = model_fingerprint()
+
+    image_fnames = list(ground_truth)
+    image_paths = [os.path.join(args.image_dir, image_fname) for image_fname in image_fnames]
+    image_hashes = hash_images(image_paths)
+
+    store = PredictionStore(args.store)
+    stored = store.get_many(sorted(set(image_hashes)), model_version)
+    missing = {image_hash: path for path, image_hash in zip(image_paths, image_hashes) if image_hash not in stored}
+    print(f"{len(image_fnames) - len(missing)} of {len(image_fnames)} images have stored predictions for model {model_version}")
+    if missing:
+        run_missing(store, model_version, [(path, image_hash) for image_hash, path in missing.items()], overrides, args.processes)
+        stored = store.get_many(sorted(set(image_hashes)), model_version)
+    store.close()
+
+    predictions = {image_fname: stored[image_hash] for image_fname, image_hash in zip(image_fnames, image_hashes)}
+    rows = sweep(predictions, ground_truth, args.score_thresholds)
+    print_sweep(rows)
+    results = {"model_version": model_version, "sweep": rows}
+    if args.near_duplicate_distances:
+        near_duplicate_rows = near_duplicate_sweep(
+            image_paths, predictions, ground_truth, args.near_duplicate_distances, score_threshold
+        )
+        print(f"\nNear-duplicate reuse at score threshold {score_threshold}:")
+        print_near_duplicate_sweep(near_duplicate_rows)
+        results["near_duplicates"] = near_duplicate_rows
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=4)
+
+if __name__ == "__main__":
+    main()
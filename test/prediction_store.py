@@ -0,0 +1,75 @@
+import json
+import sqlite3
+import time
+
+# Persists raw model predictions per (image hash, model version), so evaluations only run
+# the model on images or model versions they have not seen before (see test/evaluate.py).
+
+
+class PredictionStore:
+    """
+    SQLite table of predictions keyed by image content hash and model version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                image_hash TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                predictions TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (image_hash, model_version)
+            )
+            """
+        )
+        self._connection.commit()
+
+    def get_many(self, image_hashes: list, model_version: str) -> dict:
+        """
+        Args:
+            image_hashes (list): Content hashes of the images.
+            model_version (str): Fingerprint of the model that made the predictions.
+
+        Returns:
+            dict: Predictions per image hash, for the hashes that are stored.
+        """
+        stored = {}
+        # stay below SQLite's limit on the number of query parameters
+        for i in range(0, len(image_hashes), 500):
+            batch = image_hashes[i:i + 500]
+            rows = self._connection.execute(
+                f"SELECT image_hash, predictions FROM predictions "
+                f"WHERE model_version = ? AND image_hash IN ({','.join('?' * len(batch))})",
+                [model_version, *batch],
+            )
+            stored.update((image_hash, json.loads(predictions)) for image_hash, predictions in rows)
+        return stored
+
+    def put_many(self, predictions: dict, model_version: str):
+        """
+        Args:
+            predictions (dict): Predictions per image hash.
+            model_version (str): Fingerprint of the model that made the predictions.
+        """
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+            [(image_hash, model_version, json.dumps(results), now) for image_hash, results in predictions.items()],
+        )
+        self._connection.commit()
+
+    def model_versions(self) -> list:
+        """
+        Returns:
+            list: (model version, number of images, last update) of every stored model version.
+        """
+        return self._connection.execute(
+            "SELECT model_version, COUNT(*), MAX(created_at) FROM predictions GROUP BY model_version ORDER BY 3 DESC"
+        ).fetchall()
+
+    def close(self):
+        self._connection.close()
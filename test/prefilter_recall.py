@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import utility.config as config
+import utility.pdf as pdf_utils
+import utility.utils as utils
+from inference.inference import inference_image
+from inference.prefilter import PAGE_CANDIDATE, classify_page
+
+# Measures the recall of the page pre-filter (inference/prefilter.py): the share of pages with
+# detections that the filter sends to the model, and how many pages it skips.
+#
+#   python test/prefilter_recall.py                       # test/samples, labeled by test/ground_truth.json
+#   python test/prefilter_recall.py --pdf a.pdf b.pdf     # PDF pages, labeled by the model
+#   python test/prefilter_recall.py --pdf a.pdf --tall-factor 2 --wide-factor 6
+#
+# Pages are labeled positive if they have at least one ground truth box, or for PDFs, if the
+# model detects anything on them. The filter thresholds default to the ones in utility/config.py.
+
+
+def iter_labeled_samples():
+    with open(config.TEST_JSON_PATH, "r") as fp:
+        test_data = json.load(fp)
+    for image_fname, gt_data in test_data.items():
+        image = utils.read_image(os.path.join(config.TEST_IMAGE_DIR, image_fname))
+        yield image_fname, image, len(gt_data["boxes"]) > 0
+
+def iter_labeled_pdf_pages(pdf_paths: list, dpi: int):
+    for pdf_path in pdf_paths:
+        with open(pdf_path, "rb") as fp:
+            pdf_bytes = fp.read()
+        for page_number, image in pdf_utils.iter_pages(pdf_bytes, dpi=dpi):
+            results = inference_image(image, draw=False)
+            yield f"{os.path.basename(pdf_path)}:{page_number}", image, bool(results)
+
+def evaluate(pages, filter_args: dict) -> dict:
+    rows = []
+    filter_time = 0.0
+    for name, image, positive in pages:
+        start_time = time.perf_counter()
+        page_class = classify_page(image, **filter_args)
+        filter_time += time.perf_counter() - start_time
+        kept = page_class == PAGE_CANDIDATE
+        rows.append((name, positive, page_class))
+        status = "MISSED" if positive and not kept else ""
+        print(f"{name:>30} | {'drawing' if positive else 'none':>8} | {page_class:>9} | {status}")
+
+    positives = [row for row in rows if row[1]]
+    kept_positives = [row for row in positives if row[2] == PAGE_CANDIDATE]
+    skipped = [row for row in rows if row[2] != PAGE_CANDIDATE]
+    return {
+        "pages": len(rows),
+        "pages_with_detections": len(positives),
+        "recall": round(len(kept_positives) / len(positives), 4) if positives else None,
+        "skipped": len(skipped),
+        "skip_rate": round(len(skipped) / len(rows), 4) if rows else None,
+        "missed": [row[0] for row in positives if row[2] != PAGE_CANDIDATE],
+        "filter_ms_per_page": round(filter_time / len(rows) * 1000, 1) if rows else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall and skip rate of the page pre-filter.")
+    parser.add_argument("--pdf", nargs="*", help="PDF files whose pages are labeled by the model (default: test/samples)")
+    parser.add_argument("--dpi", type=int, default=config.PDF_DPI)
+    parser.add_argument("--width", type=int, default=config.PREFILTER_WIDTH)
+    parser.add_argument("--ink-threshold", type=int, default=config.PREFILTER_INK_THRESHOLD)
+    parser.add_argument("--min-ink-ratio", type=float, default=config.PREFILTER_MIN_INK_RATIO)
+    parser.add_argument("--tall-factor", type=float, default=config.PREFILTER_TALL_FACTOR)
+    parser.add_argument("--wide-factor", type=float, default=config.PREFILTER_WIDE_FACTOR)
+    args = parser.parse_args()
+
+    filter_args = {
+        "width": args.width,
+        "ink_threshold": args.ink_threshold,
+        "min_ink_ratio": args.min_ink_ratio,
+        "tall_factor": args.tall_factor,
+        "wide_factor": args.wide_factor,
+    }
+    pages = iter_labeled_pdf_pages(args.pdf, args.dpi) if args.pdf else iter_labeled_samples()
+    print(json.dumps(evaluate(pages, filter_args), indent=4))
+
+if __name__ == "__main__":
+    main()
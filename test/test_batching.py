@@ -0,0 +1,148 @@
+import os
+import sys
+import threading
+import time
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.batching import BatchPredictor
+
+class FakeForward:
+    """
+    Stands in for the model: returns one detection per image holding the image itself,
+    records the size of every batch and can be held until `release` is set
+    """
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, images: list) -> list:
+        self.batches.append(len(images))
+        self.started.set()
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return [[{"image": image}] for image in images]
+
+def test_max_batch_size():
+    """
+    Batches never hold more than `max_batch_size` images
+    """
+    forward = FakeForward()
+    predictor = BatchPredictor(forward, max_batch_size=4, max_wait_ms=200)
+    try:
+        futures = [predictor.submit(i) for i in range(10)]
+        assert [future.result(timeout=5)[0]["image"] for future in futures] == list(range(10))
+        assert forward.batches == [4, 4, 2], forward.batches
+    finally:
+        predictor.close()
+
+def test_max_wait_flush():
+    """
+    A batch that does not fill up is run once its first image has waited `max_wait_ms`
+    """
+    forward = FakeForward()
+    predictor = BatchPredictor(forward, max_batch_size=8, max_wait_ms=100)
+    try:
+        start_time = time.perf_counter()
+        assert predictor.submit("page").result(timeout=5) == [{"image": "page"}]
+        elapsed = time.perf_counter() - start_time
+        assert 0.09 <= elapsed < 1.0, elapsed
+        assert forward.batches == [1]
+    finally:
+        predictor.close()
+
+def test_wait_counts_from_submission():
+    """
+    An image that waited for a busy model past `max_wait_ms` runs as soon as the model is free,
+    together with the images queued behind it
+    """
+    forward = FakeForward()
+    forward.release.clear()
+    predictor = BatchPredictor(forward, max_batch_size=8, max_wait_ms=300)
+    try:
+        first = predictor.submit("first")
+        assert forward.started.wait(timeout=5)
+        waiting = [predictor.submit(i) for i in range(3)]
+        time.sleep(0.4)
+        start_time = time.perf_counter()
+        forward.release.set()
+        assert first.result(timeout=5) == [{"image": "first"}]
+        for future in waiting:
+            future.result(timeout=5)
+        assert time.perf_counter() - start_time < 0.15, "The waiting images waited for a batch to fill up again"
+        assert forward.batches == [1, 3], forward.batches
+    finally:
+        predictor.close()
+
+def test_results_in_order():
+    """
+    Every future gets the detections of its own image, for callers on several threads
+    """
+    forward = FakeForward()
+    predictor = BatchPredictor(forward, max_batch_size=3, max_wait_ms=5, concurrency=2)
+    results = {}
+
+    def call(worker: int):
+        images = [(worker, i) for i in range(7)]
+        results[worker] = predictor.predict(images)
+
+    try:
+        threads = [threading.Thread(target=call, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for worker in range(4):
+            assert [result[0]["image"] for result in results[worker]] == [(worker, i) for i in range(7)]
+        assert max(forward.batches) <= 3 and sum(forward.batches) == 28
+    finally:
+        predictor.close()
+
+def test_forward_error_fails_batch():
+    """
+    An exception raised by the model reaches every image of the batch, and the next batches still run
+    """
+    forward = FakeForward(error=RuntimeError("out of memory"))
+    forward.release.clear()
+    predictor = BatchPredictor(forward, max_batch_size=3, max_wait_ms=1000)
+    try:
+        futures = [predictor.submit(i) for i in range(3)]
+        forward.release.set()
+        for future in futures:
+            assert isinstance(future.exception(timeout=5), RuntimeError)
+        assert forward.batches == [3]
+
+        forward.error = None
+        assert predictor.submit("next").result(timeout=5) == [{"image": "next"}]
+    finally:
+        predictor.close()
+
+def test_close_drains_queue():
+    """
+    `close` runs the images queued so far without waiting for their batches to fill up, then stops the threads
+    """
+    forward = FakeForward()
+    predictor = BatchPredictor(forward, max_batch_size=4, max_wait_ms=10000)
+    futures = [predictor.submit(i) for i in range(6)]
+    start_time = time.perf_counter()
+    predictor.close()
+    assert time.perf_counter() - start_time < 5
+    assert all(future.done() for future in futures)
+    assert [future.result()[0]["image"] for future in futures] == list(range(6))
+    assert not predictor._thread.is_alive()
+
+if __name__ == "__main__":
+    test_max_batch_size()
+    test_max_wait_flush()
+    test_wait_counts_from_submission()
+    test_results_in_order()
+    test_forward_error_fails_batch()
+    test_close_drains_queue()
+    print("Batching tests passed")
@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.cache import DetectionCache
+
+DETECTIONS = [{"box": [1.0, 2.0, 3.0, 4.0], "score": 0.9, "class": 0}]
+
+def test_single_flight():
+    """
+    Concurrent lookups of the same key run the model once and all get its detections
+    """
+    cache = DetectionCache("model", max_entries=10)
+    model_future = Future()
+    submitted = []
+    start = threading.Barrier(8)
+    futures = []
+
+    def submit():
+        submitted.append(1)
+        return model_future
+
+    def lookup():
+        start.wait()
+        futures.append(cache.get_or_submit("key", submit))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(submitted) == 1, f"The model ran {len(submitted)} times"
+    assert not any(future.done() for future in futures)
+
+    model_future.set_result(DETECTIONS)
+    assert all(future.result(timeout=1) == DETECTIONS for future in futures)
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 7, stats
+
+    # later lookups are served from memory
+    assert cache.get_or_submit("key", submit).result(timeout=1) == DETECTIONS
+    assert len(submitted) == 1 and cache.stats()["hits"] == 1
+
+def test_failures_are_not_cached():
+    """
+    A failed model run fails the coalesced lookups, and the next lookup runs the model again
+    """
+    cache = DetectionCache("model", max_entries=10)
+    model_future = Future()
+    first = cache.get_or_submit("key", lambda: model_future)
+    second = cache.get_or_submit("key", lambda: model_future)
+    model_future.set_exception(RuntimeError("model failed"))
+    for future in (first, second):
+        assert isinstance(future.exception(timeout=1), RuntimeError)
+
+    retry = Future()
+    retry.set_result(DETECTIONS)
+    assert cache.get_or_submit("key", lambda: retry).result(timeout=1) == DETECTIONS
+    assert cache.stats()["misses"] == 2
+
+def test_submit_error():
+    """
+    An exception raised by `submit` itself fails the lookup and leaves nothing in flight
+    """
+    cache = DetectionCache("model", max_entries=10)
+
+    def submit():
+        raise RuntimeError("queue full")
+
+    assert isinstance(cache.get_or_submit("key", submit).exception(timeout=1), RuntimeError)
+    done = Future()
+    done.set_result(DETECTIONS)
+    assert cache.get_or_submit("key", lambda: done).result(timeout=1) == DETECTIONS
+
+def test_lru_and_disk_tier():
+    """
+    The memory tier evicts its least recently used entries, which the disk tier still serves, also to a new cache
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DetectionCache("model", max_entries=2, cache_dir=cache_dir)
+        for key in ("a", "b", "c"):
+            done = Future()
+            done.set_result([{**DETECTIONS[0], "class": ord(key)}])
+            cache.get_or_submit(key, lambda: done).result(timeout=1)
+        assert cache.stats()["entries"] == 2
+
+        def fail():
+            raise AssertionError("The model ran for a cached key")
+
+        assert cache.get_or_submit("a", fail).result(timeout=1)[0]["class"] == ord("a")
+        assert cache.stats()["disk_hits"] == 1
+
+        restarted = DetectionCache("model", max_entries=2, cache_dir=cache_dir)
+        assert restarted.get_or_submit("c", fail).result(timeout=1)[0]["class"] == ord("c")
+
+def test_key():
+    """
+    Keys depend on the pixels, the shape and the model fingerprint, not on the memory layout
+    """
+    cache = DetectionCache("model", max_entries=1)
+    image = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    assert cache.key(image) == cache.key(np.asfortranarray(image))
+    assert cache.key(image) != cache.key(image.reshape(3, 2, 3))
+    changed = image.copy()
+    changed[0, 0, 0] += 1
+    assert cache.key(image) != cache.key(changed)
+    assert cache.key(image) != DetectionCache("other model", max_entries=1).key(image)
+
+if __name__ == "__main__":
+    test_single_flight()
+    test_failures_are_not_cached()
+    test_submit_error()
+    test_lru_and_disk_tier()
+    test_key()
+    print("Cache tests passed")
@@ -0,0 +1,133 @@
+import math
+import os
+import sys
+
+import numpy as np
+
+# python does not automatically find parent directory
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(test_dir))
+sys.path.append(test_dir)
+
+from calculate_metrics import DetectionEvaluator, calculate_map, calculate_metrics
+
+GT = [{"box": [0, 0, 100, 100]}]
+
+def prediction(box: list, score: float) -> dict:
+    return {"box": box, "score": score}
+
+def evaluate(*images) -> DetectionEvaluator:
+    evaluator = DetectionEvaluator()
+    for predictions, ground_truth in images:
+        evaluator.add(predictions, ground_truth)
+    return evaluator
+
+def test_perfect_match():
+    """
+    A prediction on the ground truth box is a true positive at every IoU threshold
+    """
+    evaluator = evaluate(([prediction([0, 0, 100, 100], 0.9)], GT))
+    assert np.allclose(evaluator.average_precision(), 1.0)
+    assert np.allclose(evaluator.average_recall(), 1.0)
+    assert evaluator.precision_recall_f1(0.5) == (1.0, 1.0, 1.0)
+    summary = evaluator.summarize()
+    assert list(summary) == [
+        "mAP@[0.50:0.95]", "mAP@0.50", "mAP@0.75", "AP (small)", "AP (medium)", "AP (large)",
+        "AR@[0.50:0.95] (max 100 detections)", "Precision@0.50", "Recall@0.50", "F1@0.50",
+    ], list(summary)
+    assert summary["mAP@[0.50:0.95]"] == 1.0 and summary["AP (large)"] == 1.0
+    # no ground truth in the small and medium ranges
+    assert math.isnan(summary["AP (small)"]) and math.isnan(summary["AP (medium)"])
+
+def test_duplicate_detection():
+    """
+    A second prediction of the same box is a false positive, which lowers precision but not AP
+    when it scores below the match
+    """
+    evaluator = evaluate(([prediction([0, 0, 100, 100], 0.9), prediction([2, 2, 100, 100], 0.8)], GT))
+    assert np.allclose(evaluator.average_precision(), 1.0)
+    precision, recall, f1_score = evaluator.precision_recall_f1(0.5)
+    assert precision == 0.5 and recall == 1.0 and math.isclose(f1_score, 2 / 3)
+
+def test_miss():
+    """
+    An undetected box halves the recall: precision is 1 up to recall 0.5, i.e. on 51 of the 101 recall points
+    """
+    evaluator = evaluate(([prediction([0, 0, 100, 100], 0.9)], GT + [{"box": [200, 200, 300, 300]}]))
+    assert np.allclose(evaluator.average_precision(), 51 / 101)
+    assert np.allclose(evaluator.average_recall(), 0.5)
+    assert evaluator.precision_recall_f1(0.5) == (1.0, 0.5, 2 / 3)
+
+def test_iou_thresholds():
+    """
+    A prediction with an IoU of 0.82 matches at the thresholds 0.50 to 0.80 only
+    """
+    evaluator = evaluate(([prediction([0, 0, 100, 82], 0.9)], GT))
+    assert evaluator.average_precision().tolist() == [1.0] * 7 + [0.0] * 3
+    summary = evaluator.summarize()
+    assert math.isclose(summary["mAP@[0.50:0.95]"], 0.7)
+    assert summary["mAP@0.50"] == 1.0 and summary["mAP@0.75"] == 1.0
+
+def test_greedy_matching_by_score():
+    """
+    The highest scoring prediction takes the box at every threshold it passes: at IoU 0.5 the loose
+    prediction matches first and the tight one is a false positive, at IoU 0.75 only the tight one matches
+    """
+    loose = prediction([0, 0, 100, 62], 0.95)   # IoU 0.62
+    tight = prediction([0, 0, 100, 98], 0.6)    # IoU 0.98
+    evaluator = evaluate(([loose, tight], GT))
+    average_precisions = evaluator.average_precision()
+    assert average_precisions[0] == 1.0
+    # a false positive first, then the match: precision 0.5 at every recall
+    assert math.isclose(average_precisions[evaluator._threshold_index(0.75)], 0.5)
+
+def test_accumulated_over_dataset():
+    """
+    Predictions of all images are ranked together: a confident false positive on one image lowers
+    the precision of the true positive on another, unlike averaging per-image scores
+    """
+    evaluator = evaluate(
+        ([prediction([0, 0, 100, 100], 0.6)], GT),
+        ([prediction([300, 300, 400, 400], 0.9)], GT),
+    )
+    assert np.allclose(evaluator.average_precision(), 0.5 * 51 / 101)
+    assert evaluator.num_images == 2
+
+def test_area_ranges():
+    """
+    Boxes are evaluated in their area range, and predictions outside a range don't count against it
+    """
+    ground_truth = [{"box": [0, 0, 20, 20]}, {"box": [100, 100, 300, 300]}]
+    evaluator = evaluate(([prediction([0, 0, 20, 20], 0.9), prediction([100, 100, 300, 300], 0.8)], ground_truth))
+    assert np.allclose(evaluator.average_precision("small"), 1.0)
+    assert np.allclose(evaluator.average_precision("large"), 1.0)
+    assert np.isnan(evaluator.average_precision("medium")).all()
+
+def test_single_image_wrappers():
+    """
+    `calculate_metrics` and `calculate_map` keep their return values, including for empty inputs
+    """
+    perfect = [prediction([0, 0, 100, 100], 0.9)]
+    assert calculate_metrics(perfect, GT) == (1.0, 1.0, 1.0)
+    assert calculate_metrics([], []) == (1.0, 1.0, 1.0)
+    assert calculate_metrics([], GT) == (0.0, 0.0, 0.0)
+    assert calculate_metrics(perfect, []) == (0.0, 0.0, 0.0)
+    precision, recall, f1_score = calculate_metrics(perfect + [prediction([2, 2, 100, 100], 0.8)], GT)
+    assert precision == 0.5 and recall == 1.0 and math.isclose(f1_score, 2 / 3)
+
+    assert calculate_map(perfect, GT) == 1.0
+    assert calculate_map([], []) == 1.0
+    assert calculate_map([], GT) == 0.0
+    assert calculate_map(perfect, []) == 0.0
+    assert isinstance(calculate_map(perfect, GT, iou_threshold=0.75), float)
+
+if __name__ == "__main__":
+    test_perfect_match()
+    test_duplicate_detection()
+    test_miss()
+    test_iou_thresholds()
+    test_greedy_matching_by_score()
+    test_accumulated_over_dataset()
+    test_area_ranges()
+    test_single_image_wrappers()
+    print("Metric tests passed")
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+import threading
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from app.executor import InferenceExecutor, QueueFullError
+
+async def wait_running(executor: InferenceExecutor, running: int):
+    while executor.stats()["running"] < running:
+        await asyncio.sleep(0.01)
+
+def test_rejects_past_queue_depth():
+    """
+    Jobs past `max_queue_depth` waiting for a thread are rejected, the others run once a thread frees up
+    """
+    async def scenario():
+        executor = InferenceExecutor(max_workers=1, max_queue_depth=1)
+        release = threading.Event()
+        try:
+            running = asyncio.ensure_future(executor.run(release.wait))
+            await wait_running(executor, 1)
+            queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+            await asyncio.sleep(0.05)
+            assert executor.stats()["queue_depth"] == 1
+            assert executor.saturated()
+
+            try:
+                await executor.run(lambda: "rejected")
+                raise AssertionError("A job past the queue depth limit was accepted")
+            except QueueFullError:
+                pass
+
+            release.set()
+            assert await running is True
+            assert await queued == "queued"
+            stats = executor.stats()
+            assert stats["rejected"] == 1 and stats["completed"] == 2 and stats["queue_depth"] == 0
+        finally:
+            release.set()
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+def test_iterate_yields_in_order_and_raises():
+    """
+    Items of an iterated generator arrive in order, and its exception reaches the consumer
+    """
+    def produce(count: int):
+        for i in range(count):
+            yield i
+        raise ValueError("producer failed")
+
+    async def scenario():
+        executor = InferenceExecutor(max_workers=1, max_queue_depth=1)
+        items = []
+        try:
+            async for item in executor.iterate(produce, 20):
+                items.append(item)
+            raise AssertionError("The producer's exception was not raised")
+        except ValueError:
+            pass
+        finally:
+            executor.shutdown()
+        assert items == list(range(20)), items
+
+    asyncio.run(scenario())
+
+def test_iterate_stops_abandoned_producer():
+    """
+    A consumer that stops early (client gone mid-stream) stops the producer and frees its thread
+    """
+    produced = []
+
+    def produce():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    async def scenario():
+        executor = InferenceExecutor(max_workers=1, max_queue_depth=1)
+        try:
+            stream = executor.iterate(produce)
+            async for item in stream:
+                if item == 2:
+                    break
+            await stream.aclose()
+            # the producer is blocked on the full buffer until it sees the cancellation
+            for _ in range(100):
+                if executor.stats()["running"] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            assert executor.stats()["running"] == 0
+            assert len(produced) < 1000
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+if __name__ == "__main__":
+    test_rejects_past_queue_depth()
+    test_iterate_yields_in_order_and_raises()
+    test_iterate_stops_abandoned_producer()
+    print("Executor tests passed")
@@ -0,0 +1,160 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import utility.config as config
+from app.jobs import DONE, FAILED, QUEUED, RUNNING, JobCancelled, JobQueue, JobWorker
+
+def submit_jobs(queue: JobQueue, count: int) -> list:
+    job_ids = []
+    for i in range(count):
+        fd, path = tempfile.mkstemp(suffix=".pdf", dir=queue.spool_dir)
+        os.close(fd)
+        job_ids.append(queue.submit(path, f"{i}.pdf", "bbox", 200))
+        # jobs are claimed by creation time
+        time.sleep(0.002)
+    return job_ids
+
+def make_stale(queue: JobQueue, job_id: str):
+    with queue._connect() as connection:
+        connection.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - config.JOB_STALE_AFTER - 1, job_id))
+
+def test_claim_each_job_once():
+    """
+    Workers claiming concurrently get every job exactly once
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = JobQueue(spool_dir)
+        job_ids = submit_jobs(queue, 10)
+        claimed = []
+        lock = threading.Lock()
+
+        def work(worker: str):
+            while (job := queue.claim(worker)) is not None:
+                with lock:
+                    claimed.append(job["job_id"])
+
+        threads = [threading.Thread(target=work, args=(f"worker-{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(claimed) == sorted(job_ids), "Jobs were claimed more than once or not at all"
+        assert queue.counts() == {RUNNING: 10}
+
+def test_claim_order_and_finish():
+    """
+    Jobs are claimed oldest first, and only their worker can finish them
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = JobQueue(spool_dir)
+        first, second = submit_jobs(queue, 2)
+        job = queue.claim("a")
+        assert job["job_id"] == first and job["status"] == RUNNING and job["attempts"] == 1
+        assert queue.claim("b")["job_id"] == second
+        assert queue.claim("c") is None
+
+        queue.finish(first, "b")
+        assert queue.get(first)["status"] == RUNNING
+        queue.finish(first, "a")
+        queue.finish(second, "b", error="failed")
+        assert queue.get(first)["status"] == DONE
+        assert queue.get(second)["status"] == FAILED and queue.get(second)["error"] == "failed"
+
+def test_requeue_stale_jobs():
+    """
+    A job whose worker stopped sending heartbeats is claimed again, and its old worker is told it lost it
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = JobQueue(spool_dir)
+        job_id, = submit_jobs(queue, 1)
+        queue.claim("stopped")
+        queue.progress(job_id, "stopped", 1, pages_total=3)
+        assert queue.claim("other") is None
+
+        make_stale(queue, job_id)
+        job = queue.claim("other")
+        assert job["job_id"] == job_id and job["attempts"] == 2 and job["pages_done"] == 0
+        assert not queue.heartbeat(job_id, "stopped")
+        try:
+            queue.progress(job_id, "stopped", 2)
+            raise AssertionError("A requeued job accepted progress from its old worker")
+        except JobCancelled:
+            pass
+        assert queue.heartbeat(job_id, "other")
+
+def test_fail_after_max_attempts():
+    """
+    A job whose workers stopped responding `config.JOB_MAX_ATTEMPTS` times is failed instead of requeued
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = JobQueue(spool_dir)
+        job_id, = submit_jobs(queue, 1)
+        for attempt in range(config.JOB_MAX_ATTEMPTS):
+            job = queue.claim(f"worker-{attempt}")
+            assert job is not None and job["attempts"] == attempt + 1
+            make_stale(queue, job_id)
+        assert queue.claim("last") is None
+        job = queue.get(job_id)
+        assert job["status"] == FAILED and job["error"] == "Job worker stopped responding", job
+
+def test_release_keeps_attempts():
+    """
+    A job released by a worker shutting down is queued again without counting as an attempt
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = JobQueue(spool_dir)
+        job_id, = submit_jobs(queue, 1)
+        queue.claim("stopping")
+        queue.release(job_id, "stopping")
+        assert queue.get(job_id)["status"] == QUEUED
+        assert queue.claim("next")["attempts"] == 1
+
+def test_worker_heartbeat_covers_slow_pages():
+    """
+    A job stays with its worker while a single page takes longer than `config.JOB_STALE_AFTER`
+    """
+    stale_after, heartbeat_interval = config.JOB_STALE_AFTER, config.JOB_HEARTBEAT_INTERVAL
+    config.JOB_STALE_AFTER, config.JOB_HEARTBEAT_INTERVAL = 1, 0.1
+    try:
+        with tempfile.TemporaryDirectory() as spool_dir:
+            queue = JobQueue(spool_dir)
+            job_id, = submit_jobs(queue, 1)
+            stolen = []
+
+            def process(queue, job, progress):
+                progress(0, 1)
+                deadline = time.time() + 2 * config.JOB_STALE_AFTER
+                while time.time() < deadline:
+                    if queue.claim("other") is not None:
+                        stolen.append(job["job_id"])
+                    time.sleep(0.2)
+                progress(1)
+
+            worker = JobWorker(queue, process, poll_interval=0.05)
+            worker.start()
+            for _ in range(100):
+                if queue.get(job_id)["status"] == DONE:
+                    break
+                time.sleep(0.1)
+            worker.stop()
+            assert not stolen, "A job was requeued while its worker was running it"
+            job = queue.get(job_id)
+            assert job["status"] == DONE and job["attempts"] == 1, job
+    finally:
+        config.JOB_STALE_AFTER, config.JOB_HEARTBEAT_INTERVAL = stale_after, heartbeat_interval
+
+if __name__ == "__main__":
+    test_claim_each_job_once()
+    test_claim_order_and_finish()
+    test_requeue_stale_jobs()
+    test_fail_after_max_attempts()
+    test_release_keeps_attempts()
+    test_worker_heartbeat_covers_slow_pages()
+    print("Job queue tests passed")
@@ -0,0 +1,96 @@
+import os
+import sys
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from utility import metrics
+
+def test_counter():
+    """
+    Counters render one sample per label set, sorted, with the HELP and TYPE lines first
+    """
+    counter = metrics.Counter("test_requests_total", "Requests per endpoint", ("endpoint", "mode"))
+    counter.inc(endpoint="/pdf", mode="bbox")
+    counter.inc(2, endpoint="/image", mode="extract")
+    counter.inc(0.5, endpoint="/pdf", mode="bbox")
+    assert counter.render() == [
+        "# HELP test_requests_total Requests per endpoint",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{endpoint="/image",mode="extract"} 2',
+        'test_requests_total{endpoint="/pdf",mode="bbox"} 1.5',
+    ], counter.render()
+
+    unlabeled = metrics.Counter("test_pages_total", "Pages")
+    unlabeled.inc(3)
+    assert unlabeled.render()[2:] == ["test_pages_total 3"]
+    try:
+        counter.inc(endpoint="/pdf")
+        raise AssertionError("A sample without all of the labels was accepted")
+    except ValueError:
+        pass
+
+def test_histogram():
+    """
+    Histograms render cumulative buckets up to +Inf, with a value on a bound counted in that bucket,
+    then the sum and count of every label set
+    """
+    histogram = metrics.Histogram("test_stage_seconds", "Time per stage", ("stage",), buckets=(0.5, 0.1, 1.0))
+    for value in (0.05, 0.1, 0.7, 3.0):
+        histogram.observe(value, stage="decode")
+    histogram.observe(0.2, stage="crop")
+    assert histogram.render()[2:] == [
+        'test_stage_seconds_bucket{stage="crop",le="0.1"} 0',
+        'test_stage_seconds_bucket{stage="crop",le="0.5"} 1',
+        'test_stage_seconds_bucket{stage="crop",le="1.0"} 1',
+        'test_stage_seconds_bucket{stage="crop",le="+Inf"} 1',
+        'test_stage_seconds_sum{stage="crop"} 0.2',
+        'test_stage_seconds_count{stage="crop"} 1',
+        'test_stage_seconds_bucket{stage="decode",le="0.1"} 2',
+        'test_stage_seconds_bucket{stage="decode",le="0.5"} 2',
+        'test_stage_seconds_bucket{stage="decode",le="1.0"} 3',
+        'test_stage_seconds_bucket{stage="decode",le="+Inf"} 4',
+        'test_stage_seconds_sum{stage="decode"} 3.85',
+        'test_stage_seconds_count{stage="decode"} 4',
+    ], histogram.render()
+    assert histogram.render()[1] == "# TYPE test_stage_seconds histogram"
+
+def test_gauge():
+    """
+    Gauges read their value when rendered
+    """
+    depth = [4]
+    gauge = metrics.Gauge("test_queue_depth", "Waiting requests", lambda: depth[0])
+    assert gauge.render() == ["# HELP test_queue_depth Waiting requests", "# TYPE test_queue_depth gauge", "test_queue_depth 4"]
+    depth[0] = 0.25
+    assert gauge.render()[2] == "test_queue_depth 0.25"
+
+def test_label_escaping():
+    """
+    Backslashes, double quotes and newlines in label values are escaped
+    """
+    counter = metrics.Counter("test_escaped_total", "Escaped labels", ("path",))
+    counter.inc(path='C:\\pages\\"scan"\nnext')
+    assert counter.render()[2] == 'test_escaped_total{path="C:\\\\pages\\\\\\"scan\\"\\nnext"} 1', counter.render()[2]
+
+def test_render_registry():
+    """
+    `render` lists every registered metric, the service metrics included, and ends with a newline
+    """
+    counter = metrics.Counter("test_rendered_total", "Rendered")
+    counter.inc()
+    text = metrics.render()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert "test_rendered_total 1" in lines
+    assert "# TYPE imgextract_stage_seconds histogram" in lines
+    assert "# TYPE imgextract_requests_total counter" in lines
+
+if __name__ == "__main__":
+    test_counter()
+    test_histogram()
+    test_gauge()
+    test_label_escaping()
+    test_render_registry()
+    print("Metrics tests passed")
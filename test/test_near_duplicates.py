@@ -0,0 +1,99 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.near_duplicates import NearDuplicateIndex
+
+DETECTIONS = [{"box": [100.0, 200.0, 300.0, 400.0], "score": 0.9, "class": 0}]
+
+def drawing_page(seed: int, height: int = 1100, width: int = 850) -> np.ndarray:
+    """
+    A white page with a few random black rectangles and lines, standing in for a drawing sheet
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    for _ in range(12):
+        x, y = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 200))
+        w, h = int(rng.integers(40, 200)), int(rng.integers(40, 200))
+        cv2.rectangle(page, (x, y), (x + w, y + h), (0, 0, 0), -1 if rng.random() < 0.5 else 6)
+    return page
+
+def index_page(index: NearDuplicateIndex, page: np.ndarray, results: list = DETECTIONS):
+    index.add(index.hash(page), page.shape[0], page.shape[1], results)
+
+def lookup(index: NearDuplicateIndex, page: np.ndarray):
+    return index.lookup(index.hash(page), page.shape[0], page.shape[1])
+
+def test_rescaled_page_reuses_detections():
+    """
+    The same page rasterized at another resolution gets the indexed detections, rescaled to its size
+    """
+    index = NearDuplicateIndex(max_distance=12, max_entries=10)
+    page = drawing_page(0)
+    index_page(index, page)
+    smaller = cv2.resize(page, (425, 550), interpolation=cv2.INTER_AREA)
+    results = lookup(index, smaller)
+    assert results is not None, "A rescaled page was not found"
+    assert np.allclose(results[0]["box"], [50.0, 100.0, 150.0, 200.0]), results
+    # the indexed detections are not modified
+    assert DETECTIONS[0]["box"] == [100.0, 200.0, 300.0, 400.0]
+    assert index.stats()["hits"] == 1
+
+def test_recompressed_page_reuses_detections():
+    """
+    The same page blurred and compressed again is still a near-duplicate
+    """
+    index = NearDuplicateIndex(max_distance=12, max_entries=10)
+    page = drawing_page(0)
+    index_page(index, page)
+    blurred = cv2.GaussianBlur(page, (5, 5), 0)
+    recompressed = cv2.imdecode(cv2.imencode(".jpg", blurred, [cv2.IMWRITE_JPEG_QUALITY, 60])[1], cv2.IMREAD_COLOR)
+    assert lookup(index, recompressed) == DETECTIONS
+
+def test_different_pages_miss():
+    """
+    Other pages, and the same page at another aspect ratio, are not near-duplicates
+    """
+    index = NearDuplicateIndex(max_distance=12, max_entries=10)
+    page = drawing_page(0)
+    index_page(index, page)
+    assert lookup(index, drawing_page(1)) is None
+    stretched = cv2.resize(page, (850, 1300), interpolation=cv2.INTER_AREA)
+    assert lookup(index, stretched) is None
+    assert lookup(NearDuplicateIndex(max_distance=12, max_entries=10), page) is None
+    assert index.stats()["misses"] == 2
+
+def test_closest_page_wins():
+    """
+    Among several indexed pages within the distance, the closest one is returned
+    """
+    index = NearDuplicateIndex(max_distance=256, max_entries=10)
+    for seed in range(5):
+        index_page(index, drawing_page(seed), [{**DETECTIONS[0], "class": seed}])
+    assert lookup(index, drawing_page(3))[0]["class"] == 3
+
+def test_oldest_entries_replaced():
+    """
+    Once full, the index replaces its oldest pages first
+    """
+    index = NearDuplicateIndex(max_distance=0, max_entries=2)
+    pages = [drawing_page(seed) for seed in range(3)]
+    for page in pages:
+        index_page(index, page)
+    assert index.stats()["entries"] == 2
+    assert lookup(index, pages[0]) is None
+    assert lookup(index, pages[1]) is not None and lookup(index, pages[2]) is not None
+
+if __name__ == "__main__":
+    test_rescaled_page_reuses_detections()
+    test_recompressed_page_reuses_detections()
+    test_different_pages_miss()
+    test_closest_page_wins()
+    test_oldest_entries_replaced()
+    print("Near-duplicate index tests passed")
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from app.executor import PixelBudget, QueueFullError
+
+async def wait_waiting(budget: PixelBudget, waiting: int):
+    while budget.stats()["waiting"] < waiting:
+        await asyncio.sleep(0.001)
+
+def test_fifo_order():
+    """
+    Requests are admitted in arrival order: a small request does not overtake a large one waiting before it
+    """
+    async def scenario():
+        budget = PixelBudget(max_pixels=100, max_wait=5, max_waiting=10)
+        admitted = []
+
+        async def request(name: str, pixels: int):
+            await budget.acquire(pixels)
+            admitted.append(name)
+
+        await request("first", 60)
+        large = asyncio.ensure_future(request("large", 60))
+        await wait_waiting(budget, 1)
+        small = asyncio.ensure_future(request("small", 10))
+        await wait_waiting(budget, 2)
+        await asyncio.sleep(0.05)
+        assert admitted == ["first"], admitted
+
+        budget.release(60)
+        await asyncio.gather(large, small)
+        assert admitted == ["first", "large", "small"], admitted
+        assert budget.stats()["pixels_in_use"] == 70 and budget.stats()["admitted"] == 2
+
+    asyncio.run(scenario())
+
+def test_oversized_request_runs_alone():
+    """
+    A request larger than the whole budget is admitted once nothing else is
+    """
+    async def scenario():
+        budget = PixelBudget(max_pixels=100, max_wait=5, max_waiting=10)
+        await budget.acquire(500)
+        waiting = asyncio.ensure_future(budget.acquire(1))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        budget.release(500)
+        await waiting
+        oversized = asyncio.ensure_future(budget.acquire(500))
+        await asyncio.sleep(0.05)
+        assert not oversized.done()
+        budget.release(1)
+        await oversized
+
+    asyncio.run(scenario())
+
+def test_timeout_and_queue_limit():
+    """
+    Requests are rejected once `max_waiting` are waiting, or after waiting `max_wait` seconds, leaving the budget as it was
+    """
+    async def scenario():
+        budget = PixelBudget(max_pixels=100, max_wait=0.2, max_waiting=1)
+        await budget.acquire(100)
+        waiting = asyncio.ensure_future(budget.acquire(50))
+        await wait_waiting(budget, 1)
+        try:
+            await budget.acquire(10)
+            raise AssertionError("A request past max_waiting was queued")
+        except QueueFullError:
+            pass
+        try:
+            await waiting
+            raise AssertionError("A request waited past max_wait")
+        except QueueFullError:
+            pass
+        stats = budget.stats()
+        assert stats == {"pixels_in_use": 100, "max_pixels": 100, "admitted": 1, "waiting": 0, "rejected": 2}, stats
+
+    asyncio.run(scenario())
+
+def test_removed_head_lets_next_in():
+    """
+    When the request at the head of the line gives up, the requests behind it that fit are admitted
+    """
+    async def scenario():
+        budget = PixelBudget(max_pixels=100, max_wait=5, max_waiting=10)
+        await budget.acquire(60)
+        large = asyncio.ensure_future(budget.acquire(60))
+        await wait_waiting(budget, 1)
+        small = asyncio.ensure_future(budget.acquire(10))
+        await wait_waiting(budget, 2)
+
+        large.cancel()
+        await asyncio.wait_for(small, timeout=1)
+        assert large.cancelled()
+        assert budget.stats()["pixels_in_use"] == 70 and budget.stats()["waiting"] == 0
+
+    asyncio.run(scenario())
+
+def test_release_from_another_thread():
+    """
+    Pixels released from an executor thread wake up a request waiting on the event loop
+    """
+    async def scenario():
+        budget = PixelBudget(max_pixels=100, max_wait=5, max_waiting=10)
+        await budget.acquire(100)
+        waiting = asyncio.ensure_future(budget.acquire(100))
+        await wait_waiting(budget, 1)
+        await asyncio.get_running_loop().run_in_executor(None, budget.release, 100)
+        await asyncio.wait_for(waiting, timeout=1)
+        assert budget.stats()["pixels_in_use"] == 100
+
+    asyncio.run(scenario())
+
+if __name__ == "__main__":
+    test_fifo_order()
+    test_oversized_request_runs_alone()
+    test_timeout_and_queue_limit()
+    test_removed_head_lets_next_in()
+    test_release_from_another_thread()
+    print("Pixel budget tests passed")
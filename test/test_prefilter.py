@@ -0,0 +1,95 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.prefilter import PAGE_BLANK, PAGE_CANDIDATE, PAGE_TEXT, PageFilter, classify_page
+
+# an A4 page at 300 dpi
+HEIGHT, WIDTH = 3508, 2480
+
+def blank_page(noise: bool = False) -> np.ndarray:
+    page = np.full((HEIGHT, WIDTH, 3), 255, dtype=np.uint8)
+    if noise:
+        # scan specks, each smaller than a glyph
+        rng = np.random.default_rng(0)
+        for x, y in zip(rng.integers(0, WIDTH, 300), rng.integers(0, HEIGHT, 300)):
+            page[y:y + 2, x:x + 2] = 0
+    return page
+
+def text_page(top: int = 300, bottom: int = HEIGHT - 300) -> np.ndarray:
+    """
+    A page of claims: lines of text between `top` and `bottom`
+    """
+    page = blank_page()
+    for y in range(top, bottom, 70):
+        cv2.putText(page, "1. A method as claimed in claim 2, wherein the", (250, y), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    return page
+
+def drawing_page() -> np.ndarray:
+    """
+    A drawing sheet: a few outlined shapes connected by leader lines, with reference numerals
+    """
+    page = blank_page()
+    cv2.rectangle(page, (400, 500), (1400, 1300), (0, 0, 0), 6)
+    cv2.circle(page, (1800, 2200), 350, (0, 0, 0), 6)
+    cv2.line(page, (1400, 1300), (1600, 1900), (0, 0, 0), 4)
+    for number, (x, y) in zip(("10", "12", "14"), ((300, 450), (1550, 1350), (2000, 1750))):
+        cv2.putText(page, number, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    return page
+
+def test_blank_pages():
+    """
+    Empty pages and pages with only scan specks are blank
+    """
+    assert classify_page(blank_page()) == PAGE_BLANK
+    assert classify_page(blank_page(noise=True)) == PAGE_BLANK
+
+def test_text_page():
+    """
+    A page of text lines, in colour or gray, is text only
+    """
+    page = text_page()
+    assert classify_page(page) == PAGE_TEXT
+    gray = cv2.cvtColor(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    assert classify_page(gray) == PAGE_TEXT
+    # dark blue text is still ink
+    blue = page.copy()
+    blue[np.all(page == 0, axis=2)] = (120, 0, 0)
+    assert classify_page(blue) == PAGE_TEXT
+
+def test_drawing_pages():
+    """
+    Drawings, and text pages with a drawing or a table rule, are candidates
+    """
+    assert classify_page(drawing_page()) == PAGE_CANDIDATE
+
+    with_drawing = text_page(bottom=HEIGHT // 2)
+    cv2.rectangle(with_drawing, (500, 2200), (1900, 3200), (0, 0, 0), 5)
+    assert classify_page(with_drawing) == PAGE_CANDIDATE
+
+    with_rule = text_page()
+    cv2.line(with_rule, (250, 1500), (2200, 1500), (0, 0, 0), 3)
+    assert classify_page(with_rule) == PAGE_CANDIDATE
+
+def test_page_filter_counts():
+    """
+    `PageFilter` only keeps candidate pages and counts the skipped ones per class
+    """
+    page_filter = PageFilter()
+    assert not page_filter.has_candidates(blank_page())
+    assert not page_filter.has_candidates(text_page())
+    assert page_filter.has_candidates(drawing_page())
+    assert page_filter.stats() == {"pages": 3, "skipped": 2, "skipped_blank": 1, "skipped_text": 1, "skip_rate": 0.6667}
+
+if __name__ == "__main__":
+    test_blank_pages()
+    test_text_page()
+    test_drawing_pages()
+    test_page_filter_counts()
+    print("Prefilter tests passed")
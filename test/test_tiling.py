@@ -0,0 +1,89 @@
+import os
+import sys
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.tiling import cut_by_seam, merge_detections, tile_grid
+
+def detection(box: list, score: float, cls: int = 0) -> dict:
+    return {"box": box, "score": score, "class": cls}
+
+def test_tile_grid_covers_page():
+    """
+    Tiles overlap by at least `overlap`, cover the whole page and the last ones are aligned to its borders
+    """
+    tiles = tile_grid(2500, 3000, tile_size=1024, overlap=128)
+    assert all(xmax - xmin == 1024 and ymax - ymin == 1024 for xmin, ymin, xmax, ymax in tiles)
+    assert max(tile[2] for tile in tiles) == 3000 and max(tile[3] for tile in tiles) == 2500
+    xs = sorted({tile[0] for tile in tiles})
+    assert all(previous + 1024 - start >= 128 for previous, start in zip(xs, xs[1:])), xs
+    assert tile_grid(500, 800, tile_size=1024, overlap=128) == [(0, 0, 800, 500)]
+    try:
+        tile_grid(2500, 3000, tile_size=1024, overlap=1024)
+        raise AssertionError("An overlap as large as the tile was accepted")
+    except ValueError:
+        pass
+
+def test_cut_by_seam():
+    """
+    Boxes touching an inner edge of their tile are cut, boxes touching the page border are not
+    """
+    tile = (1000, 0, 2000, 1000)
+    height, width = 1000, 2000
+    assert cut_by_seam([1005, 100, 1500, 500], tile, height, width)       # left edge, inside the page
+    assert not cut_by_seam([1100, 100, 1500, 500], tile, height, width)   # away from the edges
+    assert not cut_by_seam([1500, 100, 1998, 500], tile, height, width)   # right edge is the page border
+    assert not cut_by_seam([1100, 2, 1500, 998], tile, height, width)     # top and bottom are page borders
+    assert cut_by_seam([100, 100, 995, 500], (0, 0, 1000, 1000), height, width)
+
+def test_merge_nms():
+    """
+    NMS keeps the highest scoring detection of overlapping ones of the same class
+    """
+    merged = merge_detections([
+        detection([0, 0, 100, 100], 0.8),
+        detection([10, 10, 90, 90], 0.9),           # inside the first
+        detection([10, 10, 90, 90], 0.7, cls=1),    # another class
+        detection([300, 300, 400, 400], 0.6),       # elsewhere
+    ], [False] * 4, method="nms")
+    assert [(result["score"], result["class"]) for result in merged] == [(0.9, 0), (0.7, 1), (0.6, 0)], merged
+    assert merged[0]["box"] == [10, 10, 90, 90]
+
+def test_merge_fusion_across_seam():
+    """
+    Pieces of a drawing cut by a seam are fused with each other and with the boxes mostly inside them, chains included
+    """
+    results = [
+        detection([600, 100, 1024, 400], 0.7),      # left piece, cut by the right edge of its tile
+        detection([1000, 120, 1400, 380], 0.8),     # right piece, cut by the left edge of the next tile
+        detection([1250, 150, 1450, 350], 0.5),     # mostly inside the right piece
+        detection([2000, 2000, 2100, 2100], 0.9),   # unrelated
+    ]
+    merged = merge_detections(results, [True, True, False, False], method="fusion")
+    assert len(merged) == 2, merged
+    assert merged[0] == detection([2000.0, 2000.0, 2100.0, 2100.0], 0.9)
+    assert merged[1] == detection([600.0, 100.0, 1450.0, 400.0], 0.8), merged[1]
+
+    # pieces overlapping this little are only matched when cut by a seam
+    assert len(merge_detections(results[:2], [False, False], method="fusion")) == 2
+
+def test_merge_arguments():
+    """
+    No detections merge to none, and unknown merge methods are rejected
+    """
+    assert merge_detections([], []) == []
+    try:
+        merge_detections([detection([0, 0, 1, 1], 0.5)], [False], method="average")
+        raise AssertionError("An unknown merge method was accepted")
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    test_tile_grid_covers_page()
+    test_cut_by_seam()
+    test_merge_nms()
+    test_merge_fusion_across_seam()
+    test_merge_arguments()
+    print("Tiling tests passed")
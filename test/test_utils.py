@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import sys
+import zipfile
+
+import cv2
+import numpy as np
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import utility.config as config
+from utility.utils import get_images, stream_zip
+
+def sample_images(count: int) -> list:
+    rng = np.random.default_rng(0)
+    return [(f"image_{i}.png", rng.integers(0, 256, (20 + i, 30, 3), dtype=np.uint8)) for i in range(count)]
+
+def test_stream_zip_entries_in_order():
+    """
+    Every image is written to the zip, in input order and losslessly, more images than the encoding threads hold at once
+    """
+    images = sample_images(4 * config.ENCODE_WORKERS + 3)
+    data = b"".join(stream_zip(iter(images), manifest=True))
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        names = zip_file.namelist()
+        assert names == [name for name, _ in images] + ["manifest.json"], names
+        for name, image in images:
+            decoded = cv2.imdecode(np.frombuffer(zip_file.read(name), np.uint8), cv2.IMREAD_COLOR)
+            assert np.array_equal(decoded, image), f"{name} does not round-trip"
+        manifest = json.loads(zip_file.read("manifest.json"))
+    assert [(entry["height"], entry["width"]) for entry in manifest["images"]] == [image.shape[:2] for _, image in images]
+
+def test_stream_zip_format():
+    """
+    Entries take the extension of the output format, and images that are None are skipped
+    """
+    images = sample_images(2) + [("missing.png", None)]
+    data = b"".join(stream_zip(images, image_format="jpeg"))
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert zip_file.namelist() == ["image_0.jpg", "image_1.jpg"], zip_file.namelist()
+
+def test_stream_zip_rejects_bad_quality_upfront():
+    """
+    An invalid quality fails before anything is streamed
+    """
+    chunks = stream_zip(sample_images(1), image_format="jpeg", quality=0)
+    try:
+        next(chunks)
+        raise AssertionError("An invalid JPEG quality was accepted")
+    except ValueError:
+        pass
+
+def test_get_images_rounds_outwards_and_skips_empty():
+    """
+    Boxes are rounded outwards to whole pixels and clamped to the image; boxes with no pixels in it are skipped
+    """
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    crops = get_images(image, [
+        [10.2, 5.7, 10.9, 6.1],             # sub-pixel box
+        [30, 30, 30, 60],                   # zero width
+        [-5, -5, 300, 300],                 # past the borders
+        {"box": [190.5, 90.5, 250, 120]},   # detection dict
+        [250, 10, 260, 20],                 # outside the image
+    ])
+    assert [crop.shape for crop in crops] == [(2, 1, 3), (100, 200, 3), (10, 10, 3)], [crop.shape for crop in crops]
+    # crops are views, and every one of them can be encoded
+    assert all(np.shares_memory(crop, image) for crop in crops)
+    data = b"".join(stream_zip((f"{i}.png", crop) for i, crop in enumerate(crops)))
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        assert len(zip_file.namelist()) == 3
+
+if __name__ == "__main__":
+    test_stream_zip_entries_in_order()
+    test_stream_zip_format()
+    test_stream_zip_rejects_bad_quality_upfront()
+    test_get_images_rounds_outwards_and_skips_empty()
+    print("Utility tests passed")
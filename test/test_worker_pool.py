@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+# python does not automatically find parent directory
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from inference.worker_pool import WorkerError, WorkerPool
+
+KILL = 99
+
+class FakePredictor:
+    """
+    Stands in for the model: returns the first pixel of every image and the pid of the worker,
+    and kills its worker in the middle of a batch holding an image that starts with `KILL`
+    """
+    batched = True
+
+    def predict_batch(self, images: list) -> list:
+        if any(image[0, 0, 0] == KILL for image in images):
+            os._exit(1)
+        return [[{"value": int(image[0, 0, 0]), "pid": os.getpid()}] for image in images]
+
+def fake_predictor() -> FakePredictor:
+    return FakePredictor()
+
+def page(value: int) -> np.ndarray:
+    return np.full((32, 24, 3), value, dtype=np.uint8)
+
+def submit(pool: WorkerPool, images: list) -> Future:
+    """
+    Runs a batch on a daemon thread, so that a batch that never returns fails the test instead of hanging it
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(pool.run_batch(images))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def shared_memory_segments() -> set:
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+def test_killed_worker_is_replaced():
+    """
+    A worker dying mid-batch fails that batch with `WorkerError` instead of hanging it, a replacement
+    worker serves the next batches, and no shared memory segment is left behind
+    """
+    segments_before = shared_memory_segments()
+    pool = WorkerPool(2, threads_per_worker=1, load_predictor=fake_predictor)
+    try:
+        assert pool.wait_ready(timeout=60), "The workers did not start"
+        results = pool.run_batch([page(1), page(2)])
+        assert [result[0]["value"] for result in results] == [1, 2], results
+        pids = {process.pid for process in pool._processes}
+
+        error = submit(pool, [page(3), page(KILL)]).exception(timeout=60)
+        assert isinstance(error, WorkerError), error
+        assert shared_memory_segments() <= segments_before, "The segments of the failed batch were not unlinked"
+
+        assert pool.wait_ready(timeout=120), "The replacement worker did not start"
+        served_by = set()
+        for value in range(4, 8):
+            results = submit(pool, [page(value)]).result(timeout=60)
+            assert results[0][0]["value"] == value, results
+            served_by.add(results[0][0]["pid"])
+        assert len(served_by) == 2 and served_by - pids, f"Batches were served by {served_by}, the original workers were {pids}"
+    finally:
+        pool.shutdown()
+    assert not any(process.is_alive() for process in pool._processes)
+    assert shared_memory_segments() <= segments_before, "Shared memory segments were left after shutdown"
+
+if __name__ == "__main__":
+    test_killed_worker_is_replaced()
+    print("Worker pool tests passed")
@@ -2,29 +2,35 @@ import json
 import os
 import random
 import sys
-from PIL import Image
 
 # python does not automatically find parent directory
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
 from inference.inference import inference_image
-from utility.utils import compare_detections
+from utility.utils import compare_detections, read_image
 from utility.config import TEST_IMAGE_DIR, TEST_JSON_PATH, BBOX_DIFF_THRESH, SCORE_DIFF_THRESH
 
-def test_all_entries():
+def validate_entries(predict, test_data: dict = None) -> list:
     """
-    Test all images in the test directory against ground truth
+    Compare the detections of `predict` with the ground truth of every test image
+    Args:
+        predict: Callable taking a BGR image and returning its detections (or None)
+        test_data: Ground truth per image file name, loaded from TEST_JSON_PATH if not given
+    Returns:
+        list: File names of the images whose detections don't match ground truth
     """
-    with open(TEST_JSON_PATH, 'r') as fp:
-        TEST_DATA = json.load(fp)
-    
-    for image_fname in TEST_DATA:
+    if test_data is None:
+        with open(TEST_JSON_PATH, 'r') as fp:
+            test_data = json.load(fp)
+
+    failures = []
+    for image_fname in test_data:
         image_path = os.path.join(TEST_IMAGE_DIR, image_fname)
-        image = Image.open(image_path).convert("RGB")
+        image = read_image(image_path)
         
         # Get predictions
-        results = inference_image(image, draw=False)
+        results = predict(image)
         if results is None:
             results = []
         
@@ -33,16 +39,27 @@ def test_all_entries():
         scores1 = [result["score"] for result in results]
         
         # Get ground truth
-        boxes2 = TEST_DATA[image_fname]['boxes']
-        scores2 = TEST_DATA[image_fname]['scores']
+        boxes2 = test_data[image_fname]['boxes']
+        scores2 = test_data[image_fname]['scores']
         
-        assert compare_detections(
+        if len(boxes1) != len(boxes2) or not compare_detections(
             boxes1, boxes2, 
             scores1, scores2,
             bbox_diff_th=BBOX_DIFF_THRESH,
             score_diff_th=SCORE_DIFF_THRESH
-        ), f"Detections for {image_fname} don't match ground truth"
-        print(f"Test passed for {image_fname}")
+        ):
+            print(f"Test failed for {image_fname}")
+            failures.append(image_fname)
+        else:
+            print(f"Test passed for {image_fname}")
+    return failures
+
+def test_all_entries():
+    """
+    Test all images in the test directory against ground truth
+    """
+    failures = validate_entries(lambda image: inference_image(image, draw=False))
+    assert not failures, f"Detections for {failures} don't match ground truth"
 
 def test_single_entry():
     """
@@ -53,7 +70,7 @@ def test_single_entry():
     
     image_fname = random.choice(sorted(TEST_DATA.keys()))
     image_path = os.path.join(TEST_IMAGE_DIR, image_fname)
-    image = Image.open(image_path).convert("RGB")
+    image = read_image(image_path)
     
     # Get predictions
     results = inference_image(image, draw=False)
@@ -81,10 +98,11 @@ def generate_ground_truth():
     Generate ground truth data from test images
     """
     data = {}
-    for image_fname in os.listdir(TEST_IMAGE_DIR):
+    # sorted, so that a regenerated file only differs where the detections changed
+    for image_fname in sorted(os.listdir(TEST_IMAGE_DIR)):
 
         image_path = os.path.join(TEST_IMAGE_DIR, image_fname)
-        image = Image.open(image_path).convert("RGB")
+        image = read_image(image_path)
         
         results = inference_image(image, draw=False)
         if results is None:
@@ -105,5 +123,7 @@ def generate_ground_truth():
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "--generate":
         generate_ground_truth()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--all":
+        test_all_entries()
     else:
         test_single_entry() 
\ No newline at end of file
@@ -5,11 +5,12 @@ import sys
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
-from PIL import Image
+import cv2
 import matplotlib.pyplot as plt
 
 from inference.load_model import get_predictor
 from inference.inference import inference_image
+from utility.utils import read_image
 
 def visualize_inference(image_dir: str = "test/samples"):
     image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.png'))]
@@ -17,7 +18,7 @@ def visualize_inference(image_dir: str = "test/samples"):
     
     for image_file in image_files:
         image_path = os.path.join(image_dir, image_file)
-        image = Image.open(image_path).convert("RGB")
+        image = read_image(image_path)
         
         result_image = inference_image(image, draw=True)
         
@@ -26,7 +27,7 @@ def visualize_inference(image_dir: str = "test/samples"):
             continue
         
         plt.figure(figsize=(12, 8))
-        plt.imshow(result_image)
+        plt.imshow(cv2.cvtColor(result_image, cv2.COLOR_BGR2RGB))
         plt.title(f"Detection Results - {image_file}")
         plt.axis('off')
         plt.show()
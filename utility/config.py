@@ -1,9 +1,10 @@
 import os
-import torch
+import tempfile
 
 
-# Set device based on CUDA availability
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Device the model runs on; `device` is only resolved on first use (see `__getattr__` below)
+# so that importing this module does not import torch
+DEVICE = os.getenv("DEVICE") # "cpu" or "cuda", detected from CUDA availability if not set
 
 SCORE_THRESHOLD = 0.9 # Threshold for filtering out low-confidence predictions
 NMS_THRESHOLD = 0.5 # Threshold for Non-Maximum Suppression (reducing overlapping boxes)
@@ -11,13 +12,134 @@ MODEL_NAME = "model_v2.pth" # Name of the model file
 MODEL_PATH = os.path.join(os.path.dirname(__file__), MODEL_NAME) # Path to the model file
 BASE_CONFIG_PATH = "COCO-Detection/faster_rcnn_R_50_FPN_3x.yaml" # Base configuration file for the model
 NUM_CLASSES = 1 # Number of classes in the COCO dataset (currently 1 - drawing class)
+MODEL_INPUT_MIN_SIZE = int(os.getenv("MODEL_INPUT_MIN_SIZE", 800)) # Images are resized so their shortest edge has this length before the model
+MODEL_INPUT_MAX_SIZE = int(os.getenv("MODEL_INPUT_MAX_SIZE", 1333)) # ... unless their longest edge would exceed this length
+
+# Backend configurations
+BACKEND = os.getenv("INFERENCE_BACKEND", "detectron2") # Runtime serving the model: "detectron2", "torchscript" or "onnxruntime"
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(__file__), "export")) # Directory of the exported models
+TORCHSCRIPT_MODEL_PATH = os.path.join(EXPORT_DIR, "model_v2.ts") # TorchScript export of the model
+ONNX_MODEL_PATH = os.path.join(EXPORT_DIR, "model_v2.onnx") # ONNX export of the model
+QUANTIZATION = os.getenv("QUANTIZATION") # Serve the INT8 model built by inference/quantize.py: "dynamic" or "static" (onnxruntime backend only)
+QUANTIZED_MODEL_PATHS = {
+    "dynamic": os.path.join(EXPORT_DIR, "model_v2.int8-dynamic.onnx"),
+    "static": os.path.join(EXPORT_DIR, "model_v2.int8-static.onnx"),
+}
+
+# Startup configurations
+# (height, width) of the synthetic pages run through the model at startup, portrait and landscape A4
+# at the model input size by default; an empty WARMUP_PAGE_SIZES disables the warm-up passes
+WARMUP_PAGE_SIZES = [tuple(int(edge) for edge in size.split("x")) for size in os.getenv("WARMUP_PAGE_SIZES", "1131x800,800x1131").split(",") if size]
+
+# Batching configurations
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 4)) # Maximum number of images run through the model in one forward pass
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10)) # Maximum time an image waits for a batch to fill up
+
+# Worker pool configurations
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 0)) # Number of inference worker processes, 0 runs the model in the API process
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("INFERENCE_THREADS_PER_WORKER", 0)) # Torch threads per worker, 0 uses the worker's share of cores
+
+# Detection cache configurations
+DETECTION_CACHE_ENABLED = os.getenv("DETECTION_CACHE_ENABLED", "1") == "1" # Reuse detections of identical images
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", 4096)) # Size of the in-memory LRU tier
+DETECTION_CACHE_DIR = os.getenv("DETECTION_CACHE_DIR") # Directory of the on-disk tier, disabled if not set
+
+# Near-duplicate configurations
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "0") == "1" # Reuse detections of near-duplicate pages, see `inference/near_duplicates.py`
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", 12)) # Pages whose hashes differ in at most this many bits are near-duplicates
+NEAR_DUPLICATE_HASH_SIZE = 16 # Pages are hashed on a grid of this size, i.e. 256 bits
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", 20000)) # Number of pages indexed, the oldest are replaced first
+
+# Executor configurations
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", 4)) # Number of threads running decoding, inference and encoding
+EXECUTOR_MAX_QUEUE_DEPTH = int(os.getenv("EXECUTOR_MAX_QUEUE_DEPTH", 16)) # Requests waiting beyond this depth are rejected with 503
+EXECUTOR_RETRY_AFTER = 5 # Seconds clients are asked to wait before retrying a rejected request
+STREAM_BUFFER_SIZE = 8 # Maximum number of streamed items produced ahead of a slow client
+
+# Upload and admission configurations
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") # Directory uploads are spooled to while they are processed, the system temporary directory if not set
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 200 * 1024 * 1024)) # Larger uploaded files are rejected with 413
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_BYTES", 256 * 1024 * 1024)) # Larger request bodies are rejected with 413
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", 64)) # Requests with more images are rejected with 413
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 500)) # Longer PDFs are rejected with 413 by /inference/pdf, they can go through /inference/jobs
+MAX_PAGE_PIXELS = int(os.getenv("MAX_PAGE_PIXELS", 150_000_000)) # Larger images and PDF pages, at the requested resolution, are rejected with 413 (A0 at 300 dpi is 140M)
+REQUEST_MAX_PIXELS = int(os.getenv("REQUEST_MAX_PIXELS", 2_000_000_000)) # Requests decoding or rendering more pixels are rejected with 413
+PROCESS_MAX_PIXELS = int(os.getenv("PROCESS_MAX_PIXELS", 4_000_000_000)) # Pixels of the requests admitted at once, further requests wait for budget
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 30)) # Seconds a request waits for pixel budget before it is rejected with 503
+
+# Output encoding configurations
+ENCODE_FORMATS = ["png", "webp", "jpeg"] # Formats extracted and annotated images can be returned in; webp is lossless
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", 4)) # Number of threads encoding the images of zip responses in parallel
+PNG_COMPRESSION = int(os.getenv("PNG_COMPRESSION", 1)) # Default PNG compression level, 0 (fastest) to 9 (smallest)
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", 90)) # Default JPEG quality, 1 to 100
+
+# PDF rendering configurations
+PDF_DPI = int(os.getenv("PDF_DPI", 300)) # Default resolution PDF pages are rendered at
+PDF_MIN_DPI = 72 # Lowest resolution a request may ask for
+PDF_MAX_DPI = 600 # Highest resolution a request may ask for
+PDF_DETECT_DPI = int(os.getenv("PDF_DETECT_DPI", 150)) # Resolution pages are rendered at for detection, boxes are scaled to the requested dpi; 0 detects at the requested dpi
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 2)) # Number of poppler processes rendering pages in parallel
+PDF_MAX_BUFFERED_PAGES = int(os.getenv("PDF_MAX_BUFFERED_PAGES", 4)) # Maximum number of rendered pages held in memory per PDF
+
+# Tiled inference configurations
+TILING_ENABLED = os.getenv("TILING_ENABLED", "0") == "1" # Run oversized pages as overlapping tiles next to the downscaled whole page
+TILE_MIN_EDGE = int(os.getenv("TILE_MIN_EDGE", 4096)) # Pages whose longest edge exceeds this length are tiled (A4 at 300 dpi is 3508)
+TILE_SIZE = int(os.getenv("TILE_SIZE", 2048)) # Edge length of the tiles, in page pixels
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", 256)) # Overlap of neighbouring tiles, in page pixels
+TILE_MERGE = os.getenv("TILE_MERGE", "fusion") # How detections of the same object on several tiles are merged: "nms" or "fusion", see `inference/tiling.py`
+TILE_MERGE_THRESHOLD = float(os.getenv("TILE_MERGE_THRESHOLD", 0.5)) # Detections whose intersection covers this fraction of the smaller box are merged
+
+# Page pre-filter configurations
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "0") == "1" # Skip the model for blank and text-only PDF pages, once test/prefilter_recall.py shows no recall loss on your documents
+PREFILTER_WIDTH = int(os.getenv("PREFILTER_WIDTH", 1000)) # Maximum width pages are downsampled to before the layout analysis
+PREFILTER_INK_THRESHOLD = int(os.getenv("PREFILTER_INK_THRESHOLD", 160)) # Gray level below which a pixel counts as ink
+PREFILTER_MIN_INK_RATIO = float(os.getenv("PREFILTER_MIN_INK_RATIO", 0.002)) # Pages with less ink than this fraction are blank
+PREFILTER_TALL_FACTOR = float(os.getenv("PREFILTER_TALL_FACTOR", 2.5)) # Components taller than this many glyph heights may be drawings
+PREFILTER_WIDE_FACTOR = float(os.getenv("PREFILTER_WIDE_FACTOR", 8)) # Components wider than this many glyph heights may be drawings
+
+# Job configurations
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "imgextract-jobs")) # Directory of the job queue database, uploaded PDFs and job results; set it to a persistent volume for jobs to survive reboots
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 0)) # Number of job worker threads started with the API; 0 (default) leaves jobs to `python -m app.jobs`, so they don't share the model with interactive requests
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 100)) # Job submissions beyond this many waiting jobs are rejected with 503
+JOB_COUNTS_TIMEOUT = 1.0 # Seconds /inference/ready waits for the job counts before reporting them as unknown
+JOB_POLL_INTERVAL = 1.0 # Seconds an idle job worker waits before checking the queue again
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", 30)) # Seconds between the heartbeats of a running job, well below JOB_STALE_AFTER
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", 300)) # Running jobs without a heartbeat for this many seconds are requeued, e.g. after a restart
+JOB_MAX_ATTEMPTS = 3 # Jobs whose worker stopped responding this many times are marked as failed
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 24 * 3600)) # Seconds finished jobs and their results are kept
+
+# Gradio configurations
+GRADIO_MAX_BATCH_SIZE = int(os.getenv("GRADIO_MAX_BATCH_SIZE", BATCH_MAX_SIZE)) # Maximum number of queued uploads processed together
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", 2)) # Number of batches processed at the same time
+GRADIO_QUEUE_SIZE = int(os.getenv("GRADIO_QUEUE_SIZE", 64)) # Uploads waiting beyond this queue size are rejected
+GRADIO_RESULT_DIR = os.getenv("GRADIO_RESULT_DIR") # Directory of the result zips, a new temporary directory if not set
+GRADIO_RESULT_MAX_BYTES = int(os.getenv("GRADIO_RESULT_MAX_BYTES", 512 * 1024 * 1024)) # Total size of the result zips kept
+GRADIO_RESULT_MAX_AGE = int(os.getenv("GRADIO_RESULT_MAX_AGE", 3600)) # Seconds a result zip is kept
+GRADIO_RESULT_MIN_AGE = 60 # Seconds a result zip is kept at least, so downloads in progress are not cut off
 
 # Test configurations
-THIS_DIR = os.path.realpath(__file__).rpartition('/')[0]
-TEST_DIR = os.path.join(THIS_DIR, "test")
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+TEST_DIR = os.path.join(PROJECT_DIR, "test")
 TEST_IMAGE_DIR = os.path.join(TEST_DIR, "samples")  # Directory containing test images
 TEST_JSON_PATH = os.path.join(TEST_DIR, "ground_truth.json")  # Path to ground truth data
+EVAL_STORE_PATH = os.path.join(TEST_DIR, "predictions.sqlite")  # Raw predictions per image hash and model version
 
 # Test thresholds
 SCORE_DIFF_THRESH = 0.05  # Maximum allowable difference in confidence scores
-BBOX_DIFF_THRESH = 0.05   # Maximum allowable difference in bounding box
\ No newline at end of file
+BBOX_DIFF_THRESH = 0.05   # Maximum allowable difference in bounding box
+
+
+def __getattr__(name: str):
+    """
+    Resolves `device` on first access, after which it is a plain module attribute.
+    """
+    if name == "device":
+        global device
+        if DEVICE:
+            device = DEVICE
+        else:
+            import torch
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        return device
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,172 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# This module collects the service metrics and renders them in the Prometheus text format
+# served on /metrics. Metrics live in this process only; with several uvicorn processes each
+# one is scraped separately.
+#
+#   with metrics.timer("decode"):
+#       image = decode_image(data)
+#   metrics.DETECTIONS.inc(len(results))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from cheap stages (crop, prefilter) to slow PDFs on CPU
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return lines + self._samples()
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. of pages or bytes.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over cumulative buckets, e.g. of stage latencies.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> list:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Current value read from a callback at scrape time, e.g. the queue depth.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self) -> list:
+        return [f"{self.name} {_format_value(self.callback())}"]
+
+
+STAGE_SECONDS = Histogram(
+    "imgextract_stage_seconds",
+    "Time spent per processing stage: upload_read, preflight, decode, pdf_render, pdf_render_region, prefilter, near_duplicate, resize, inference, draw, crop, encode",
+    ("stage",),
+)
+REQUESTS = Counter("imgextract_requests_total", "Requests received per endpoint and mode", ("endpoint", "mode"))
+IMAGES = Counter("imgextract_images_total", "Images and PDF pages sent to inference")
+PAGES = Counter("imgextract_pdf_pages_total", "PDF pages processed, by whether the pre-filter skipped the model", ("skipped",))
+TILES = Counter("imgextract_tiles_total", "Tiles of oversized pages sent to inference")
+DETECTIONS = Counter("imgextract_detections_total", "Boxes detected")
+BYTES_IN = Counter("imgextract_bytes_in_total", "Bytes of uploaded files per endpoint", ("endpoint",))
+BYTES_OUT = Counter("imgextract_bytes_out_total", "Bytes of response bodies per endpoint", ("endpoint",))
+ENCODED_BYTES = Counter("imgextract_encoded_bytes_total", "Bytes of encoded output images per format", ("format",))
+
+
+@contextmanager
+def timer(stage: str):
+    """
+    Time the enclosed block as one observation of `stage` in `STAGE_SECONDS`.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage=stage)
+
+def render() -> str:
+    """
+    Returns all registered metrics in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,218 @@
+import os
+import re
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+import utility.config as config
+from utility import metrics
+from utility.utils import get_logger, to_bgr
+
+logger = get_logger(__name__)
+
+PAGE_SIZE_PATTERN = re.compile(r"^Page\s+\d+\s+size:\s+([\d.]+) x ([\d.]+) pts", re.MULTILINE)
+
+# This module rasterizes PDFs one page at a time.
+# Each page is rendered by its own poppler process, a bounded number of pages are
+# rendered ahead of the consumer, and only those pages are held in memory.
+# Regions of a page (e.g. detected drawings) can be rendered on their own at a higher
+# resolution with pdftoppm's crop options, without rasterizing the rest of the page.
+
+
+def get_page_count(pdf_path: str) -> int:
+    """
+    Get the number of pages of a PDF file.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+
+    Returns:
+        int: Number of pages.
+    """
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+def get_page_sizes(pdf_path: str, num_pages: int) -> list:
+    """
+    Read the page sizes of a PDF file from its metadata with pdfinfo, without rendering anything.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        num_pages (int): Number of pages, see `get_page_count`.
+
+    Returns:
+        list: (width, height) of every page in points (1/72 inch).
+    """
+    command = ["pdfinfo", "-f", "1", "-l", str(num_pages), pdf_path]
+    output = subprocess.run(command, capture_output=True, check=True, text=True, errors="replace").stdout
+    return [(float(width), float(height)) for width, height in PAGE_SIZE_PATTERN.findall(output)]
+
+def render_page(pdf_path: str, page_number: int, dpi: int):
+    """
+    Render a single page of a PDF file.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_number (int): 1-based page number.
+        dpi (int): Rendering resolution.
+
+    Returns:
+        np.ndarray: The rendered page in BGR.
+    """
+    with metrics.timer("pdf_render"):
+        pages = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+        return to_bgr(pages[0])
+
+@contextmanager
+def spooled_pdf(pdf_bytes: bytes):
+    """
+    Writes PDF content to a temporary file for poppler, and removes it afterwards.
+
+    Yields:
+        str: Path to the temporary PDF file.
+    """
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(pdf_bytes)
+        yield pdf_path
+    finally:
+        os.unlink(pdf_path)
+
+def iter_pages(
+    pdf_bytes: bytes,
+    dpi: int = config.PDF_DPI,
+    render_workers: int = config.PDF_RENDER_WORKERS,
+    max_buffered_pages: int = config.PDF_MAX_BUFFERED_PAGES,
+):
+    """
+    Render the pages of a PDF lazily, in order, see `iter_file_pages`.
+
+    Args:
+        pdf_bytes (bytes): Content of the PDF file.
+
+    Yields:
+        tuple: (page_number, np.ndarray) with 1-based page numbers and BGR pages.
+    """
+    with spooled_pdf(pdf_bytes) as pdf_path:
+        yield from iter_file_pages(pdf_path, dpi, render_workers, max_buffered_pages)
+
+def iter_file_pages(
+    pdf_path: str,
+    dpi: int = config.PDF_DPI,
+    render_workers: int = config.PDF_RENDER_WORKERS,
+    max_buffered_pages: int = config.PDF_MAX_BUFFERED_PAGES,
+):
+    """
+    Render the pages of a PDF file lazily, in order.
+
+    Up to `max_buffered_pages` pages are rendered ahead of the consumer across
+    `render_workers` poppler processes, so rendering overlaps with inference
+    while peak memory stays independent of the page count.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        dpi (int): Rendering resolution.
+        render_workers (int): Number of pages rendered in parallel.
+        max_buffered_pages (int): Maximum number of rendered pages waiting for the consumer.
+
+    Yields:
+        tuple: (page_number, np.ndarray) with 1-based page numbers and BGR pages.
+    """
+    pool = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="pdf-render")
+    try:
+        page_count = get_page_count(pdf_path)
+        logger.info(f"[PDF] Rendering {page_count} pages at {dpi} dpi")
+
+        pending = deque()
+        next_page = 1
+        while pending or next_page <= page_count:
+            while next_page <= page_count and len(pending) < max(1, max_buffered_pages):
+                pending.append((next_page, pool.submit(render_page, pdf_path, next_page, dpi)))
+                next_page += 1
+            page_number, future = pending.popleft()
+            yield page_number, future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def render_region(pdf_path: str, page_number: int, dpi: int, region: tuple) -> np.ndarray:
+    """
+    Render a region of a single page of a PDF file with pdftoppm's crop options.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_number (int): 1-based page number.
+        dpi (int): Rendering resolution.
+        region (tuple): (xmin, ymin, xmax, ymax) in pixels of the page rendered at `dpi`.
+
+    Returns:
+        np.ndarray: The rendered region in BGR.
+    """
+    xmin, ymin, xmax, ymax = region
+    command = [
+        "pdftoppm", "-r", str(dpi), "-f", str(page_number), "-l", str(page_number),
+        "-x", str(xmin), "-y", str(ymin), "-W", str(xmax - xmin), "-H", str(ymax - ymin),
+        pdf_path,
+    ]
+    with metrics.timer("pdf_render_region"):
+        # without an output root, pdftoppm writes the page as PPM to stdout
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+        image = cv2.imdecode(np.frombuffer(output, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise RuntimeError(f"pdftoppm returned no image for page {page_number} of {pdf_path}")
+    return image
+
+def render_boxes(pdf_path: str, page_number: int, dpi: int, boxes: list, page_size: tuple, padding: int = 0) -> list:
+    """
+    Render the regions of boxes on a single page of a PDF file at `dpi`.
+
+    Boxes covering most of the area spanned by all of them are rendered together in a single
+    region and cropped from it; otherwise every box is rendered on its own.
+
+    Args:
+        pdf_path (str): Path to the PDF file.
+        page_number (int): 1-based page number.
+        dpi (int): Rendering resolution.
+        boxes (list): [xmin, ymin, xmax, ymax] boxes in pixels of the page rendered at `dpi`.
+        page_size (tuple): (height, width) of the page rendered at `dpi`.
+        padding (int): Pixels added around every box, e.g. to cover the imprecision of boxes
+            detected at a lower resolution.
+
+    Returns:
+        list: One BGR image per box.
+    """
+    height, width = page_size
+    regions = []
+    for xmin, ymin, xmax, ymax in boxes:
+        region = (
+            max(0, int(xmin) - padding),
+            max(0, int(ymin) - padding),
+            min(width, int(np.ceil(xmax)) + padding),
+            min(height, int(np.ceil(ymax)) + padding),
+        )
+        if region[2] > region[0] and region[3] > region[1]:
+            regions.append(region)
+    if not regions:
+        return []
+
+    union = (
+        min(region[0] for region in regions),
+        min(region[1] for region in regions),
+        max(region[2] for region in regions),
+        max(region[3] for region in regions),
+    )
+    union_area = (union[2] - union[0]) * (union[3] - union[1])
+    boxes_area = sum((region[2] - region[0]) * (region[3] - region[1]) for region in regions)
+    if len(regions) == 1 or boxes_area < union_area / 2:
+        return [render_region(pdf_path, page_number, dpi, region) for region in regions]
+
+    image = render_region(pdf_path, page_number, dpi, union)
+    return [
+        image[region[1] - union[1]:region[3] - union[1], region[0] - union[0]:region[2] - union[0]]
+        for region in regions
+    ]
@@ -1,8 +1,20 @@
 import logging
 import io
+import json
+import math
+import os
+import threading
+import time
 import zipfile
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+import cv2
+import numpy as np
 from PIL import Image
+import utility.config as config
+from utility import metrics
 
 def configure_warnings():
     """
@@ -37,45 +49,222 @@ def get_logger(name: str) -> logging.Logger:
         logger.setLevel(logging.INFO)
     return logger
 
-def create_zip(images: list) -> io.BytesIO:
+def decode_image(data: bytes) -> np.ndarray:
     """
-    Create a zip file containing images with bounding boxes drawn on them.
-    
+    Decode an encoded image straight into the contiguous BGR array the model takes.
+
+    Formats OpenCV cannot read fall back to PIL. EXIF orientation is ignored, as PIL does.
+
     Args:
-        images (list): List of tuples containing image filename and image object.
-        
+        data (bytes): Content of the image file.
+
     Returns:
-        io.BytesIO: A BytesIO object containing the zip file.
+        np.ndarray: HxWx3 uint8 image in BGR order.
+    """
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        image = to_bgr(Image.open(io.BytesIO(data)))
+    return image
+
+def read_image(path: str) -> np.ndarray:
+    """
+    Read an image file as a BGR array, see `decode_image`.
+    """
+    with open(path, "rb") as fp:
+        return decode_image(fp.read())
+
+def to_bgr(image: Image) -> np.ndarray:
+    """
+    Convert a PIL image (e.g. a rendered PDF page) to a BGR array.
+    """
+    return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+ENCODE_EXTENSIONS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+def encode_params(image_format: str, quality: int = None) -> list:
+    """
+    OpenCV encoder parameters of an output format.
+
+    Args:
+        image_format (str): One of `config.ENCODE_FORMATS`.
+        quality (int): PNG compression level (0-9) or JPEG quality (1-100); lossless WebP takes none.
+            Defaults to `config.PNG_COMPRESSION` and `config.JPEG_QUALITY`.
+
+    Returns:
+        list: Parameters for `cv2.imencode`.
+
+    Raises:
+        ValueError: If the format is unknown or the quality is out of its range.
+    """
+    if image_format == "png":
+        level = config.PNG_COMPRESSION if quality is None else quality
+        if not 0 <= level <= 9:
+            raise ValueError("PNG compression level must be between 0 and 9")
+        return [cv2.IMWRITE_PNG_COMPRESSION, level]
+    if image_format == "jpeg":
+        level = config.JPEG_QUALITY if quality is None else quality
+        if not 1 <= level <= 100:
+            raise ValueError("JPEG quality must be between 1 and 100")
+        return [cv2.IMWRITE_JPEG_QUALITY, level]
+    if image_format == "webp":
+        if quality is not None:
+            raise ValueError("WebP output is lossless and takes no quality")
+        # OpenCV encodes WebP losslessly for qualities above 100
+        return [cv2.IMWRITE_WEBP_QUALITY, 101]
+    raise ValueError(f"Unknown image format '{image_format}'. Choose from {config.ENCODE_FORMATS}.")
+
+def encode_image(image: np.ndarray, image_format: str = "png", quality: int = None) -> bytes:
+    """
+    Encode a BGR array, or a view into one such as a crop, see `encode_params`.
+    OpenCV releases the GIL while encoding, so images can be encoded on several threads.
+    """
+    with metrics.timer("encode"):
+        ok, encoded = cv2.imencode(ENCODE_EXTENSIONS[image_format], image, encode_params(image_format, quality))
+    if not ok:
+        raise ValueError(f"Failed to encode image as {image_format}")
+    metrics.ENCODED_BYTES.inc(len(encoded), format=image_format)
+    return encoded.tobytes()
+
+encode_pool = None
+encode_pool_lock = threading.Lock()
+
+def get_encode_pool() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide pool of threads encoding zip entries, creating it on first use.
     """
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for filename, image in images:
-            if image is not None:
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='PNG')
-                img_byte_arr.seek(0)
-                zip_file.writestr(filename, img_byte_arr.getvalue())
-    zip_buffer.seek(0)
-    return zip_buffer
+    global encode_pool
+    with encode_pool_lock:
+        if encode_pool is None:
+            encode_pool = ThreadPoolExecutor(max_workers=config.ENCODE_WORKERS, thread_name_prefix="encode")
+        return encode_pool
 
-def get_images(image: Image, bbox: list) -> list:
+class _ZipStreamBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable buffer that collects what `zipfile` writes so it can be
+    handed out in chunks. Being unseekable makes `zipfile` write data descriptors
+    instead of seeking back to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(images, image_format: str = "png", quality: int = None, manifest: bool = False) -> Iterator[bytes]:
+    """
+    Stream a zip file containing images, one entry at a time.
+
+    Images are encoded on the encoding threads (`config.ENCODE_WORKERS`) and written to the zip
+    in input order as soon as they are encoded. At most two images per thread are held pending,
+    so memory stays bounded however many images there are. The encoded images are already
+    compressed, so entries are stored without DEFLATE.
+
+    Args:
+        images (Iterable): Iterable of tuples containing image filename and BGR image array.
+            The file extension is replaced by the one of `image_format`.
+        image_format (str): One of `config.ENCODE_FORMATS`.
+        quality (int): PNG compression level or JPEG quality, see `encode_params`.
+        manifest (bool): Append a `manifest.json` entry with the size in pixels and bytes of every image.
+
+    Yields:
+        bytes: Consecutive chunks of the zip file.
+    """
+    encode_params(image_format, quality)  # fails before anything is streamed
+    extension = ENCODE_EXTENSIONS[image_format]
+    pool = get_encode_pool()
+    max_pending = 2 * config.ENCODE_WORKERS
+    pending = deque()
+    entries = []
+    buffer = _ZipStreamBuffer()
+
+    def write_entry(zip_file: zipfile.ZipFile):
+        filename, (height, width), future = pending.popleft()
+        data = future.result()
+        zip_info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+        zip_info.compress_type = zipfile.ZIP_STORED
+        zip_file.writestr(zip_info, data)
+        entries.append({"filename": filename, "width": width, "height": height, "bytes": len(data)})
+
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+            for filename, image in images:
+                if image is None:
+                    continue
+                filename = os.path.splitext(filename)[0] + extension
+                future = pool.submit(encode_image, image, image_format, quality)
+                pending.append((filename, image.shape[:2], future))
+                while pending and (len(pending) >= max_pending or pending[0][2].done()):
+                    write_entry(zip_file)
+                    yield buffer.drain()
+            while pending:
+                write_entry(zip_file)
+                yield buffer.drain()
+            if manifest:
+                summary = {
+                    "format": image_format,
+                    "images": entries,
+                    "total_bytes": sum(entry["bytes"] for entry in entries),
+                }
+                zip_file.writestr("manifest.json", json.dumps(summary, indent=4), compress_type=zipfile.ZIP_DEFLATED)
+        yield buffer.drain()
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+def get_images(image: np.ndarray, bbox: list) -> list:
     """
     Extract images from the original image based on bounding boxes.
     
     Args:
-        image (Image): The original image.
-        bbox (list): List of bounding boxes to extract images from.
+        image (np.ndarray): The original image.
+        bbox (list): List of bounding boxes, or of detections with a "box" key, to extract images from.
         
     Returns:
-        list: List of extracted images.
+        list: List of extracted images, as views into the original image (no pixels are copied).
+            Boxes are rounded outwards to whole pixels, and boxes with no pixels inside the image
+            are skipped, as empty images cannot be encoded.
     """
+    height, width = image.shape[:2]
     extracted_images = []
-    for box in bbox:
-        xmin, ymin, xmax, ymax = map(int, box)
-        cropped_image = image.crop((xmin, ymin, xmax, ymax))
-        extracted_images.append(cropped_image)
+    with metrics.timer("crop"):
+        for box in bbox:
+            if isinstance(box, dict):
+                box = box["box"]
+            xmin, ymin = (max(0, math.floor(v)) for v in box[:2])
+            xmax, ymax = min(width, math.ceil(box[2])), min(height, math.ceil(box[3]))
+            if xmax <= xmin or ymax <= ymin:
+                continue
+            extracted_images.append(image[ymin:ymax, xmin:xmax])
     return extracted_images
 
+def scale_detections(results: list, scale_x: float, scale_y: float) -> list:
+    """
+    Scale the boxes of detections, e.g. from a resized image back to the original one.
+    
+    Args:
+        results (list): Detections with "box", "score" and "class" keys.
+        scale_x (float): Horizontal scale factor.
+        scale_y (float): Vertical scale factor.
+        
+    Returns:
+        list: New detections with scaled boxes.
+    """
+    scaled = []
+    for result in results:
+        xmin, ymin, xmax, ymax = result["box"]
+        scaled.append({**result, "box": [xmin * scale_x, ymin * scale_y, xmax * scale_x, ymax * scale_y]})
+    return scaled
+
 def compare_detections(boxes1, boxes2, scores1, scores2, bbox_diff_th, score_diff_th):
     """
     Compare two sets of detections to see if they match within thresholds